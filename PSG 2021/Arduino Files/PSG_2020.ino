@@ -44,6 +44,48 @@ int pan_position = 90;
 int tilt_position = 90;
 int fire = 0;                         // if 1, fire; else, don't fire
 
+// Give the servos time to move before firing, otherwise they will be blocked!
+const unsigned long SERVO_SETTLE_MS = 100;
+unsigned long when_moved = 0;
+
+// Baud rate at power up, and how long to wait at a negotiated baud rate
+// without a valid message before going back to it, in case the computer
+// never switched or has gone away
+const long INITIAL_BAUD = 9600;
+const unsigned long NEGOTIATED_BAUD_TIMEOUT_MS = 3000;
+long baud = INITIAL_BAUD;
+unsigned long when_last_message = 0;
+
+// Protocol version 1: 'a', pan and tilt as three ASCII digits, then '0' or '1'
+// for firing
+const byte V1_START = 'a';
+const int V1_LENGTH = 7;
+byte v1_message[V1_LENGTH];
+int v1_received = -1;                 // -1 when not within a message
+
+// Protocol version 2, as psg.py's SerialProtocol: SYNC, then byte stuffed
+// version, type, sequence, length, payload and CRC-16/CCITT-FALSE
+const byte SYNC = 0xA5;
+const byte ESCAPE = 0x7D;
+const byte VERSION = 2;
+const int MAX_PAYLOAD = 32;
+
+const byte MOVE = 0x01;
+const byte HELLO = 0x02;
+const byte PING = 0x03;
+const byte STOP = 0x04;
+const byte ACK = 0x81;
+const byte WELCOME = 0x82;
+
+const byte FIRING = 0x01;
+const byte ACK_REQUESTED = 0x02;
+
+byte v2_body[4 + MAX_PAYLOAD + 2];
+int v2_received = -1;                 // -1 when not within a frame
+bool v2_escaped = false;
+
+const long SUPPORTED_BAUDS[] = { 9600, 19200, 38400, 57600, 115200 };
+
 void setup() {
   pan.attach(panServoPin);             // set up the x axis servo
   tilt.attach(tiltServoPin);           // set up the y axis servo
@@ -53,63 +95,141 @@ void setup() {
 
   pinMode(USBIndicatorLEDPin, OUTPUT);        // set up USB indicator LED
 
-  Serial.begin(9600);                     // start communication with computer
+  Serial.begin(INITIAL_BAUD);             // start communication with computer
 }
 
+// Never waits, so the servos and trigger are always looked after promptly
 void loop() {
-  // Check to see if a new set of commands is available
-  if (Serial.available() < 8) {
-    // Back to waiting...
-    delay(25);
-    return;
+  while (Serial.available() > 0) {
+    receive(Serial.read());
+  }
+
+  if (fire && millis() - when_moved >= SERVO_SETTLE_MS) {
+    Fire();
   }
 
-  // Read first byte in buffer
-  byte indicator = Serial.read();
+  if (baud != INITIAL_BAUD && millis() - when_last_message >= NEGOTIATED_BAUD_TIMEOUT_MS) {
+    switchBaud(INITIAL_BAUD);
+  }
+}
 
-  // Check for 'a' (indicates start of message)
-  if (indicator != 'a') {
-    // We keep looking for the start of the message
+void receive(byte b) {
+  if (b == SYNC) {
+    v1_received = -1;
+    v2_received = 0;
+    v2_escaped = false;
     return;
   }
 
-  // Light up the USB indicator LED to indicate we're processing a message
-  digitalWrite(USBIndicatorLEDPin, HIGH);
+  if (v2_received >= 0) {
+    receiveV2(b);
+    return;
+  }
 
-  // Read the message, byte by byte
-  byte pan100_byte = Serial.read();
-  byte pan010_byte = Serial.read();
-  byte pan001_byte = Serial.read();
-  byte tilt100_byte = Serial.read();
-  byte tilt010_byte = Serial.read();
-  byte tilt001_byte = Serial.read();
-  byte fire_byte = Serial.read();
-
-  // If any of the bytes failed to be read (indicated by Serial.read()
-  // returning -1), we ignore and wait for another 8 bytes
-  if (pan100_byte < 0 || pan010_byte < 0 || pan001_byte < 0 ||
-      tilt100_byte < 0 || tilt010_byte < 0 || tilt001_byte < 0 ||
-      fire_byte < 0) {
-
-    digitalWrite(USBIndicatorLEDPin, LOW);
+  if (b == V1_START) {
+    v1_received = 0;
     return;
   }
 
-  // Decode those message bytes into two 3-digit numbers
+  if (v1_received >= 0) {
+    v1_message[v1_received++] = b;
+
+    if (v1_received == V1_LENGTH) {
+      v1_received = -1;
+      handleV1();
+    }
+  }
+}
+
+void handleV1() {
+  for (int i = 0; i < V1_LENGTH; i++) {
+    if (v1_message[i] < '0' || v1_message[i] > '9') {
+      return;
+    }
+  }
 
+  // Decode those message bytes into two 3-digit numbers
   int updated_pan_position =
-    (100 * ((int)pan100_byte - 48)) +
-    (10  * ((int)pan010_byte - 48)) +
-    (       (int)pan001_byte - 48);
+    (100 * ((int)v1_message[0] - 48)) +
+    (10  * ((int)v1_message[1] - 48)) +
+    (       (int)v1_message[2] - 48);
 
   int updated_tilt_position =
-    (100 * ((int)tilt100_byte - 48)) +
-    (10  * ((int)tilt010_byte - 48)) +
-    (       (int)tilt001_byte - 48);
+    (100 * ((int)v1_message[3] - 48)) +
+    (10  * ((int)v1_message[4] - 48)) +
+    (       (int)v1_message[5] - 48);
+
+  when_last_message = millis();
+
+  command(updated_pan_position, updated_tilt_position, v1_message[6] == '1');
+}
+
+void receiveV2(byte b) {
+  if (b == ESCAPE) {
+    v2_escaped = true;
+    return;
+  }
+
+  if (v2_escaped) {
+    b ^= 0x20;
+    v2_escaped = false;
+  }
+
+  v2_body[v2_received++] = b;
+
+  if (v2_received >= 4 && v2_body[3] > MAX_PAYLOAD) {
+    v2_received = -1;
+  } else if (v2_received >= 4 && v2_received == 4 + v2_body[3] + 2) {
+    int length = v2_received;
+    v2_received = -1;
+
+    uint16_t crc = ((uint16_t)v2_body[length - 2] << 8) | v2_body[length - 1];
+
+    if (v2_body[0] == VERSION && crc16(v2_body, length - 2) == crc) {
+      handleV2(v2_body[1], v2_body[2], v2_body + 4, v2_body[3]);
+    }
+  }
+}
 
-  // Convert byte to integer
-  fire = (int)fire_byte - 48;
+void handleV2(byte type, byte sequence, byte *payload, byte length) {
+  digitalWrite(USBIndicatorLEDPin, HIGH);
+
+  when_last_message = millis();
+
+  if (type == MOVE && length >= 3) {
+    command(payload[0], payload[1], payload[2] & FIRING);
+
+    if (payload[2] & ACK_REQUESTED) {
+      acknowledge(sequence);
+    }
+  } else if (type == PING) {
+    acknowledge(sequence);
+  } else if (type == STOP) {
+    fire = 0;
+    ceaseFire();
+    acknowledge(sequence);
+  } else if (type == HELLO && length >= 4) {
+    long requested = (long)payload[0] | ((long)payload[1] << 8) | ((long)payload[2] << 16) | ((long)payload[3] << 24);
+    long accepted = baud;
+
+    for (unsigned int i = 0; i < sizeof(SUPPORTED_BAUDS) / sizeof(SUPPORTED_BAUDS[0]); i++) {
+      if (SUPPORTED_BAUDS[i] == requested) {
+        accepted = requested;
+      }
+    }
+
+    byte welcome[5] = { VERSION, (byte)accepted, (byte)(accepted >> 8), (byte)(accepted >> 16), (byte)(accepted >> 24) };
+    send(WELCOME, sequence, welcome, sizeof(welcome));
+
+    if (accepted != baud) {
+      switchBaud(accepted);
+    }
+  }
+
+  digitalWrite(USBIndicatorLEDPin, LOW);
+}
 
+void command(int updated_pan_position, int updated_tilt_position, bool updated_fire) {
   if (updated_pan_position != pan_position || updated_tilt_position != tilt_position) {
     pan_position = updated_pan_position;
     tilt_position = updated_tilt_position;
@@ -119,18 +239,68 @@ void loop() {
 
     pan.write(pan_position);
     tilt.write(tilt_position);
+
+    when_moved = millis();
   }
 
-  if (fire) {
-    // Wait to give the servos time to move, otherwise they will be blocked!
-    delay(100);
-    Fire();
-  } else {
+  fire = updated_fire ? 1 : 0;
+
+  // Firing starts from loop(), once the servos have settled
+  if (!fire) {
     ceaseFire();
   }
+}
 
-  digitalWrite(USBIndicatorLEDPin, LOW);
-  delay(50);
+void acknowledge(byte sequence) {
+  byte status[3] = { (byte)pan_position, (byte)tilt_position, (byte)(fire ? FIRING : 0) };
+  send(ACK, sequence, status, sizeof(status));
+}
+
+void send(byte type, byte sequence, byte *payload, byte length) {
+  byte body[4 + MAX_PAYLOAD + 2] = { VERSION, type, sequence, length };
+
+  for (int i = 0; i < length; i++) {
+    body[4 + i] = payload[i];
+  }
+
+  uint16_t crc = crc16(body, 4 + length);
+  body[4 + length] = crc >> 8;
+  body[4 + length + 1] = crc & 0xFF;
+
+  Serial.write(SYNC);
+
+  for (int i = 0; i < 4 + length + 2; i++) {
+    if (body[i] == SYNC || body[i] == ESCAPE || body[i] == V1_START) {
+      Serial.write(ESCAPE);
+      Serial.write(body[i] ^ 0x20);
+    } else {
+      Serial.write(body[i]);
+    }
+  }
+}
+
+void switchBaud(long new_baud) {
+  // Let the last reply go at the old baud rate
+  Serial.flush();
+  Serial.end();
+  Serial.begin(new_baud);
+
+  baud = new_baud;
+  when_last_message = millis();
+}
+
+uint16_t crc16(byte *data, int length) {
+  uint16_t crc = 0xFFFF;
+
+  for (int i = 0; i < length; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+
+    for (int bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+    }
+  }
+
+  return crc;
 }
 
 void Fire() {
@@ -0,0 +1,782 @@
+#!/usr/bin/python3
+
+#
+# Benchmarks for PSG, timing parts of it against recorded video instead of the
+# camera and the turret. They import what they time from psg.py, and read
+# psg.ini, detection.ini and calibration.json from where they are run, as PSG
+# does.
+#
+# Example:
+#
+#   python3 benchmarks.py --video Videos preprocessing
+#   python3 benchmarks.py --video Videos replay --json replay.json
+#
+
+import argparse
+import collections
+import configparser
+import contextlib
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import psg
+from psg import (
+    BlobFinder, Calibration, Colour, DETECTION_ENGINES, DetectionPool, DetectionRegion, FrameCache, FrameRing, Preprocessor,
+    Recording, ScreenCoords, SimpleBlobEngine, Startup, TurretController, TurretControls, VideoFiles, VideoProcessor,
+    configure_logging, made_up_calibration, open_videos, recorded_frames, video_log)
+
+def timing_summary(timings):
+    timings = sorted(timings)
+
+    return (
+        f"mean {1e6 * sum(timings)/len(timings):8.1f} us, "
+        f"p50 {1e6 * timings[len(timings)//2]:8.1f} us, "
+        f"p95 {1e6 * timings[int(0.95 * len(timings))]:8.1f} us")
+
+def benchmark_preprocessing(config, videos):
+    frames = recorded_frames(videos, config.getint("Video", "Width", fallback = 400), 700)
+
+    # The preprocessing stage as it was before Preprocessor, for comparison
+    def threshold_and_invert(img):
+        _, threshed = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+        return cv2.bitwise_not(threshed)
+
+    def original(frame):
+        masked_blue = threshold_and_invert(frame[:,:,0])
+        masked_green = threshold_and_invert(frame[:,:,1])
+        masked_red = threshold_and_invert(frame[:,:,2])
+
+        masked = cv2.bitwise_or(cv2.bitwise_or(masked_blue, masked_green), masked_red)
+        mask = cv2.merge((masked, masked, masked))
+
+        detection_frame = cv2.bitwise_and(frame, mask)
+        hsv_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+
+        return detection_frame
+
+    fused = Preprocessor()
+
+    drift = 0.05
+    reusing = Preprocessor()
+    reusing.configure(True, drift)
+
+    timings = { "original": [], "fused": [], "fused, reusing thresholds": [] }
+    reused_pixels_differing = 0
+
+    for _ in range(3):
+        for frame in frames:
+            started = time.perf_counter()
+            original(frame)
+            timings["original"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            actual = fused.process(frame)
+            timings["fused"].append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            approximate = reusing.process(frame)
+            timings["fused, reusing thresholds"].append(time.perf_counter() - started)
+
+            reused_pixels_differing += np.count_nonzero(approximate != actual)
+
+    print(f"Preprocessing {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]} from {len(videos)} video(s), 3 passes")
+
+    for (name, values) in timings.items():
+        print(f"  {name:<26} {timing_summary(values)}")
+
+    print(f"  Reusing thresholds (drift {drift}): recomputed {reusing.thresholds_computed}, "
+          f"reused {reusing.thresholds_reused}, {100 * reused_pixels_differing / (3 * len(frames) * frames[0][:,:,0].size):.3f}% of pixels differ")
+
+def benchmark_detectors(config, videos):
+    frames = recorded_frames(videos, config.getint("Video", "Width", fallback = 400), 700)
+
+    preprocessor = Preprocessor()
+    images = [ preprocessor.process(frame).copy() for frame in frames ]
+
+    detection_config = configparser.ConfigParser()
+    detection_config.read(BlobFinder.CONFIG_FILE_NAME)
+
+    configured = BlobFinder.detection_parameters(detection_config)
+
+    # The configured filters may find nothing in the recordings, so also time
+    # them with the colour and circularity filters off
+    relaxed = BlobFinder.detection_parameters(detection_config)
+    relaxed.filterByColor = False
+    relaxed.filterByCircularity = False
+
+    print(f"Detecting in {len(images)} frames of {images[0].shape[1]}x{images[0].shape[0]} from {len(videos)} video(s), 3 passes")
+
+    for (name, params) in [ ("configured", configured), ("relaxed", relaxed) ]:
+        engines = [ engine(params, detection_config) for engine in DETECTION_ENGINES.values() ]
+        timings = { engine.NAME: [] for engine in engines }
+        found = { engine.NAME: 0 for engine in engines }
+
+        for _ in range(3):
+            for image in images:
+                for engine in engines:
+                    started = time.perf_counter()
+                    keypoints = engine.detect(image)
+                    timings[engine.NAME].append(time.perf_counter() - started)
+                    found[engine.NAME] += len(keypoints)
+
+        print(f"  {name} parameters")
+
+        for (engine, values) in timings.items():
+            print(f"    {engine:<12} {len(values)/sum(values):8.1f} fps, {timing_summary(values)}, {found[engine] // 3} blobs")
+
+def benchmark_region(config, videos):
+    frames = recorded_frames(videos, config.getint("Video", "Width", fallback = 400), 700)
+    (height, width) = frames[0].shape[:2]
+
+    calibration = Calibration()
+    calibration.load()
+
+    description = f"the grid in {Calibration.CONFIG_FILE}"
+
+    if calibration.grid_outline() is None:
+        # Without a calibration, stand in a grid covering the middle 60% of the frame
+        xs = np.linspace(0.11 * width, 0.89 * width, Calibration.NUM_COLS).round().astype(int)
+        ys = np.linspace(0.11 * height, 0.89 * height, Calibration.NUM_ROWS).round().astype(int)
+
+        calibration.calibrate({
+            "grid": {
+                "x": [ xs.tolist() for _ in ys ],
+                "y": [ [ int(y) ] * len(xs) for y in ys ],
+                "pan": [ 150, 120, 90, 60, 30 ],
+                "tilt": [ 40, 65, 90, 115, 140 ]
+            }
+        }, save = False)
+
+        description = "a grid covering the middle 60% of the frame"
+
+    detection_config = configparser.ConfigParser()
+    detection_config.read(BlobFinder.CONFIG_FILE_NAME)
+
+    print(f"Detecting in {len(frames)} frames of {width}x{height} from {len(videos)} video(s), 3 passes, "
+          f"cropping to {description}")
+
+    for (name, crop, mask) in [ ("whole frame", False, False), ("cropped", True, False), ("cropped and masked", True, True) ]:
+        preprocessor = Preprocessor()
+        detector = BlobFinder.create_detector(detection_config)
+        region = DetectionRegion()
+        region.configure(crop, mask, detection_config.getint("Region", "margin", fallback = 0), [])
+
+        timings = []
+        blobs = 0
+
+        for _ in range(3):
+            for frame in frames:
+                started = time.perf_counter()
+
+                ((x, y, region_width, region_height), _) = region.update(calibration.grid_outline(), frame.shape)
+
+                image = preprocessor.process(frame[y:y + region_height, x:x + region_width])
+                region.apply(image)
+
+                keypoints = region.to_frame(detector.detect(image))
+
+                timings.append(time.perf_counter() - started)
+                blobs += len(keypoints)
+
+        print(f"  {name:<20} {len(timings)/sum(timings):8.1f} fps, {timing_summary(timings)}, {blobs // 3} blobs")
+
+def benchmark_workers(config, videos):
+    frames = recorded_frames(videos, config.getint("Video", "Width", fallback = 400), 700)
+
+    calibration = Calibration()
+    calibration.load()
+
+    outline = calibration.grid_outline()
+
+    print(f"Finding blobs in {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]} from {len(videos)} video(s), "
+          f"as fast as they can be handed over, on {os.cpu_count()} CPU(s)")
+
+    blob_finder = BlobFinder(None)
+
+    started = time.perf_counter()
+
+    for frame in frames:
+        blob_finder.find_blobs(frame, outline)
+
+    baseline = len(frames) / (time.perf_counter() - started)
+
+    print(f"  {'video thread':<12} {baseline:8.1f} fps")
+
+    for workers in range(1, 5):
+        pool = DetectionPool(workers)
+        ring = FrameRing(slots = 2 * workers, shared = True)
+
+        order = []
+        blobs = 0
+
+        def apply(ready):
+            nonlocal blobs
+
+            for ((sequence, slot), found) in ready:
+                order.append(sequence)
+                blobs += len(found[0]) if found else 0
+                ring.abandon(slot)
+
+        # Let the workers start up, and attach to the shared memory, first
+        for (sequence, frame) in enumerate(frames[:workers]):
+            (slot, buffer) = ring.acquire(frame.shape)
+            np.copyto(buffer, frame)
+            pool.submit(-1 - sequence, (-1 - sequence, slot), ring, slot, outline)
+
+        while pool.pending:
+            pool.collect(wait = True)
+
+        for (slot, _) in enumerate(ring.buffers):
+            ring.abandon(slot)
+
+        started = time.perf_counter()
+
+        for (sequence, frame) in enumerate(frames):
+            while pool.busy():
+                apply(pool.collect(wait = True))
+
+            (slot, buffer) = ring.acquire(frame.shape)
+            np.copyto(buffer, frame)
+            pool.submit(sequence, (sequence, slot), ring, slot, outline)
+
+            apply(pool.collect())
+
+        while pool.pending:
+            apply(pool.collect(wait = True))
+
+        fps = len(frames) / (time.perf_counter() - started)
+
+        pool.close()
+        ring.close()
+
+        in_order = order == sorted(order)
+
+        print(f"  {workers} worker(s)  {fps:8.1f} fps, {fps / baseline:4.2f}x, {blobs} blobs, "
+              f"{'in order' if in_order else 'OUT OF ORDER'}, {pool.abandoned} given up on, {pool.discarded} discarded")
+
+def benchmark_colours(config, videos):
+    frames = recorded_frames(videos, config.getint("Video", "Width", fallback = 400), 700)
+
+    turret_controls = TurretControls()
+    turret_controls.set({ "shoot_colours": [ "RED", "YELLOW" ], "safe_colours": [ "GREEN", "BLUE" ] })
+
+    started = time.perf_counter()
+    Colour.table()
+    built = time.perf_counter() - started
+
+    # Stand-ins for keypoints, at the same pixels in each frame
+    random = np.random.default_rng(1)
+    (height, width) = frames[0].shape[:2]
+    points = list(zip(random.integers(0, width, 20), random.integers(0, height, 20)))
+
+    timings = { "per keypoint": [], "lookup table": [], "whole frame": [] }
+    mismatches = 0
+
+    for frame in frames:
+        hsv_points = Preprocessor.hsv_at(frame, points)
+
+        # As BlobFinder used to, one colour and two lookups per keypoint
+        started = time.perf_counter()
+        expected = []
+
+        for point in hsv_points:
+            colour = Colour.classifyHSV(point)
+            expected.append((turret_controls.is_safe_colour(colour), turret_controls.is_shootable_colour(colour)))
+
+        timings["per keypoint"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        categories = turret_controls.colour_categories()[Colour.classify_hsv_array(hsv_points)]
+        safe = (categories & TurretControls.SAFE) != 0
+        shootable = (categories & TurretControls.SHOOTABLE) != 0
+        timings["lookup table"].append(time.perf_counter() - started)
+
+        mismatches += sum(1 for (e, a) in zip(expected, zip(safe, shootable)) if e != a)
+
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+
+        started = time.perf_counter()
+        colours = Colour.classify_hsv_array(hsv)
+        timings["whole frame"].append(time.perf_counter() - started)
+
+        # Spot check the whole frame against classifyHSV
+        mismatches += sum(
+            1 for (pixel, colour) in zip(hsv[::17, ::17].reshape(-1, 3), colours[::17, ::17].ravel())
+            if Colour.classifyHSV(pixel).value != colour)
+
+    print(f"Classifying colours in {len(frames)} frames of {width}x{height} from {len(videos)} video(s), "
+          f"lookup table built in {1000 * built:.1f} ms")
+
+    print(f"  {len(points)} keypoints, per keypoint  {timing_summary(timings['per keypoint'])}")
+    print(f"  {len(points)} keypoints, lookup table  {timing_summary(timings['lookup table'])}")
+    print(f"  every pixel, lookup table    {timing_summary(timings['whole frame'])}")
+    print(f"  Disagreements with classifyHSV: {mismatches}")
+
+def benchmark_calibration(config, videos):
+    width = config.getint("Video", "Width", fallback = 400)
+    height = recorded_frames(videos[:1], width, 1)[0].shape[0]
+
+    calibration = Calibration((width, height))
+    calibration.load()
+
+    description = Calibration.CONFIG_FILE
+
+    if calibration.data is None:
+        calibration.calibrate(made_up_calibration(width, height), save = False)
+
+        description = "a made up grid"
+
+    grid = calibration.calibration()["grid"]
+
+    # As calibrating, or calibration.json changing, compiles it
+    started = time.perf_counter()
+    Calibration((width, height)).calibrate(calibration.calibration(), save = False)
+    compile_time = time.perf_counter() - started
+
+    # calculate_turret_position() as it was before the map, for comparison
+    def original(target):
+        row, col = 0, 0
+
+        while row < Calibration.NUM_ROWS - 2 and col < Calibration.NUM_COLS - 2:
+            if target.y > grid["y"][row+1][col]:
+                row = row + 1
+                continue
+
+            if target.x > grid["x"][row][col+1]:
+                col = col + 1
+                continue
+
+            break
+
+        logging.debug(f"Using grid square ({row}, {col}), with corners "\
+            f"nw ({grid['x'][row][col]}, {grid['y'][row][col]}) "\
+            f"ne ({grid['x'][row][col+1]}, {grid['y'][row][col+1]}) "\
+            f"se ({grid['x'][row+1][col+1]}, {grid['y'][row+1][col+1]}) "\
+            f"sw ({grid['x'][row+1][col]}, {grid['y'][row+1][col]}), "\
+            f"left pan {grid['pan'][col]}, right pan {grid['pan'][col+1]}, "\
+            f"top tilt {grid['tilt'][row]}, bottom tilt {grid['tilt'][row+1]}")
+
+        pan_ratio = (target.x - grid["x"][row][col])/(grid["x"][row][col+1] - grid["x"][row][col])
+        pan_delta = grid["pan"][col] - grid["pan"][col+1]
+
+        logging.debug(f"Pan delta: {pan_delta}, pan ratio: {pan_ratio}")
+
+        pan = grid["pan"][col] - round(pan_ratio * pan_delta)
+
+        tilt_ratio = (target.y - grid["y"][row][col])/(grid["y"][row+1][col] - grid["y"][row][col])
+        tilt_delta = grid["tilt"][row+1] - grid["tilt"][row]
+
+        logging.debug(f"Tilt delta: {tilt_delta}, tilt ratio: {tilt_ratio}")
+
+        tilt = grid["tilt"][row] + round(tilt_ratio * tilt_delta)
+
+        logging.debug(f"Calculated turret position for ({target.x}, {target.y}): pan {pan}, tilt {tilt}")
+
+        return (pan, tilt)
+
+    # Every pixel, some beyond the frame and some between pixels
+    points = [ ScreenCoords(x, y) for y in range(height) for x in range(width) ]
+    points += [ ScreenCoords(x, y) for (x, y) in [ (-20, -20), (width + 50, height + 50), (10.5, 20.25), (width / 3, height / 7) ] ]
+
+    # Debug logging, which psg.log normally records, would dominate otherwise
+    logging.getLogger().setLevel(logging.INFO)
+
+    started = time.perf_counter()
+
+    for point in points:
+        original(point)
+
+    original_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+
+    for point in points:
+        calibration.calculate_turret_position(point)
+
+    single_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    calibration.calculate_turret_positions([ (point.x, point.y) for point in points ])
+    batch_time = time.perf_counter() - started
+
+    print(f"Turret positions for {len(points)} points using {description}, "
+          f"mapped in advance for {width}x{height} in {1000 * compile_time:.1f} ms")
+    print(f"  original           {1e6 * original_time / len(points):6.2f} us per point")
+    print(f"  one point at once  {1e6 * single_time / len(points):6.2f} us per point")
+    print(f"  all points at once {1e6 * batch_time / len(points):6.2f} us per point")
+
+def benchmark_logging(config, videos):
+    frames = recorded_frames(videos, config.getint("Video", "Width", fallback = 400), 700)
+    (height, width) = frames[0].shape[:2]
+
+    # Firing at everything, so that each frame with a blob moves the turret
+    turret_controls = TurretControls()
+    turret_controls.set({
+        "tracking": False,
+        "autofire": True,
+        "alwaysfire": False,
+        "scanwhenidle": False,
+        "shoot_colours": [],
+        "safe_colours": []
+    })
+
+    calibration = Calibration((width, height))
+    calibration.calibrate(made_up_calibration(width, height), save = False)
+
+    # Looser than the usual filters, so that the recorded video has blobs in it
+    blob_finder = BlobFinder(turret_controls)
+    detection_config = configparser.ConfigParser()
+    detection_config.read(BlobFinder.CONFIG_FILE_NAME)
+    params = BlobFinder.detection_parameters(detection_config)
+    params.filterByColor = False
+    params.filterByCircularity = False
+    (_, preprocessor, region) = blob_finder.setup
+    blob_finder.setup = (SimpleBlobEngine(params, detection_config), preprocessor, region)
+
+    root = logging.getLogger()
+    (original_handlers, original_level) = (root.handlers, root.level)
+
+    print(f"Finding blobs and aiming at them in {len(frames)} frames of {width}x{height} from {len(videos)} video(s), "
+          f"logging to a file and to {os.devnull}")
+
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        for (setup, level) in [ ("direct", "DEBUG"), ("queued", "DEBUG"), ("direct", "INFO"), ("queued", "INFO") ]:
+            filename = os.path.join(directory, f"{setup}-{level}.log")
+
+            if setup == "direct":
+                # As psg.log was written before configure_logging(), by the thread that logs
+                handlers = [ logging.handlers.RotatingFileHandler(filename, maxBytes = 1000000, backupCount = 5), logging.StreamHandler(devnull) ]
+
+                for handler in handlers:
+                    handler.setFormatter(logging.Formatter(
+                        fmt = "{asctime}|{levelname:<5}|{threadName:>12}|{message}",
+                        style = "{",
+                        datefmt = "%Y%m%d|%H:%M:%S"))
+
+                root.handlers = handlers
+                root.setLevel(level)
+                listener = None
+            else:
+                logging_config = configparser.ConfigParser()
+                logging_config["Logging"] = { "Level": level }
+                listener = configure_logging(logging_config, filename, devnull)
+
+            turret = TurretController()
+            turret.start()
+
+            started = time.perf_counter()
+
+            for frame in frames:
+                blob_finder.identify_blobs(frame.copy(), calibration, turret)
+
+            fps = len(frames) / (time.perf_counter() - started)
+
+            turret.terminate()
+
+            # What a message logged for every frame costs the thread logging it
+            started = time.perf_counter()
+
+            for sequence in range(2000):
+                video_log.debug("Processed frame %d", sequence)
+
+            call_time = (time.perf_counter() - started) / 2000
+
+            if listener:
+                listener.stop()
+                handlers = listener.handlers
+
+            for handler in handlers:
+                handler.close()
+
+            with open(filename) as log_file:
+                lines = sum(1 for _ in log_file)
+
+            print(f"  {setup:<6} at {level:<5} {fps:8.1f} fps, {1e6 * call_time:6.2f} us per debug message, {lines} lines logged")
+
+    root.handlers = original_handlers
+    root.setLevel(original_level)
+
+#
+# Plays the videos once through the same VideoFiles, VideoProcessor and
+# BlobFinder as PSG uses, with the detection workers from psg.ini, but as fast
+# as frames can be processed, with no web server or turret. A frame's latency
+# is from being read from the video to its processed frame being published.
+#
+
+def benchmark_replay(config, videos):
+    width = config.getint("Video", "Width", fallback = 400)
+    workers = config.getint("Video", "Detection workers", fallback = 0)
+
+    try:
+        import resource
+    except ImportError:
+        resource = None
+
+    # Forked before any threads are started, as PSG does
+    pool = DetectionPool(workers) if workers > 0 and DetectionPool.available() else None
+
+    controls = TurretControls()
+    controls.set({
+        "tracking": True,
+        "autofire": True,
+        "alwaysfire": False,
+        "scanwhenidle": False,
+        "shoot_colours": [ "RED", "YELLOW" ],
+        "safe_colours": [ "GREEN", "BLUE" ]
+    })
+
+    video_source = open_videos(None, width, videos, paced = False, repeat = False)
+
+    calibration = Calibration(video_source.frame_size())
+    calibration.load()
+
+    if calibration.grid_outline() is None:
+        calibration.calibrate(made_up_calibration(*video_source.frame_size()), save = False)
+
+    video_processor = VideoProcessor(controls, calibration, TurretController(), video_source, pool)
+
+    print(f"Replaying {len(videos)} video(s) at a width of {width} through {workers if pool else 'no'} detection worker(s), "
+          f"as fast as they can be processed, on {os.cpu_count()} CPU(s)")
+
+    cpu_before = os.times()
+
+    video_processor.start()
+    video_source.start()
+
+    latencies = []
+    sequence = 0
+    first = None
+
+    # Counting from the start, in case no frame ever comes through
+    last = time.perf_counter()
+
+    # Once the videos have finished, wait for the last frames to come through
+    while video_source.is_alive() or time.perf_counter() - last < DetectionPool.RESULT_TIMEOUT:
+        frame = video_processor.frames.borrow(sequence, timeout = 0.1)
+
+        if frame is None:
+            continue
+
+        with frame:
+            last = time.perf_counter()
+            first = first or frame.captured
+            sequence = frame.sequence
+            latencies.append(last - frame.captured)
+
+    video_processor.terminate()
+
+    cpu_after = os.times()
+
+    if not latencies:
+        print("  No frames processed")
+        return None
+
+    elapsed = last - first
+    frames = video_processor.frames.sequence
+    cpu_seconds = sum(cpu_after[:4]) - sum(cpu_before[:4])
+
+    if resource:
+        # Kilobytes on Linux, bytes on macOS
+        unit = 1 if sys.platform == "darwin" else 1024
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+        peak_worker_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit if pool else None
+    else:
+        peak_rss = peak_worker_rss = None
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return round(1000 * latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 2)
+
+    results = {
+        "benchmark": "replay",
+        "when": datetime.datetime.now().isoformat(timespec = "seconds"),
+        "platform": sys.platform,
+        "python": sys.version.split()[0],
+        "opencv": cv2.__version__,
+        "cpus": os.cpu_count(),
+        "videos": [ os.path.basename(video) for video in videos ],
+        "width": width,
+        "detection_workers": workers if pool else 0,
+        "frames": frames,
+        "frames_timed": len(latencies),
+        "frames_dropped": video_source.frames.dropped + video_processor.frames.dropped,
+        "frames_given_up_on": pool.abandoned if pool else 0,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2),
+        "latency_ms": { "p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99), "max": percentile(1) },
+        "cpu_seconds": round(cpu_seconds, 2),
+        "cpu_percent": round(100 * cpu_seconds / elapsed, 1),
+        "peak_rss_mb": None if peak_rss is None else round(peak_rss / 2**20, 1),
+        "peak_worker_rss_mb": None if peak_worker_rss is None else round(peak_worker_rss / 2**20, 1)
+    }
+
+    latency = results["latency_ms"]
+
+    print(f"  {frames} frames in {elapsed:.2f} s, {results['fps']:.1f} fps, {results['frames_dropped']} dropped, "
+          f"{results['frames_given_up_on']} given up on")
+    print(f"  latency p50 {latency['p50']:.2f} ms, p95 {latency['p95']:.2f} ms, p99 {latency['p99']:.2f} ms, max {latency['max']:.2f} ms, "
+          f"over {len(latencies)} frames")
+    print(f"  CPU {results['cpu_percent']:.1f}% ({results['cpu_seconds']:.2f} s), peak RSS {results['peak_rss_mb']} MB"
+          + ("" if peak_worker_rss is None else f", largest worker {results['peak_worker_rss_mb']} MB"))
+
+    return results
+
+#
+# Reads the videos through VideoFiles as PSG plays them, once decoding them into
+# a FrameCache in a temporary directory, and then again from the cache, as fast
+# as frames can be read and with nothing processing them.
+#
+
+def benchmark_frame_cache(config, videos):
+    width = config.getint("Video", "Width", fallback = 400)
+
+    if any(Recording.is_recording(video) for video in videos):
+        print("The frame cache is only for video files")
+        return
+
+    def play(cache):
+        video_source = VideoFiles(None, width, list(videos), paced = False, repeat = False, cache = cache)
+
+        frames = 0
+        cpu = os.times()
+        started = time.perf_counter()
+
+        video_source.start()
+
+        while video_source.is_alive() or video_source.frames.sequence > frames:
+            frame = video_source.read(frames, timeout = 0.1)
+
+            if frame is not None:
+                with frame:
+                    frames = frame.sequence
+
+        elapsed = time.perf_counter() - started
+        cpu = (os.times().user - cpu.user) + (os.times().system - cpu.system)
+
+        return (frames, elapsed, cpu)
+
+    with tempfile.TemporaryDirectory() as path:
+        cache = FrameCache(path, config.getfloat("Video", "Frame cache megabytes", fallback = 1024))
+
+        print(f"Reading {len(videos)} video(s) at a width of {width}")
+
+        for name in [ "decoding, filling the cache", "from the cache" ]:
+            (frames, elapsed, cpu) = play(cache)
+
+            print(f"  {name:<28} {frames} frames, {frames / elapsed:.1f} fps, {1000 * cpu / max(frames, 1):.2f} ms CPU per frame")
+
+        print(f"  {cache.hits} video(s) read from the cache, {cache.misses} decoded, "
+              f"{cache.evicted} evicted, {cache.size() / (1024 * 1024):.1f} MB cached")
+
+#
+# Runs PSG's own command line in a new process, once for each of the videos,
+# with --exit-after-first-frame, to time it starting up from cold, and reports
+# when it reached each stage of starting up.
+#
+
+# The Arduino as emulator.py emulates it, on a pseudo-terminal, for one start
+# of PSG in the startup benchmark, so that the real one is left alone. Gives
+# the port, or none to start without the Arduino where that needs Linux.
+@contextlib.contextmanager
+def emulated_arduino(config):
+    if not sys.platform.startswith("linux"):
+        yield "none"
+        return
+
+    import emulator
+
+    arduino = emulator.Emulator("new", config.getint("Arduino", "Baud rate", fallback = 9600))
+    thread = threading.Thread(target = arduino.run, name = "Emulator", daemon = True)
+    thread.start()
+
+    try:
+        yield arduino.port()
+    finally:
+        arduino.stop()
+        thread.join()
+        arduino.close()
+
+def benchmark_startup(config, videos, runs = 5):
+    timings = collections.defaultdict(list)
+
+    for run in range(runs):
+        video = videos[run % len(videos)]
+
+        with emulated_arduino(config) as com_port:
+            completed = subprocess.run(
+                [ sys.executable, os.path.abspath(psg.__file__), "--video", video, "--com-port", com_port, "--exit-after-first-frame" ],
+                stdout = subprocess.PIPE,
+                stderr = subprocess.DEVNULL,
+                text = True,
+                timeout = 120)
+
+        if completed.returncode != 0:
+            print(f"PSG exited with {completed.returncode} starting with {video}")
+            return None
+
+        for (milestone, seconds) in json.loads(completed.stdout).items():
+            timings[milestone].append(seconds)
+
+    arduino = "an emulated Arduino" if sys.platform.startswith("linux") else "no Arduino"
+
+    print(f"Starting PSG {runs} times, with {len(videos)} video(s) instead of the camera and {arduino}")
+
+    for milestone in Startup.MILESTONES:
+        values = sorted(timings[milestone])
+
+        if values:
+            print(f"  {milestone:<12} median {1000 * values[len(values) // 2]:7.1f} ms, "
+                  f"min {1000 * values[0]:7.1f} ms, max {1000 * values[-1]:7.1f} ms")
+
+    return { milestone: sorted(values)[len(values) // 2] for (milestone, values) in timings.items() }
+
+BENCHMARKS = {
+    "preprocessing": benchmark_preprocessing,
+    "detectors": benchmark_detectors,
+    "region": benchmark_region,
+    "workers": benchmark_workers,
+    "colours": benchmark_colours,
+    "calibration": benchmark_calibration,
+    "logging": benchmark_logging,
+    "replay": benchmark_replay,
+    "cache": benchmark_frame_cache,
+    "startup": benchmark_startup
+}
+
+argument_parser = argparse.ArgumentParser()
+argument_parser.add_argument("--video", required = True,
+    help = "Name of video file, directory containing video files, or recording made with psg.py --record")
+argument_parser.add_argument("--json", help = "Also write the results to this file as JSON, where the benchmark has them")
+argument_parser.add_argument("benchmark", choices = BENCHMARKS.keys(), help = "Which benchmark to run")
+
+if __name__ == "__main__":
+    args = argument_parser.parse_args()
+
+    config = psg.read_configuration()
+    listener = configure_logging(config)
+    psg.metrics.configure(config.getboolean("Metrics", "Enabled", fallback = False))
+
+    try:
+        results = BENCHMARKS[args.benchmark](config, psg.video_files(args.video))
+    finally:
+        listener.stop()
+
+    if args.json:
+        if results is None:
+            print(f"The {args.benchmark} benchmark has no results to write as JSON")
+            sys.exit(1)
+
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent = 4)
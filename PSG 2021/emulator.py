@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+
+#
+# Emulates the Arduino running PSG_2020.ino on a Linux pseudo-terminal, so
+# the serial path can be exercised and measured without the hardware. Bytes
+# are taken in no faster than the baud rate allows, and replies sent no faster
+# either; the servos take time to move, and with --firmware old, the sketch's
+# earlier fixed delays and 64 byte receive buffer are reproduced too.
+#
+# Every command received is recorded with when it arrived, when the sketch
+# would have acted on it, and when the servos would have got there.
+#
+# Example:
+#
+#   python3 emulator.py --link /tmp/psg-turret --record commands.csv --psg http://localhost:8080
+#
+# with "COM Port = /tmp/psg-turret" under [Arduino] in psg.ini, then start PSG.
+#
+
+import argparse
+import bisect
+import csv
+import heapq
+import os
+import pty
+import select
+import sys
+import time
+import tty
+import json
+import urllib.request
+
+# As SerialProtocol in psg.py
+SYNC = 0xA5
+ESCAPE = 0x7D
+V1_START = ord("a")
+VERSION = 2
+MAX_PAYLOAD = 32
+
+MOVE = 0x01
+HELLO = 0x02
+PING = 0x03
+STOP = 0x04
+ACK = 0x81
+WELCOME = 0x82
+
+FIRING = 0x01
+ACK_REQUESTED = 0x02
+
+SUPPORTED_BAUDS = [ 9600, 19200, 38400, 57600, 115200 ]
+
+def crc16(data):
+    crc = 0xFFFF
+
+    for byte in data:
+        crc ^= byte << 8
+
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+            crc &= 0xFFFF
+
+    return crc
+
+def encode(frame_type, sequence, payload):
+    body = bytes([ VERSION, frame_type, sequence, len(payload) ]) + bytes(payload)
+    body += crc16(body).to_bytes(2, "big")
+
+    stuffed = bytearray([ SYNC ])
+
+    for byte in body:
+        if byte in (SYNC, ESCAPE, V1_START):
+            stuffed += bytes([ ESCAPE, byte ^ 0x20 ])
+        else:
+            stuffed.append(byte)
+
+    return bytes(stuffed)
+
+def percentile(values, fraction):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class Command:
+    FIELDS = [ "received", "applied", "settled", "protocol", "sequence", "pan", "tilt", "firing" ]
+
+    def __init__(self, received, protocol, sequence, pan, tilt, firing):
+        self.received = received
+        self.applied = None
+        self.settled = None
+        self.protocol = protocol
+        self.sequence = sequence
+        self.pan = pan
+        self.tilt = tilt
+        self.firing = firing
+
+class Emulator:
+    # Bits on the wire for each byte: start, eight data bits, stop
+    BITS_PER_BYTE = 10
+
+    # A hobby servo takes about 0.1 s to turn 60 degrees
+    SERVO_DEGREES_PER_SECOND = 600
+
+    # PSG_2020.ino as it is
+    SERVO_SETTLE = 0.1
+    NEGOTIATED_BAUD_TIMEOUT = 3.0
+
+    # PSG_2020.ino as it was, waiting 25 ms whenever fewer than eight bytes
+    # had arrived, 100 ms before firing, and 50 ms after every command
+    OLD_POLL_DELAY = 0.025
+    OLD_FIRE_DELAY = 0.1
+    OLD_COMMAND_DELAY = 0.05
+    OLD_RECEIVE_BUFFER = 64
+
+    def __init__(self, firmware, baud):
+        (self.master, self.slave) = pty.openpty()
+        tty.setraw(self.slave)
+
+        self.firmware = firmware
+        self.initial_baud = baud
+        self.baud = baud
+        self.started = time.monotonic()
+
+        # When the last byte received finished arriving, at the baud rate
+        self.receive_clock = 0
+        # When the last byte sent will have finished leaving
+        self.send_clock = 0
+        # Replies not yet due: (when, order, bytes)
+        self.outgoing = []
+
+        self.frame = None
+        self.escaped = False
+        self.v1_message = None
+
+        self.pan = 90
+        self.tilt = 90
+        self.firing = False
+        self.when_settled = 0
+        self.when_last_message = 0
+
+        # With the old firmware, when each command waiting in the receive buffer
+        # will be read, and when the sketch will next look at the buffer
+        self.old_buffered = []
+        self.old_busy_until = 0
+
+        self.commands = []
+        self.frames = {}
+        self.crc_errors = 0
+        self.overruns = 0
+        self.ignored = 0
+
+        self.stopping = False
+
+    def port(self):
+        return os.ttyname(self.slave)
+
+    # Stops run(), from another thread, within half a second
+    def stop(self):
+        self.stopping = True
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+    def now(self):
+        return time.monotonic() - self.started
+
+    def run(self, seconds = None):
+        while not self.stopping and (seconds is None or self.now() < seconds):
+            timeout = 0.5
+
+            if self.outgoing:
+                timeout = max(0, min(timeout, self.outgoing[0][0] - self.now()))
+
+            (readable, _, _) = select.select([ self.master ], [], [], timeout)
+
+            if readable:
+                self.receive(os.read(self.master, 4096), self.now())
+
+            self.send_due()
+            self.check_baud()
+
+    def receive(self, data, now):
+        for byte in data:
+            # Each byte arrives no sooner than the link can carry it
+            self.receive_clock = max(self.receive_clock, now) + self.BITS_PER_BYTE / self.baud
+
+            if self.firmware == "new" and byte == SYNC:
+                (self.frame, self.escaped, self.v1_message) = (bytearray(), False, None)
+            elif self.frame is not None:
+                self.receive_v2(byte)
+            elif byte == V1_START:
+                self.v1_message = bytearray()
+            elif self.v1_message is not None:
+                self.v1_message.append(byte)
+
+                if len(self.v1_message) == 7:
+                    self.handle_v1(bytes(self.v1_message))
+                    self.v1_message = None
+            else:
+                self.ignored += 1
+
+    def receive_v2(self, byte):
+        if byte == ESCAPE:
+            self.escaped = True
+            return
+
+        if self.escaped:
+            (byte, self.escaped) = (byte ^ 0x20, False)
+
+        self.frame.append(byte)
+
+        if len(self.frame) >= 4 and self.frame[3] > MAX_PAYLOAD:
+            self.frame = None
+        elif len(self.frame) >= 4 and len(self.frame) == 4 + self.frame[3] + 2:
+            body = bytes(self.frame)
+            self.frame = None
+
+            if crc16(body[:-2]) != int.from_bytes(body[-2:], "big"):
+                self.crc_errors += 1
+            elif body[0] == VERSION:
+                self.handle_v2(body[1], body[2], body[4:-2])
+
+    def handle_v1(self, message):
+        if not message.isdigit():
+            self.ignored += len(message) + 1
+            return
+
+        command = Command(self.receive_clock, 1, None, int(message[0:3]), int(message[3:6]), message[6:7] == b"1")
+
+        if self.firmware == "old":
+            self.schedule_old(command)
+        else:
+            self.apply(command, self.receive_clock)
+
+        self.when_last_message = self.receive_clock
+
+    def handle_v2(self, frame_type, sequence, payload):
+        self.frames[frame_type] = self.frames.get(frame_type, 0) + 1
+        self.when_last_message = self.receive_clock
+
+        if frame_type == MOVE and len(payload) >= 3:
+            self.apply(Command(self.receive_clock, 2, sequence, payload[0], payload[1], bool(payload[2] & FIRING)), self.receive_clock)
+
+            if payload[2] & ACK_REQUESTED:
+                self.acknowledge(sequence)
+        elif frame_type == PING:
+            self.acknowledge(sequence)
+        elif frame_type == STOP:
+            self.firing = False
+            self.acknowledge(sequence)
+        elif frame_type == HELLO and len(payload) >= 4:
+            requested = int.from_bytes(payload[0:4], "little")
+            accepted = requested if requested in SUPPORTED_BAUDS else self.baud
+
+            self.send(encode(WELCOME, sequence, bytes([ VERSION ]) + accepted.to_bytes(4, "little")))
+
+            # Serial.flush() waits for the reply to go before switching
+            self.receive_clock = max(self.receive_clock, self.send_clock)
+            self.baud = accepted
+
+    # The old sketch only reads a command when it gets round to it, and the
+    # receive buffer overflows if commands arrive faster than that
+    def schedule_old(self, command):
+        arrived = command.received
+
+        del self.old_buffered[:bisect.bisect_right(self.old_buffered, arrived)]
+
+        if 8 * (len(self.old_buffered) + 1) > self.OLD_RECEIVE_BUFFER:
+            self.overruns += 1
+            return
+
+        if arrived > self.old_busy_until:
+            polls = -(-(arrived - self.old_busy_until) // self.OLD_POLL_DELAY)
+            start = self.old_busy_until + polls * self.OLD_POLL_DELAY
+        else:
+            start = self.old_busy_until
+
+        self.old_buffered.append(start)
+        self.old_busy_until = start + (self.OLD_FIRE_DELAY if command.firing else 0) + self.OLD_COMMAND_DELAY
+
+        self.apply(command, start)
+
+    def apply(self, command, when):
+        if (command.pan, command.tilt) != (self.pan, self.tilt):
+            travel = max(abs(command.pan - self.pan), abs(command.tilt - self.tilt))
+
+            self.when_settled = max(when, self.when_settled) + travel / self.SERVO_DEGREES_PER_SECOND
+            (self.pan, self.tilt) = (command.pan, command.tilt)
+
+        self.firing = command.firing
+
+        command.applied = when
+        command.settled = max(when, self.when_settled)
+
+        if self.firing and self.firmware == "new":
+            command.settled = max(command.settled, when + self.SERVO_SETTLE)
+
+        self.commands.append(command)
+
+    def acknowledge(self, sequence):
+        self.send(encode(ACK, sequence, bytes([ self.pan, self.tilt, FIRING if self.firing else 0 ])))
+
+    # Replies reach the computer once the link has carried them
+    def send(self, data):
+        self.send_clock = max(self.send_clock, self.receive_clock) + len(data) * self.BITS_PER_BYTE / self.baud
+
+        heapq.heappush(self.outgoing, (self.send_clock, len(self.outgoing), data))
+
+    def send_due(self):
+        while self.outgoing and self.outgoing[0][0] <= self.now():
+            os.write(self.master, heapq.heappop(self.outgoing)[2])
+
+    def check_baud(self):
+        if self.baud != self.initial_baud and self.now() - self.when_last_message >= self.NEGOTIATED_BAUD_TIMEOUT:
+            print(f"Nothing heard for {self.NEGOTIATED_BAUD_TIMEOUT} s, back to {self.initial_baud} baud", flush = True)
+            self.baud = self.initial_baud
+
+def summarise(emulator, psg):
+    commands = emulator.commands
+    elapsed = emulator.now()
+
+    print(f"{len(commands)} commands in {elapsed:.1f} s, {len(commands) / elapsed:.1f} per second, at {emulator.baud} baud")
+    print(f"  version 2 frames: {', '.join(f'{hex(t)}: {n}' for (t, n) in sorted(emulator.frames.items())) or 'none'}")
+    print(f"  CRC errors {emulator.crc_errors}, bytes ignored {emulator.ignored}, commands lost to a full receive buffer {emulator.overruns}")
+
+    if commands:
+        applied = [ command.applied - command.received for command in commands ]
+        settled = [ command.settled - command.received for command in commands ]
+
+        print(f"  received to acted on   p50 {1000 * percentile(applied, 0.5):7.1f} ms, p95 {1000 * percentile(applied, 0.95):7.1f} ms, "
+              f"max {1000 * max(applied):7.1f} ms")
+        print(f"  received to servos set p50 {1000 * percentile(settled, 0.5):7.1f} ms, p95 {1000 * percentile(settled, 0.95):7.1f} ms, "
+              f"max {1000 * max(settled):7.1f} ms")
+
+    if not psg:
+        return
+
+    try:
+        with urllib.request.urlopen(f"{psg}/turret_link", timeout = 5) as response:
+            statistics = json.load(response)
+    except OSError as e:
+        print(f"  Couldn't fetch {psg}/turret_link: {e}")
+        return
+
+    sent = statistics["commands"]
+    requested = sent["sent"] + sent["coalesced"] + sent["dropped"]
+
+    print(f"  PSG sent {sent['sent']} changes and {sent['keepalives']} keepalives, "
+          f"coalesced {sent['coalesced']} and dropped {sent['dropped']}")
+
+    if requested:
+        print(f"  {100 * sent['coalesced'] / requested:.1f}% of changes coalesced")
+
+    link = statistics["link"]
+
+    if link and link["latency_ms"]["p50"] is not None:
+        latency = link["latency_ms"]
+        print(f"  Round trip as PSG measured it p50 {latency['p50']} ms, p95 {latency['p95']} ms, max {latency['max']} ms")
+
+def record(emulator, filename):
+    with open(filename, "w", newline = "") as record_file:
+        writer = csv.writer(record_file)
+        writer.writerow(Command.FIELDS)
+
+        for command in emulator.commands:
+            writer.writerow([ getattr(command, field) for field in Command.FIELDS ])
+
+argument_parser = argparse.ArgumentParser()
+argument_parser.add_argument("--firmware", choices = [ "new", "old" ], default = "new",
+    help = "Emulate PSG_2020.ino as it is, or as it was before protocol version 2")
+argument_parser.add_argument("--baud", type = int, default = 9600, help = "Baud rate the Arduino starts at")
+argument_parser.add_argument("--link", help = "Also make the port available under this name, for COM Port in psg.ini")
+argument_parser.add_argument("--seconds", type = float, help = "Stop after this long, rather than at Ctrl-C")
+argument_parser.add_argument("--record", help = "CSV file to record the commands received in, with times in seconds from starting")
+argument_parser.add_argument("--psg", help = "URL of PSG, such as http://localhost:8080, to fetch its own statistics from at the end")
+
+if __name__ == "__main__":
+    args = argument_parser.parse_args()
+
+    if not sys.platform.startswith("linux"):
+        print(f"{sys.argv[0]} needs Linux")
+        sys.exit(1)
+
+    emulator = Emulator(args.firmware, args.baud)
+
+    if args.link:
+        if os.path.islink(args.link):
+            os.unlink(args.link)
+
+        os.symlink(emulator.port(), args.link)
+
+    print(f"Emulating the {args.firmware} firmware at {args.baud} baud on {args.link or emulator.port()}", flush = True)
+
+    try:
+        emulator.run(args.seconds)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.link and os.path.islink(args.link):
+            os.unlink(args.link)
+
+    if args.record:
+        record(emulator, args.record)
+
+    summarise(emulator, args.psg)
@@ -0,0 +1,347 @@
+#!/usr/bin/python3
+
+#
+# Load generator for a running PSG instance. Opens a number of concurrent
+# viewers against the web server and reports what each viewer receives and,
+# on Linux, how much CPU the server process used while they were connected.
+#
+# Example:
+#
+#   python3 psg.py --video Videos &
+#   python3 loadtest.py --pid $! video --viewers 1,2,5,10,20
+#
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.request
+
+class Viewer(threading.Thread):
+    def __init__(self, host, port, path, boundary):
+        super().__init__(name = "Viewer")
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.path = path
+        self.boundary = boundary
+
+        self.done = False
+        self.bytes_received = 0
+        self.parts_received = 0
+        self.error = None
+
+    def run(self):
+        try:
+            with socket.create_connection((self.host, self.port), timeout = 5) as connection:
+                connection.sendall(
+                    f"GET {self.path} HTTP/1.1\r\n"
+                    f"Host: {self.host}:{self.port}\r\n"
+                    "Connection: close\r\n\r\n".encode("ascii"))
+
+                tail = b""
+
+                while not self.done:
+                    data = connection.recv(65536)
+
+                    if not data:
+                        break
+
+                    self.bytes_received += len(data)
+
+                    # The boundary may straddle two reads
+                    data = tail + data
+                    self.parts_received += data.count(self.boundary)
+                    tail = data[-len(self.boundary) + 1:]
+        except OSError as e:
+            self.error = e
+
+    def stop(self):
+        self.done = True
+
+#
+# Reads /events as a browser's EventSource does, connecting again after the
+# retry interval the server gives whenever the stream ends. Counts the requests
+# made, the events and heartbeats received, and keeps the last event.
+#
+
+class EventClient(threading.Thread):
+    def __init__(self, host, port, path):
+        super().__init__(name = "EventClient")
+        self.daemon = True
+        self.host = host
+        self.port = port
+        self.path = path
+
+        # EventSource's default, in seconds
+        self.retry = 3.0
+
+        self.done = False
+        self.requests = 0
+        self.events_received = 0
+        self.heartbeats = 0
+        self.last = None
+        self.error = None
+
+    def run(self):
+        while not self.done:
+            try:
+                with socket.create_connection((self.host, self.port), timeout = 1) as connection:
+                    self.requests += 1
+
+                    # HTTP/1.0, so the stream isn't chunked
+                    connection.sendall(
+                        f"GET {self.path} HTTP/1.0\r\n"
+                        f"Host: {self.host}:{self.port}\r\n"
+                        "Accept: text/event-stream\r\n\r\n".encode("ascii"))
+
+                    self.__read(connection)
+            except OSError as e:
+                self.error = e
+
+            if not self.done:
+                time.sleep(self.retry)
+
+    def __read(self, connection):
+        data = b""
+        headers = True
+
+        while not self.done:
+            try:
+                received = connection.recv(65536)
+            except socket.timeout:
+                continue
+
+            if not received:
+                return
+
+            data += received
+
+            if headers:
+                if b"\r\n\r\n" not in data:
+                    continue
+
+                data = data.split(b"\r\n\r\n", 1)[1]
+                headers = False
+
+            # Each event ends with a blank line, and may be split across reads
+            (*events, data) = data.split(b"\n\n")
+
+            for event in events:
+                for line in event.decode("utf_8").split("\n"):
+                    if line.startswith(":"):
+                        self.heartbeats += 1
+                    elif line.startswith("retry:"):
+                        self.retry = int(line[6:]) / 1000
+                    elif line.startswith("data:"):
+                        self.last = json.loads(line[5:])
+                        self.events_received += 1
+
+    def stop(self):
+        self.done = True
+
+def process_cpu_seconds(pid):
+    if pid is None or not sys.platform.startswith("linux"):
+        return None
+
+    with open(f"/proc/{pid}/stat", "r") as stat_file:
+        # Fields after the command name, which may itself contain spaces
+        fields = stat_file.read().rsplit(")", 1)[1].split()
+
+    utime, stime = int(fields[11]), int(fields[12])
+
+    return (utime + stime) / os.sysconf("SC_CLK_TCK")
+
+def run_viewers(args, path, boundary, count):
+    viewers = [ Viewer(args.host, args.port, path, boundary) for _ in range(count) ]
+
+    for viewer in viewers:
+        viewer.start()
+
+    # Let the connections settle before measuring
+    time.sleep(1)
+
+    cpu_before = process_cpu_seconds(args.pid)
+    parts_before = sum(viewer.parts_received for viewer in viewers)
+    bytes_before = sum(viewer.bytes_received for viewer in viewers)
+    started = time.monotonic()
+
+    time.sleep(args.seconds)
+
+    elapsed = time.monotonic() - started
+    cpu_after = process_cpu_seconds(args.pid)
+    parts = sum(viewer.parts_received for viewer in viewers) - parts_before
+    received = sum(viewer.bytes_received for viewer in viewers) - bytes_before
+
+    for viewer in viewers:
+        viewer.stop()
+
+    for viewer in viewers:
+        viewer.join(5)
+
+    errors = [ viewer.error for viewer in viewers if viewer.error ]
+
+    cpu = None if cpu_before is None else 100 * (cpu_after - cpu_before) / elapsed
+
+    return (parts / elapsed / count, received / elapsed / count, cpu, errors)
+
+def video(args):
+    print(f"{'viewers':>8} {'fps/viewer':>11} {'kB/s/viewer':>12} {'server CPU %':>13}")
+
+    for count in args.viewers:
+        (fps, rate, cpu, errors) = run_viewers(args, "/video", b"--frame\r\n", count)
+
+        cpu_column = "n/a" if cpu is None else f"{cpu:.1f}"
+
+        print(f"{count:>8} {fps:>11.1f} {rate/1024:>12.1f} {cpu_column:>13}")
+
+        for error in errors:
+            print(f"  viewer error: {error}")
+
+        # Give the server a moment to notice the disconnections
+        time.sleep(1)
+
+def move_turret(args, pan, tilt):
+    request = urllib.request.Request(
+        f"http://{args.host}:{args.port}/move",
+        data = json.dumps({ "pan": pan, "tilt": tilt }).encode("utf_8"),
+        headers = { "Content-Type": "application/json" })
+
+    with urllib.request.urlopen(request, timeout = 5) as response:
+        response.read()
+
+def events(args):
+    print(f"{'clients':>8} {'updates/s':>10} {'events/s/client':>16} {'requests/s':>11} {'in sync':>8} {'server CPU %':>13}")
+
+    for count in args.clients:
+        clients = [ EventClient(args.host, args.port, "/events") for _ in range(count) ]
+
+        for client in clients:
+            client.start()
+
+        # Let the connections settle before measuring
+        time.sleep(1)
+
+        cpu_before = process_cpu_seconds(args.pid)
+        requests_before = sum(client.requests for client in clients)
+        events_before = sum(client.events_received for client in clients)
+        started = time.monotonic()
+
+        # Sweep the turret back and forth at the given rate
+        updates = 0
+
+        while time.monotonic() - started < args.seconds:
+            move_turret(args, 45 + updates % 90, 90)
+            updates += 1
+
+            time.sleep(max(0, started + updates / args.rate - time.monotonic()))
+
+        elapsed = time.monotonic() - started
+        cpu_after = process_cpu_seconds(args.pid)
+        requests = sum(client.requests for client in clients) - requests_before
+        received = sum(client.events_received for client in clients) - events_before
+
+        # Somewhere the sweep never goes, which every client should end up at
+        move_turret(args, 150, 95)
+        time.sleep(1)
+
+        in_sync = sum(1 for client in clients if client.last and (client.last["pan"], client.last["tilt"]) == (150, 95))
+
+        for client in clients:
+            client.stop()
+
+        for client in clients:
+            client.join(5)
+
+        cpu_column = "n/a" if cpu_before is None else f"{100 * (cpu_after - cpu_before) / elapsed:.1f}"
+
+        print(f"{count:>8} {updates / elapsed:>10.1f} {received / elapsed / count:>16.1f} {requests / elapsed:>11.1f} {in_sync:>4}/{count:<3} {cpu_column:>13}")
+
+        for client in clients:
+            if client.error:
+                print(f"  client error: {client.error}")
+
+        time.sleep(1)
+
+def percentile(values, fraction):
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def latency(args):
+    viewers = [ Viewer(args.host, args.port, "/video", b"--frame\r\n") for _ in range(args.viewers) ]
+
+    for viewer in viewers:
+        viewer.start()
+
+    time.sleep(1)
+
+    timings = []
+    failures = 0
+
+    for _ in range(args.requests):
+        started = time.monotonic()
+
+        try:
+            with socket.create_connection((args.host, args.port), timeout = 5) as connection:
+                connection.sendall(
+                    f"GET {args.path} HTTP/1.1\r\n"
+                    f"Host: {args.host}:{args.port}\r\n"
+                    "Connection: close\r\n\r\n".encode("ascii"))
+
+                while connection.recv(65536):
+                    pass
+        except OSError:
+            failures += 1
+            continue
+
+        timings.append(time.monotonic() - started)
+
+    for viewer in viewers:
+        viewer.stop()
+
+    if not timings:
+        print(f"All {failures} requests failed")
+        return
+
+    print(f"GET {args.path} with {args.viewers} viewer(s) connected, {len(timings)} requests, {failures} failed")
+    print(f"  p50 {1000 * percentile(timings, 0.5):.2f} ms, p95 {1000 * percentile(timings, 0.95):.2f} ms, "
+          f"p99 {1000 * percentile(timings, 0.99):.2f} ms, max {1000 * max(timings):.2f} ms")
+
+argument_parser = argparse.ArgumentParser()
+argument_parser.add_argument("--host", default = "localhost", help = "PSG web server host")
+argument_parser.add_argument("--port", type = int, default = 8080, help = "PSG web server port")
+argument_parser.add_argument("--pid", type = int, help = "Process ID of PSG, to report its CPU use (Linux only)")
+argument_parser.add_argument("--seconds", type = float, default = 10, help = "How long to measure each step for")
+
+commands = argument_parser.add_subparsers(dest = "command", required = True)
+
+video_command = commands.add_parser("video", help = "Measure MJPEG streaming with an increasing number of viewers")
+video_command.add_argument(
+    "--viewers",
+    type = lambda s: [ int(n) for n in s.split(",") ],
+    default = [ 1, 2, 5, 10, 20 ],
+    help = "Comma-separated list of viewer counts")
+video_command.set_defaults(func = video)
+
+events_command = commands.add_parser("events", help = "Measure /events with several clients while moving the turret")
+events_command.add_argument(
+    "--clients",
+    type = lambda s: [ int(n) for n in s.split(",") ],
+    default = [ 1, 5, 10 ],
+    help = "Comma-separated list of client counts")
+events_command.add_argument("--rate", type = float, default = 20, help = "Turret moves per second")
+events_command.set_defaults(func = events)
+
+latency_command = commands.add_parser("latency", help = "Measure request latency while viewers are connected")
+latency_command.add_argument("--path", default = "/turret_position", help = "Route to request")
+latency_command.add_argument("--requests", type = int, default = 500, help = "Number of requests to make")
+latency_command.add_argument("--viewers", type = int, default = 10, help = "Number of video viewers to connect first")
+latency_command.set_defaults(func = latency)
+
+if __name__ == "__main__":
+    args = argument_parser.parse_args()
+    args.func(args)
@@ -1,18 +1,18 @@
 #!/usr/bin/python3
 
-import cv2
-import imutils.video
-import threading
-import serial
+import time
 
-import flask
+# As near as PSG can tell to when it started, for timing starting up
+STARTED = time.perf_counter()
+
+import numpy as np
+import threading
 
 import json
 import dataclasses
 import enum
 import configparser
 import argparse
-import time
 import logging
 import logging.handlers
 import sys
@@ -23,1307 +23,5465 @@ import queue
 import http
 import datetime
 import abc
+import math
+import collections
+import multiprocessing
+import multiprocessing.shared_memory
+import multiprocessing.resource_tracker
+import socket
+import asyncio
+import urllib.parse
+import atexit
+import ctypes
+import ctypes.util
+import select
+import struct
+import bisect
+import contextlib
+import hashlib
+import importlib
+import concurrent.futures
 
-class Events:
-    def __init__(self):
-        self.lock = threading.Lock()
-        self.condition = threading.Condition(self.lock)
+#
+# Stands in for a module that takes a while to import, and imports it the first
+# time anything in it is used, just as "import name" would have, so that PSG
+# starts sooner and can be imported without waiting for it. The module then
+# replaces this in the globals, so that using it costs nothing extra.
+#
 
-        self.last = None
-        self.current = None
-        self.running = True
+class LazyModule:
+    def __init__(self, name):
+        self.__name = name
 
-    def publishTurretStatus(self, pan, tilt, firing):
-        with self.condition:
-            if not self.running:
-                return
+    def load(self):
+        importlib.import_module(self.__name)
 
-            event = (pan, tilt, firing)
+        package = self.__name.split(".")[0]
+        globals()[package] = sys.modules[package]
 
+        return sys.modules[package]
 
-            # Do not generate an event if nothing has changed
-            if self.last and self.last == event:
-                logging.debug(f"Not publishing {pan}, {tilt}, {firing} because same as last time")
-                return
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
 
-            logging.debug(f"Publishing {pan}, {tilt}, {firing}")
+# Imports any of the modules that haven't been yet
+def import_now(*modules):
+    for module in modules:
+        if isinstance(module, LazyModule):
+            module.load()
 
-            self.current = event
-            self.condition.notify()
+cv2 = LazyModule("cv2")
+serial = LazyModule("serial")
+flask = LazyModule("flask")
+werkzeug = LazyModule("werkzeug.datastructures")
 
-    def nextEvent(self):
-        with self.condition:
-            while self.running and not self.current:
-                self.condition.wait()
+#
+# Each subsystem logs through its own logger, so that its level can be set
+# separately under [Logging] in psg.ini
+#
 
-            event = {
-                "pan": self.current[0],
-                "tilt": self.current[1],
-                "firing": self.current[2]
-            }
+log = logging.getLogger("psg")
+events_log = logging.getLogger("psg.events")
+controls_log = logging.getLogger("psg.controls")
+calibration_log = logging.getLogger("psg.calibration")
+detection_log = logging.getLogger("psg.detection")
+turret_log = logging.getLogger("psg.turret")
+video_log = logging.getLogger("psg.video")
+stream_log = logging.getLogger("psg.stream")
+web_log = logging.getLogger("psg.web")
 
-            if controls.alwaysfire():
-                event["firing"] = True
+LOG_SUBSYSTEMS = [ "events", "controls", "calibration", "detection", "turret", "video", "stream", "web" ]
 
-            self.last = self.current
-            self.current = None
+#
+# Lets through at most per_second messages a second, in bursts of up to as
+# many, from each line of code that logs, so that a message logged for every
+# frame can't swamp the log. The number dropped is added to the next message
+# from that line that gets through. Errors are never dropped.
+#
 
-            logging.debug(f"Sending {event['pan']}, {event['tilt']}, {event['firing']}")
+class RateLimitFilter(logging.Filter):
+    def __init__(self, per_second):
+        super().__init__()
+        self.per_second = per_second
+        self.lock = threading.Lock()
 
-            yield f"data: {json.dumps(event)}\nretry:100\n\n"
+        # (pathname, lineno) -> [ tokens, when last refilled, number dropped ]
+        self.buckets = {}
 
-    def terminate(self):
-        with self.condition:
-            self.running = False
-            self.condition.notify()
+    def filter(self, record):
+        if self.per_second <= 0 or record.levelno >= logging.ERROR:
+            return True
 
-event_queue = Events()
+        capacity = max(1, self.per_second)
 
-class Daemon(threading.Thread):
-    def __init__(self, thread_name):
-        super().__init__(name = thread_name)
-        self.daemon = True
-        self.done = False
+        with self.lock:
+            bucket = self.buckets.setdefault((record.pathname, record.lineno), [ capacity, record.created, 0 ])
 
-        self.lock = threading.Lock()
-        self.condition = threading.Condition(self.lock)
-        self.cleanup_complete = threading.Event()
+            bucket[0] = min(capacity, bucket[0] + (record.created - bucket[1]) * self.per_second)
+            bucket[1] = record.created
 
-    def terminate(self):
-        # Note that the 'done' field does not need to be synchronised
-        self.done = True
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
 
-        with self.condition:
-            self.condition.notify()
+            bucket[0] -= 1
+            (dropped, bucket[2]) = (bucket[2], 0)
 
-        self.cleanup_complete.wait()
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar dropped)"
 
-@dataclasses.dataclass
-class ScreenCoords:
-    x: int
-    y: int
+        return True
 
-class Colour(enum.Enum):
-    BLACK = enum.auto()
-    WHITE = enum.auto()
-    GREY = enum.auto()
-    RED = enum.auto()
-    YELLOW = enum.auto()
-    GREEN = enum.auto()
-    CYAN = enum.auto()
-    BLUE = enum.auto()
-    MAGENTA = enum.auto()
+#
+# Hands records to the logging thread as they are, rather than formatting the
+# message first as QueueHandler does, so that the thread that logs only pays
+# for creating the record. Arguments are formatted when the record is written,
+# so must not be changed after being logged.
+#
 
-    @classmethod
-    def classifyHSV(cls, point):
-        hue = point[0]/179 * 360
-        saturation = point[1]/255 * 100
-        lightness = point[2]/255 * 100
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        return record
 
-        #logging.debug(f"{hue}, {saturation}, {lightness}")
+#
+# Writes psg.log, and to the console, on a thread of its own, with the levels
+# set under [Logging] in psg.ini. Returns the QueueListener doing the writing,
+# which must be stopped for everything logged to be written.
+#
 
-        if lightness < 20: return cls.BLACK
-        if saturation < 25:
-            if lightness > 80: return cls.WHITE
-            else: return cls.GREY
-        if hue < 30: return cls.RED
-        if hue < 90: return cls.YELLOW
-        if hue < 150: return cls.GREEN
-        if hue < 210: return cls.CYAN
-        if hue < 270: return cls.BLUE
-        if hue < 330: return cls.MAGENTA
+def configure_logging(config, filename = "psg.log", stream = None):
+    formatter = logging.Formatter(
+        fmt = "{asctime}|{levelname:<5}|{threadName:>12}|{message}",
+        style = "{",
+        datefmt = "%Y%m%d|%H:%M:%S")
 
-        return cls.RED
+    handlers = [
+        logging.handlers.RotatingFileHandler(
+            filename,
+            maxBytes = 1000000,
+            backupCount = 5
+        ),
+        logging.StreamHandler(stream)
+    ]
 
-class TurretControls:
-    def __init__(self):
-        self.config_lock = threading.Lock()
-        self.config = {
-            "tracking": False,
-            "autofire": False,
-            "alwaysfire": False,
-            "scanwhenidle": False,
-            "shoot_colours": [],
-            "safe_colours": []
-        }
+    for handler in handlers:
+        handler.setFormatter(formatter)
 
-    def get(self):
-        logging.debug(f"Retrieving controls: {self.config}")
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter(config.getfloat("Logging", "Messages per second from each line", fallback = 5)))
 
-        with self.config_lock:
-            config = copy.deepcopy(self.config)
-            config["shoot_colours"] = [ c.name for c in config["shoot_colours"] ]
-            config["safe_colours"] = [ c.name for c in config["safe_colours"] ]
+    logging.getLogger().handlers = [ queue_handler ]
 
-            return config
+    configure_log_levels(config)
 
-    def set(self, config):
-        logging.debug(f"New controls: {config}")
+    listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level = True)
+    listener.start()
 
-        with self.config_lock:
-            self.config = config
-            self.config["shoot_colours"] = [ Colour[c] for c in config["shoot_colours"] ]
-            self.config["safe_colours"] = [ Colour[c] for c in config["safe_colours"] ]
+    return listener
 
-    def autofire(self):
-        with self.config_lock:
-            return self.config["autofire"]
+# Subsystems without a level of their own log at the overall level
+def configure_log_levels(config):
+    logging.getLogger().setLevel(config.get("Logging", "Level", fallback = "DEBUG").upper())
 
-    def tracking(self):
-        with self.config_lock:
-            return self.config["tracking"]
+    for subsystem in LOG_SUBSYSTEMS:
+        level = config.get("Logging", subsystem, fallback = "")
 
-    def alwaysfire(self):
-        with self.config_lock:
-            return self.config["alwaysfire"]
+        logging.getLogger(f"psg.{subsystem}").setLevel(level.upper() if level else logging.NOTSET)
 
-    def scanwhenidle(self):
-        with self.config_lock:
-            return self.config["scanwhenidle"]
+#
+# A count of observations falling into each of a fixed set of buckets, with
+# their sum, as a Prometheus histogram. Buckets hold the observations up to
+# and including their bound, and one more holds the rest.
+#
 
-    def shootable_colours(self):
-        with self.config_lock:
-            return self.config["shoot_colours"]
+class Histogram:
+    def __init__(self, bounds):
+        self.lock = threading.Lock()
+        self.bounds = bounds
+        self.counts = [ 0 ] * (len(bounds) + 1)
+        self.sum = 0.0
 
-    def safe_colours(self):
-        with self.config_lock:
-            return self.config["safe_colours"]
+    def observe(self, value):
+        bucket = bisect.bisect_left(self.bounds, value)
 
-    def is_shootable_colour(self, colour):
-        with self.config_lock:
-           # If there are no shootable colours, all colours are shootable
-            if not self.config["shoot_colours"]:
-                return True
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += value
 
-            return colour in self.config["shoot_colours"]
-                
+    # Returns the cumulative count for each bound, the total count and the sum
+    def snapshot(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
 
-    def is_safe_colour(self, colour):
-        with self.config_lock:
-            # If there are no safe colours, supplied colour is NOT safe
-            if not self.config["safe_colours"]:
-                return False
+        cumulative = [ sum(counts[:n + 1]) for n in range(len(self.bounds)) ]
 
-            return colour in self.config["safe_colours"]
+        return (cumulative, sum(counts), total)
+
+class StageTimer:
+    __slots__ = ("metrics", "stage", "started")
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started, self.started)
 
 #
-# x:[
-#     [ x1,1, x1,2, x1,3, x1,4, x1,5 ],
-#     [ x2,1, x2,2, x2,3, x2,4, x2,5 ],
-#     [ x3,1, x3,2, x3,3, x3,4, x3,5 ],
-#     [ x4,1, x4,2, x4,3, x4,4, x4,5 ],
-#     [ x5,1, x5,2, x5,3, x5,4, x5,5 ]
-# ]
+# Times the stages each frame goes through, as histograms, and reports them on
+# /metrics in Prometheus's text format, together with counters and gauges read
+# from the rest of PSG only when /metrics is requested. Stages are timed with
 #
-# x[row][col]
+#   with metrics.stage("detect"):
+#       ...
+#
+# which costs nothing but the call while metrics are disabled, under [Metrics]
+# in psg.ini, and nothing is being traced. Detection workers time every stage,
+# and pass the timings back with each frame's blobs, to be observed here.
 #
 
-class Calibration:
-    CONFIG_FILE = "calibration.json"
+class Metrics:
+    STAGES = [ "capture", "resize", "threshold", "detect", "classify", "calibration", "annotate", "encode", "serial_write" ]
 
-    NUM_ROWS = 5
-    NUM_COLS = 5
+    # 50 us to about 3 s
+    BUCKETS = [ 0.00005 * 2**n for n in range(17) ]
+
+    NOT_TIMED = contextlib.nullcontext()
 
     def __init__(self):
         self.lock = threading.Lock()
-        self.data = None,
+        self.enabled = False
+        self.stages = { stage: Histogram(self.BUCKETS) for stage in self.STAGES }
 
-        # self.data = {
-        #    "pan_left": 180,
-        #    "pan_right": 0,
-        #    "tilt_up": 0,
-        #    "tilt_down": 180,
-        #    "grid": {
-        #        "x": [
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ]
-        #        ],
-        #        "y": [
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ],
-        #            [ -1, -1, -1, -1, -1 ]
-        #        ],
-        #        "pan": [ -1, -1, -1, -1, -1 ],
-        #        "tilt": [ -1, -1, -1, -1, -1 ]
-        #    }
-        # }
+        # name -> [ type, help, [ (labels, callback) ] ]
+        self.samples = {}
 
-    def pan_limits(self):
-        with self.lock:
-            return (self.data["pan_left"], self.data["pan_right"])
+        # In a detection worker, the timings to pass back with the frame's blobs
+        self.forwarded = None
 
-    def tilt_limits(self):
-        with self.lock:
-            return (self.data["tilt_up"], self.data["tilt_down"])
+    def configure(self, enabled):
+        self.enabled = enabled
 
-    def calculate_turret_position(self, target: ScreenCoords) -> (int, int):
-        with self.lock:
-            row, col = 0, 0
+    # Whether stages are being timed, for metrics or tracing
+    def timing(self):
+        return self.enabled or tracer.active or self.forwarded is not None
 
-            grid = self.data["grid"]
+    def stage(self, stage):
+        return StageTimer(self, stage) if self.timing() else self.NOT_TIMED
 
-            while row < self.NUM_ROWS - 2 and col < self.NUM_COLS - 2:
-                if target.y > grid["y"][row+1][col]:
-                    row = row + 1
-                    continue
+    # The timing is traced as part of the given frame, or else the frame the
+    # thread is working on, as the given thread, or else this one
+    def observe(self, stage, seconds, started, origin = None, thread = None):
+        if self.forwarded is not None:
+            self.forwarded.append((stage, seconds, started))
+            return
 
-                if target.x > grid["x"][row][col+1]:
-                    col = col + 1
-                    continue
+        if self.enabled:
+            self.stages[stage].observe(seconds)
 
-                break
+        tracer.complete(stage, started, seconds, origin, thread)
 
-            if row == self.NUM_ROWS - 1 or col == self.NUM_COLS - 1:
-                logging.warning(f"Could not find grid square for ({target.x}, {target.y})")
-                return (grid["pan"][2], grid["tilt"][2])
+    # Returns the timings observed since last called, in a detection worker
+    def take_forwarded(self):
+        (forwarded, self.forwarded) = (self.forwarded, [])
 
-            logging.debug(f"Using grid square ({row}, {col}), with corners "\
-                f"nw ({grid['x'][row][col]}, {grid['y'][row][col]}) "\
-                f"ne ({grid['x'][row][col+1]}, {grid['y'][row][col+1]}) "\
-                f"se ({grid['x'][row+1][col+1]}, {grid['y'][row+1][col+1]}) "\
-                f"sw ({grid['x'][row+1][col]}, {grid['y'][row+1][col]}), "\
-                f"left pan {grid['pan'][col]}, right pan {grid['pan'][col+1]}, "\
-                f"top tilt {grid['tilt'][row]}, bottom tilt {grid['tilt'][row+1]}")
+        return forwarded
 
-            pan_ratio = (target.x - grid["x"][row][col])/(grid["x"][row][col+1] - grid["x"][row][col])
-            pan_delta = grid["pan"][col] - grid["pan"][col+1]
+    # A counter or gauge whose value is returned by the callback when
+    # /metrics is requested. Several may share a name with different labels.
+    def register(self, name, kind, help, callback, **labels):
+        with self.lock:
+            self.samples.setdefault(name, [ kind, help, [] ])[2].append((labels, callback))
 
-            logging.debug(f"Pan delta: {pan_delta}, pan ratio: {pan_ratio}")
+    def exposition(self):
+        lines = [
+            "# HELP psg_stage_seconds Time taken by each stage of handling a frame",
+            "# TYPE psg_stage_seconds histogram"
+        ]
 
-            pan = grid["pan"][col] - round(pan_ratio * pan_delta)
+        for (stage, histogram) in self.stages.items():
+            (cumulative, count, total) = histogram.snapshot()
 
-            tilt_ratio = (target.y - grid["y"][row][col])/(grid["y"][row+1][col] - grid["y"][row][col])
-            tilt_delta = grid["tilt"][row+1] - grid["tilt"][row]
+            for (bound, bucket_count) in zip(self.BUCKETS, cumulative):
+                lines.append(f'psg_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {bucket_count}')
 
-            logging.debug(f"Tilt delta: {tilt_delta}, tilt ratio: {tilt_ratio}")
+            lines.append(f'psg_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'psg_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'psg_stage_seconds_count{{stage="{stage}"}} {count}')
 
-            tilt = grid["tilt"][row] + round(tilt_ratio * tilt_delta)
+        with self.lock:
+            samples = [ (name, kind, help, list(registered)) for (name, (kind, help, registered)) in self.samples.items() ]
 
-            logging.debug(f"Calculated turret position for ({target.x}, {target.y}): pan {pan}, tilt {tilt}")
+        for (name, kind, help, registered) in samples:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
 
-            return (pan, tilt)
+            for (labels, callback) in registered:
+                label_text = ",".join(f'{label}="{value}"' for (label, value) in labels.items())
+                lines.append(f"{name}{{{label_text}}} {callback()}" if labels else f"{name} {callback()}")
 
-    def calibration(self):
-        with self.lock:
-            return copy.deepcopy(self.data)
+        return "\n".join(lines) + "\n"
 
-    def load(self):
-        try:
-            with self.lock, open(self.CONFIG_FILE, "r") as calibration_file:
-                self.data = json.load(calibration_file)
+metrics = Metrics()
 
-                self.__calibrate()
-        except FileNotFoundError:
-            logging.warning(f"Calibration file {self.CONFIG_FILE} not found")
+class TraceSpan:
+    __slots__ = ("tracer", "name", "started")
 
-    def calibrate(self, data):
-        with self.lock:
-            self.data = data
-            self.__calibrate()
-            self.__save()
+    def __init__(self, tracer, name):
+        self.tracer = tracer
+        self.name = name
 
-    def __calibrate(self):
-        # TBD - Nothing really to do?
-        pass
+    def __enter__(self):
+        self.started = time.perf_counter()
 
-    def __save(self):
-        logging.debug(f"Saving updated configuration: {self.data} into {self.CONFIG_FILE}")
+    def __exit__(self, *exc_info):
+        self.tracer.complete(self.name, self.started, time.perf_counter() - self.started)
 
-        with open(self.CONFIG_FILE, "w") as calibration_file:
-            json.dump(self.data, calibration_file)
+#
+# Records what each thread spends its time on while tracing, to be opened in a
+# trace viewer such as chrome://tracing or Perfetto as Chrome trace events.
+# Stages timed through Metrics are traced too, as are spans of
+#
+#   with tracer.span("wait for frame"):
+#       ...
+#
+# Each thread notes the origin of the frame it is working on, (frame ID,
+# time.perf_counter() when captured), with set_origin(); whatever it traces is
+# labelled with that frame. The time from a frame's capture to its effect, such
+# as a command to the turret, is traced with latency().
+#
+# Events are appended without a lock, and tracing stops by itself after
+# MAX_EVENTS of them.
+#
 
-class BlobFinder:
-    CONFIG_FILE_NAME = "detection.ini"
+class Tracer:
+    MAX_EVENTS = 500000
 
-    @staticmethod
-    def __params_to_string(params):
-        s = f"threshold from {params.minThreshold} to {params.maxThreshold} via {params.thresholdStep} steps, "
+    NOT_TRACED = contextlib.nullcontext()
 
-        if params.filterByColor:
-          s += f"filter: colour is {params.blobColor}, "
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = False
+        self.started = None
+        self.events = []
+        self.local = threading.local()
 
-        if params.filterByArea:
-          s += f"filter: {params.minArea:6.2} < area < {params.maxArea:6.2}, "
+    # Returns False if already tracing
+    def start(self):
+        with self.lock:
+            if self.active:
+                return False
 
-        if params.filterByCircularity:
-          s += f"filter: {params.minCircularity:6.2} < circularity < {params.maxCircularity:6.2}, "
+            self.events = []
+            self.started = time.perf_counter()
+            self.active = True
 
-        if params.filterByConvexity:
-          s += f"filter: {params.minConvexity:6.2} < convexity < {params.maxConvexity:6.2}, "
+            return True
 
-        if params.filterByInertia:
-          s += f"filter: {params.minInertiaRatio:6.2} < inertia ratio < {params.maxInertiaRatio:6.2}, "
+    # Returns what was traced as Chrome trace events, ready to save as JSON
+    def stop(self):
+        with self.lock:
+            self.active = False
+            (events, self.events) = (self.events, [])
 
-        s += f"minimum distance between blobs is {int(params.minDistBetweenBlobs)}, "
-        s += f"minimum repeatability is {params.minRepeatability}"
+        return self.__chrome_trace(events)
 
-        return s
+    def set_origin(self, origin):
+        self.local.origin = origin
 
-    @staticmethod
-    def __update_option(config, params, option, param_name, activate_if_found_param = None):
-        if not config.has_option("Parameters", option):
+    def origin(self):
+        return getattr(self.local, "origin", None)
+
+    def span(self, name):
+        return TraceSpan(self, name) if self.active else self.NOT_TRACED
+
+    def complete(self, name, started, duration, origin = None, thread = None):
+        if not self.active:
             return
 
-        value = getattr(params, param_name)
+        self.__append("X", name, started, duration, origin or self.origin(), thread)
 
-        if isinstance(value, int):
-            value = config.getint("Parameters", option)
-        elif isinstance(value, float):
-            value = config.getfloat("Parameters", option)
-        else:
-            value = config.get("Parameters", option)
+    # From the frame's capture until now
+    def latency(self, name, origin):
+        if not self.active or not origin:
+            return
 
-        setattr(params, param_name, value)
+        self.__append("latency", name, origin[1], time.perf_counter() - origin[1], origin, None)
 
-        if activate_if_found_param:
-            setattr(params, activate_if_found_param, True)
+    def __append(self, kind, name, started, duration, origin, thread):
+        self.events.append((kind, name, started, duration, origin[0] if origin else None, thread or threading.current_thread().name))
 
-    def __init__(self, controls):
-        self.detector = None
-        self.controls = controls
-        self.detector_lock = threading.Lock()
-        self.when_config_file_last_modified = 0
-        self.__update_detector()
+        if len(self.events) >= self.MAX_EVENTS:
+            self.active = False
 
-    def __update_detector(self):
-        with self.detector_lock:
-            config_file_path = pathlib.Path(self.CONFIG_FILE_NAME)
+    def __chrome_trace(self, events):
+        pid = os.getpid()
+        threads = {}
+        trace = []
 
-            # Only check for non-existence of file on startup
-            if not self.when_config_file_last_modified and not config_file_path.exists():
-                params = cv2.SimpleBlobDetector_Params()
+        for (number, (kind, name, started, duration, frame, thread)) in enumerate(events):
+            tid = threads.setdefault(thread, len(threads) + 1)
+            timestamp = round(1e6 * (started - self.started), 1)
+            args = {} if frame is None else { "frame": frame }
 
-                logging.info(f"{self.CONFIG_FILE_NAME} not found, using defaults for blob detection: {self.__params_to_string(params)}")
+            if kind == "X":
+                trace.append({ "name": name, "cat": "stage", "ph": "X", "ts": timestamp, "dur": round(1e6 * duration, 1), "pid": pid, "tid": tid, "args": args })
+            else:
+                # Shown on a track of their own, as they overlap what the thread was doing
+                trace.append({ "name": name, "cat": "latency", "ph": "b", "id": number, "ts": timestamp, "pid": pid, "tid": tid, "args": args })
+                trace.append({ "name": name, "cat": "latency", "ph": "e", "id": number, "ts": round(timestamp + 1e6 * duration, 1), "pid": pid, "tid": tid })
 
-                config = configparser.ConfigParser()
+        for (thread, tid) in threads.items():
+            trace.append({ "name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": { "name": thread } })
 
-                config["Parameters"] = {};
-                config["Parameters"]["threshold.min"] = str(params.minThreshold)
-                config["Parameters"]["threshold.step"] = str(params.thresholdStep)
-                config["Parameters"]["threshold.max"] = str(params.maxThreshold)
-                config["Parameters"]["distance_between_blobs.min"] = str(params.minDistBetweenBlobs)
-                config["Parameters"]["repeatability.min"] = str(params.minRepeatability)
-                config["Parameters"]["filter.color"] = str(params.blobColor)
-                config["Parameters"]["filter.area.min"] = str(params.minArea)
-                config["Parameters"]["filter.area.max"] = str(params.maxArea)
-                config["Parameters"]["filter.circularity.min"] = str(params.minCircularity)
-                config["Parameters"]["filter.circularity.max"] = str(params.maxCircularity)
-                config["Parameters"]["filter.convexity.min"] = str(params.minConvexity)
-                config["Parameters"]["filter.convexity.max"] = str(params.maxConvexity)
-                config["Parameters"]["filter.inertia.min"] = str(params.minInertiaRatio)
-                config["Parameters"]["filter.inertia.max"] = str(params.maxInertiaRatio)
+        return { "traceEvents": trace, "displayTimeUnit": "ms" }
 
-                with open(self.CONFIG_FILE_NAME, "w") as config_file:
-                    config.write(config_file)
+tracer = Tracer()
 
-                self.detector = cv2.SimpleBlobDetector_create(params)
+#
+# Broadcasts events, such as where the turret is, to every open /events stream.
+# Only the newest event of each kind matters, so rather than queueing events
+# for each subscriber, the hub keeps the newest of each kind with its sequence
+# number, and each subscriber a cursor: the sequence number of the last event
+# it was sent. A subscriber is sent whatever is newer than its cursor, at most
+# one event of each kind, however many arrived since, and at most one message
+# every MINIMUM_INTERVAL, so a burst of updates, or a viewer on a slow link,
+# costs a message rather than a backlog. New subscribers start with the newest
+# of each kind.
+#
+# Streams stay open, with a comment sent every HEARTBEAT_INTERVAL when there is
+# nothing else to send, so that proxies keep them open and a viewer that has
+# gone away is noticed.
+#
 
-                return self.detector
+class Events:
+    MINIMUM_INTERVAL = 0.05
+    HEARTBEAT_INTERVAL = 15
 
-            try:
-                last_modified = config_file_path.stat().st_mtime
+    # How long a browser should wait before reconnecting, in milliseconds
+    RETRY = 1000
 
-                if last_modified <= self.when_config_file_last_modified:
-                    return self.detector
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
 
-                logging.debug(f"Loading {self.CONFIG_FILE_NAME}")
+        self.sequence = 0
+        self.latest = {}
+        self.running = True
+        self.listeners = []
 
-                config = configparser.ConfigParser()
+        self.last_turret_status = None
 
-                config.read(self.CONFIG_FILE_NAME)
-            except FileNotFoundError:
-                # This odd case arises when the file is re-written using gvim, as the file temporarily
-                # vanishes as gvim backs it up; we simply do nothing, as it'll be back momentarily.
-                return self.detector
+        # With always fire on, every event says the turret is firing
+        self.controls = None
 
-            params = cv2.SimpleBlobDetector_Params()
+        self.subscribers = 0
+        self.published = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.heartbeats = 0
 
-            params.filterByColor = False
-            params.filterByArea = False
-            params.filterByCircularity = False
-            params.filterByConvexity = False
-            params.filterByInertia = False
+    # Callbacks are made with the lock held, so must not block
+    def add_listener(self, callback):
+        with self.condition:
+            self.listeners.append(callback)
 
-            self.__update_option(config, params, "filter.color", "blobColor", activate_if_found_param = "filterByColor")
-            self.__update_option(config, params, "filter.area.min", "minArea", activate_if_found_param = "filterByArea")
-            self.__update_option(config, params, "filter.area.max", "maxArea", activate_if_found_param = "filterByArea")
-            self.__update_option(config, params, "filter.circularity.min", "minCircularity", activate_if_found_param = "filterByCircularity")
-            self.__update_option(config, params, "filter.circularity.max", "maxCircularity", activate_if_found_param = "filterByCircularity")
-            self.__update_option(config, params, "filter.convexity.min", "minConvexity", activate_if_found_param = "filterByConvexity")
-            self.__update_option(config, params, "filter.convexity.max", "maxConvexity", activate_if_found_param = "filterByConvexity")
-            self.__update_option(config, params, "filter.inertia.min", "minInertiaRatio", activate_if_found_param = "filterByInertia")
-            self.__update_option(config, params, "filter.inertia.max", "maxInertiaRatio", activate_if_found_param = "filterByInertia")
-            self.__update_option(config, params, "threshold.min", "minThreshold")
-            self.__update_option(config, params, "threshold.step", "thresholdStep")
-            self.__update_option(config, params, "threshold.max", "maxThreshold")
-            self.__update_option(config, params, "distance_between_blobs.min", "minDistBetweenBlobs")
-            self.__update_option(config, params, "repeatability.min", "minRepeatability")
+    def publish(self, kind, data):
+        with self.condition:
+            if not self.running:
+                return
 
-            logging.info(f"Loaded configuration from {self.CONFIG_FILE_NAME}, using {self.__params_to_string(params)}")
+            self.sequence += 1
+            self.published += 1
 
-            self.detector = cv2.SimpleBlobDetector_create(params)
+            # The newest event of the kind, and how many of the kind there have been
+            (_, _, count) = self.latest.get(kind, (0, None, 0))
+            self.latest[kind] = (self.sequence, f"id: {self.sequence}\ndata: {json.dumps(data)}\n\n", count + 1)
 
-            self.when_config_file_last_modified = last_modified
+            self.condition.notify_all()
 
-            return self.detector
+            for listener in self.listeners:
+                listener()
 
-    def __threshold_and_invert(self, img):
-        _, threshed = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
-        return cv2.bitwise_not(threshed)
+    def publishTurretStatus(self, pan, tilt, firing):
+        event = (pan, tilt, firing)
 
-    def identify_blobs(self, frame, calibration, turret):
+        with self.condition:
+            # Do not generate an event if nothing has changed
+            if self.last_turret_status == event:
+                events_log.debug("Not publishing %s, %s, %s because same as last time", pan, tilt, firing)
+                return
+
+            self.last_turret_status = event
+
+        events_log.debug("Publishing %s, %s, %s", pan, tilt, firing)
+
+        self.publish("turret", {
+            "pan": pan,
+            "tilt": tilt,
+            "firing": firing or bool(self.controls and self.controls.alwaysfire())
+        })
+
+    def subscribe(self, kinds):
+        return EventSubscriber(self, kinds)
+
+    # Yields the events of the given kinds, as a text/event-stream, until PSG
+    # stops or the viewer goes away
+    def stream(self, kinds):
+        subscriber = self.subscribe(kinds)
+
+        try:
+            yield f"retry: {self.RETRY}\n\n"
+
+            while self.running:
+                delay = subscriber.delay()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running or subscriber.pending(), subscriber.until_heartbeat())
+
+                message = subscriber.take()
+
+                if message:
+                    yield message
+        finally:
+            subscriber.close()
+
+    def terminate(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+            for listener in self.listeners:
+                listener()
+
+event_queue = Events()
+
+# A single /events stream's subscription to Events
+class EventSubscriber:
+    def __init__(self, events, kinds):
+        self.events = events
+        self.kinds = set(kinds)
+        self.cursor = 0
+        self.when_last_sent = time.monotonic()
+
+        # How many events of each kind there had been when last sent one
+        self.counts = {}
+
+        with events.condition:
+            events.subscribers += 1
+
+        events_log.debug("Subscriber to %s connected", ", ".join(sorted(self.kinds)))
+
+    # Must be called with the lock held
+    def pending(self):
+        return any(sequence > self.cursor for (kind, (sequence, _, _)) in self.events.latest.items() if kind in self.kinds)
+
+    # How long to hold off before the next message, to stay within MINIMUM_INTERVAL
+    def delay(self):
+        return self.when_last_sent + self.events.MINIMUM_INTERVAL - time.monotonic()
+
+    def until_heartbeat(self):
+        return max(0, self.when_last_sent + self.events.HEARTBEAT_INTERVAL - time.monotonic())
+
+    # Returns the events newer than the cursor, a heartbeat if it is due, or
+    # None if there is nothing to send yet
+    def take(self):
+        with self.events.condition:
+            newer = sorted((sequence, message, kind, count) for (kind, (sequence, message, count)) in self.events.latest.items()
+                if kind in self.kinds and sequence > self.cursor)
+
+            if newer:
+                for (_, _, kind, count) in newer:
+                    # Those of the kind published since the last one sent, but not sent
+                    if kind in self.counts:
+                        self.events.coalesced += count - self.counts[kind] - 1
+
+                    self.counts[kind] = count
+
+                self.events.sent += len(newer)
+                self.cursor = newer[-1][0]
+            elif not self.until_heartbeat():
+                self.events.heartbeats += 1
+            else:
+                return None
+
+        self.when_last_sent = time.monotonic()
+
+        return "".join(message for (_, message, _, _) in newer) if newer else ": heartbeat\n\n"
+
+    def close(self):
+        with self.events.condition:
+            self.events.subscribers -= 1
+
+        events_log.debug("Subscriber disconnected")
+
+class Daemon(threading.Thread):
+    def __init__(self, thread_name):
+        super().__init__(name = thread_name)
+        self.daemon = True
+        self.done = False
+
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.cleanup_complete = threading.Event()
+
+    def terminate(self):
+        # Note that the 'done' field does not need to be synchronised
+        self.done = True
+
+        with self.condition:
+            self.condition.notify()
+
+        self.cleanup_complete.wait()
+
+#
+# Linux's inotify, through ctypes, reporting the names of files created,
+# written, moved or deleted in the directories watched
+#
+
+class Inotify:
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    WATCHED_EVENTS = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    # struct inotify_event, followed by len bytes of name
+    EVENT = struct.Struct("iIII")
+
+    # Returns None where inotify isn't available
+    @classmethod
+    def create(cls):
+        if not sys.platform.startswith("linux"):
+            return None
+
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+
+        return cls(libc, fd) if fd >= 0 else None
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+
+    def add_watch(self, directory):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCHED_EVENTS)
+
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+
+        return wd
+
+    # Returns (watch descriptor, name) for each event waiting
+    def read(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+
+        while offset < len(data):
+            (wd, _, _, length) = self.EVENT.unpack_from(data, offset)
+            offset += self.EVENT.size
+
+            events.append((wd, os.fsdecode(data[offset:offset + length].rstrip(b"\0"))))
+            offset += length
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+#
+# Calls back when a watched file changes, on the watcher's own thread, so that
+# the file is parsed there rather than on the thread using it. Editors save in
+# several steps, writing, renaming or briefly deleting the file, so a callback
+# is only made once the file has been left alone for DEBOUNCE seconds. Uses
+# inotify where available, and otherwise checks each file every POLL_INTERVAL
+# seconds.
+#
+# A callback should build whatever it loads from the file, and then swap it
+# into place with a single assignment, keeping what it had if the file has
+# gone or can't be parsed.
+#
+
+class ConfigWatcher(Daemon):
+    DEBOUNCE = 0.25
+    POLL_INTERVAL = 1.0
+
+    def __init__(self):
+        super().__init__("ConfigWatcher")
+
+        self.callbacks = {}   # absolute path -> [ callback ]
+        self.signatures = {}  # absolute path -> stat signature, when polling
+        self.directories = {} # inotify watch descriptor -> directory
+        self.due = {}         # absolute path -> when to call back, if nothing else changes
+
+        self.reloads = 0
+
+        self.inotify = Inotify.create()
+        self.wakeup = os.pipe() if self.inotify else None
+
+    def watch(self, path, callback):
+        path = os.path.abspath(path)
+        directory = os.path.dirname(path)
+
+        with self.condition:
+            if self.inotify and directory not in self.directories.values():
+                try:
+                    self.directories[self.inotify.add_watch(directory)] = directory
+                except OSError as e:
+                    log.warning("Can't watch %s with inotify, checking files every %s s instead: %s", directory, self.POLL_INTERVAL, e)
+
+                    self.__stop_inotify()
+
+            self.callbacks.setdefault(path, []).append(callback)
+            self.signatures[path] = self.__signature(path)
+
+    def terminate(self):
+        if self.wakeup:
+            os.write(self.wakeup[1], b"\0")
+
+        super().terminate()
+
+    def run(self):
+        log.info("Watching configuration files %s", "with inotify" if self.inotify else f"every {self.POLL_INTERVAL} s")
+
+        while not self.done:
+            timeout = self.POLL_INTERVAL
+
+            if self.due:
+                timeout = max(0, min(timeout, min(self.due.values()) - time.monotonic()))
+
+            changed = self.__wait_for_changes(timeout)
+            now = time.monotonic()
+
+            for path in changed:
+                self.due[path] = now + self.DEBOUNCE
+
+            for path in [ path for (path, when) in self.due.items() if when <= now ]:
+                del self.due[path]
+
+                self.__call_back(path)
+
+        self.__stop_inotify()
+
+        if self.wakeup:
+            for fd in self.wakeup:
+                os.close(fd)
+
+        self.cleanup_complete.set()
+
+    def __wait_for_changes(self, timeout):
+        if self.inotify:
+            (readable, _, _) = select.select([ self.inotify.fd, self.wakeup[0] ], [], [], timeout)
+
+            if self.inotify.fd not in readable:
+                return set()
+
+            with self.condition:
+                return set(
+                    path for path in (os.path.join(self.directories.get(wd, ""), name) for (wd, name) in self.inotify.read())
+                    if path in self.callbacks)
+
+        with self.condition:
+            if not self.done:
+                self.condition.wait(timeout)
+
+            changed = set()
+
+            for (path, signature) in self.signatures.items():
+                latest = self.__signature(path)
+
+                if latest != signature:
+                    self.signatures[path] = latest
+                    changed.add(path)
+
+            return changed
+
+    def __call_back(self, path):
+        with self.condition:
+            callbacks = list(self.callbacks[path])
+
+        log.debug("%s changed", path)
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                log.exception("Failed to reload %s", path)
+
+        self.reloads += 1
+
+    def __stop_inotify(self):
+        if self.inotify:
+            self.inotify.close()
+            self.inotify = None
+
+    @staticmethod
+    def __signature(path):
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            return None
+
+        return (status.st_mtime_ns, status.st_size, status.st_ino)
+
+@dataclasses.dataclass
+class ScreenCoords:
+    x: int
+    y: int
+
+class Colour(enum.Enum):
+    BLACK = enum.auto()
+    WHITE = enum.auto()
+    GREY = enum.auto()
+    RED = enum.auto()
+    YELLOW = enum.auto()
+    GREEN = enum.auto()
+    CYAN = enum.auto()
+    BLUE = enum.auto()
+    MAGENTA = enum.auto()
+
+    @classmethod
+    def classifyHSV(cls, point):
+        hue = point[0]/179 * 360
+        saturation = point[1]/255 * 100
+        lightness = point[2]/255 * 100
+
+        #logging.debug(f"{hue}, {saturation}, {lightness}")
+
+        if lightness < 20: return cls.BLACK
+        if saturation < 25:
+            if lightness > 80: return cls.WHITE
+            else: return cls.GREY
+        if hue < 30: return cls.RED
+        if hue < 90: return cls.YELLOW
+        if hue < 150: return cls.GREEN
+        if hue < 210: return cls.CYAN
+        if hue < 270: return cls.BLUE
+        if hue < 330: return cls.MAGENTA
+
+        return cls.RED
+
+    # classifyHSV() for every OpenCV HSV value, as a (180, 256, 256) array of
+    # Colour values, built on first use
+    @classmethod
+    def table(cls):
+        global colour_table
+
+        if colour_table is None:
+            # The same sums as classifyHSV(), done once per hue, saturation and
+            # lightness rather than per pixel
+            hue = np.arange(180)/179 * 360
+            saturation = np.arange(256)/255 * 100
+            lightness = np.arange(256)/255 * 100
+
+            hue_colour = np.select(
+                [ hue < 30, hue < 90, hue < 150, hue < 210, hue < 270, hue < 330 ],
+                [ cls.RED.value, cls.YELLOW.value, cls.GREEN.value, cls.CYAN.value, cls.BLUE.value, cls.MAGENTA.value ],
+                cls.RED.value).astype(np.uint8)
+
+            unsaturated = np.where(lightness > 80, cls.WHITE.value, cls.GREY.value).astype(np.uint8)
+
+            table = np.empty((180, 256, 256), dtype = np.uint8)
+            table[:] = hue_colour[:, None, None]
+            table[:, saturation < 25, :] = unsaturated
+            table[:, :, lightness < 20] = cls.BLACK.value
+
+            colour_table = table
+
+        return colour_table
+
+    # Colour values for any array of HSV pixels, e.g. from Preprocessor.hsv_at()
+    # or a whole frame, in one lookup
+    @classmethod
+    def classify_hsv_array(cls, hsv):
+        hsv = np.asarray(hsv)
+
+        return cls.table()[hsv[..., 0], hsv[..., 1], hsv[..., 2]]
+
+colour_table = None
+
+#
+# The controls as set at one moment. TurretControls.set() publishes a new
+# snapshot rather than changing the current one, so a reader can take one with
+# a single reference read and see a consistent set of controls for as long as
+# it holds it, such as for the whole of a frame. Each set() increments version.
+#
+
+@dataclasses.dataclass(frozen = True)
+class ControlsSnapshot:
+    version: int
+    tracking: bool
+    autofire: bool
+    alwaysfire: bool
+    scanwhenidle: bool
+    shoot_colours: tuple
+    safe_colours: tuple
+
+    # SAFE and SHOOTABLE bits of TurretControls for each Colour value, as
+    # is_safe_colour() and is_shootable_colour() answer; index it with an array
+    # of Colour values to categorise them all at once
+    categories: np.ndarray = dataclasses.field(compare = False, repr = False)
+
+    def is_shootable_colour(self, colour):
+        return bool(self.categories[colour.value] & TurretControls.SHOOTABLE)
+
+    def is_safe_colour(self, colour):
+        return bool(self.categories[colour.value] & TurretControls.SAFE)
+
+class TurretControls:
+    # Bits of ControlsSnapshot.categories
+    SAFE = 1
+    SHOOTABLE = 2
+
+    def __init__(self):
+        # Only serialises set(), so that versions are published in order
+        self.config_lock = threading.Lock()
+
+        self.current = self.__snapshot(0, {})
+
+    def get(self):
+        current = self.current
+
+        controls_log.debug("Retrieving controls: %s", current)
+
+        return {
+            "tracking": current.tracking,
+            "autofire": current.autofire,
+            "alwaysfire": current.alwaysfire,
+            "scanwhenidle": current.scanwhenidle,
+            "shoot_colours": [ c.name for c in current.shoot_colours ],
+            "safe_colours": [ c.name for c in current.safe_colours ]
+        }
+
+    def set(self, config):
+        controls_log.debug("New controls: %s", config)
+
+        with self.config_lock:
+            self.current = self.__snapshot(self.current.version + 1, config)
+
+    def snapshot(self):
+        return self.current
+
+    @classmethod
+    def __snapshot(cls, version, config):
+        shoot_colours = tuple(Colour[c] for c in config.get("shoot_colours", []))
+        safe_colours = tuple(Colour[c] for c in config.get("safe_colours", []))
+
+        return ControlsSnapshot(
+            version = version,
+            tracking = bool(config.get("tracking", False)),
+            autofire = bool(config.get("autofire", False)),
+            alwaysfire = bool(config.get("alwaysfire", False)),
+            scanwhenidle = bool(config.get("scanwhenidle", False)),
+            shoot_colours = shoot_colours,
+            safe_colours = safe_colours,
+            categories = cls.__categorise(shoot_colours, safe_colours))
+
+    @classmethod
+    def __categorise(cls, shoot_colours, safe_colours):
+        categories = np.zeros(max(colour.value for colour in Colour) + 1, dtype = np.uint8)
+
+        # If there are no shootable colours, all colours are shootable
+        for colour in shoot_colours or Colour:
+            categories[colour.value] |= cls.SHOOTABLE
+
+        # If there are no safe colours, no colour is safe
+        for colour in safe_colours:
+            categories[colour.value] |= cls.SAFE
+
+        categories.flags.writeable = False
+
+        return categories
+
+    def colour_categories(self):
+        return self.current.categories
+
+    def autofire(self):
+        return self.current.autofire
+
+    def tracking(self):
+        return self.current.tracking
+
+    def alwaysfire(self):
+        return self.current.alwaysfire
+
+    def scanwhenidle(self):
+        return self.current.scanwhenidle
+
+    def shootable_colours(self):
+        return list(self.current.shoot_colours)
+
+    def safe_colours(self):
+        return list(self.current.safe_colours)
+
+    def is_shootable_colour(self, colour):
+        return self.current.is_shootable_colour(colour)
+
+    def is_safe_colour(self, colour):
+        return self.current.is_safe_colour(colour)
+
+#
+# x:[
+#     [ x1,1, x1,2, x1,3, x1,4, x1,5 ],
+#     [ x2,1, x2,2, x2,3, x2,4, x2,5 ],
+#     [ x3,1, x3,2, x3,3, x3,4, x3,5 ],
+#     [ x4,1, x4,2, x4,3, x4,4, x4,5 ],
+#     [ x5,1, x5,2, x5,3, x5,4, x5,5 ]
+# ]
+#
+# x[row][col]
+#
+
+class Calibration:
+    CONFIG_FILE = "calibration.json"
+
+    NUM_ROWS = 5
+    NUM_COLS = 5
+
+    # Rows of the map interpolated at once, which bounds the memory used
+    MAP_CHUNK_ROWS = 32
+
+    # The map covers frames of frame_size, (width, height); without it, every
+    # point is interpolated
+    def __init__(self, frame_size = None):
+        self.lock = threading.Lock()
+        self.data = None
+        self.compiled = None
+        self.outline = None
+        self.frame_size = frame_size
+
+        # self.data = {
+        #    "pan_left": 180,
+        #    "pan_right": 0,
+        #    "tilt_up": 0,
+        #    "tilt_down": 180,
+        #    "grid": {
+        #        "x": [
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ]
+        #        ],
+        #        "y": [
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ],
+        #            [ -1, -1, -1, -1, -1 ]
+        #        ],
+        #        "pan": [ -1, -1, -1, -1, -1 ],
+        #        "tilt": [ -1, -1, -1, -1, -1 ]
+        #    }
+        # }
+
+    def pan_limits(self):
+        with self.lock:
+            return (self.data["pan_left"], self.data["pan_right"])
+
+    def tilt_limits(self):
+        with self.lock:
+            return (self.data["tilt_up"], self.data["tilt_down"])
+
+    def calculate_turret_position(self, target: ScreenCoords) -> (int, int):
+        with self.lock:
+            compiled = self.compiled
+
+        if compiled is None:
+            raise ValueError("The turret has not been calibrated")
+
+        (positions, valid, compiled_grid) = compiled
+
+        if (positions is not None and isinstance(target.x, int) and isinstance(target.y, int)
+                and 0 <= target.x < positions.shape[1] and 0 <= target.y < positions.shape[0] and valid[target.y, target.x]):
+            (pan, tilt) = positions[target.y, target.x].tolist()
+        else:
+            (pans, tilts) = self.calculate_turret_positions([ (target.x, target.y) ])
+            (pan, tilt) = (int(pans[0]), int(tilts[0]))
+
+        if calibration_log.isEnabledFor(logging.DEBUG):
+            with self.lock:
+                grid = self.data["grid"]
+
+            (_, _, _, rows, cols, pan_ratios, tilt_ratios) = self.__interpolate(compiled_grid, [ target.x ], [ target.y ])
+            (row, col) = (rows[0], cols[0])
+
+            calibration_log.debug(f"Using grid square ({row}, {col}), with corners "\
+                f"nw ({grid['x'][row][col]}, {grid['y'][row][col]}) "\
+                f"ne ({grid['x'][row][col+1]}, {grid['y'][row][col+1]}) "\
+                f"se ({grid['x'][row+1][col+1]}, {grid['y'][row+1][col+1]}) "\
+                f"sw ({grid['x'][row+1][col]}, {grid['y'][row+1][col]}), "\
+                f"left pan {grid['pan'][col]}, right pan {grid['pan'][col+1]}, "\
+                f"top tilt {grid['tilt'][row]}, bottom tilt {grid['tilt'][row+1]}")
+
+            calibration_log.debug(f"Pan ratio: {pan_ratios[0]}, tilt ratio: {tilt_ratios[0]}")
+            calibration_log.debug(f"Calculated turret position for ({target.x}, {target.y}): pan {pan}, tilt {tilt}")
+
+        return (pan, tilt)
+
+    # Turret positions for an array of (x, y) screen points, as arrays of pans
+    # and tilts. Whole-pixel points within the grid are looked up in the map
+    # compiled by __compile(); any others are interpolated there and then.
+    def calculate_turret_positions(self, points):
+        with self.lock:
+            compiled = self.compiled
+
+        if compiled is None:
+            raise ValueError("The turret has not been calibrated")
+
+        (positions, valid_positions, grid) = compiled
+
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 2)
+        (x, y) = (points[:, 0], points[:, 1])
+
+        pans = np.empty(len(points), dtype = np.int64)
+        tilts = np.empty(len(points), dtype = np.int64)
+        valid = np.empty(len(points), dtype = bool)
+
+        if positions is not None:
+            (height, width) = valid_positions.shape
+            mapped = (x >= 0) & (x < width) & (y >= 0) & (y < height) & (x == np.floor(x)) & (y == np.floor(y))
+        else:
+            mapped = np.zeros(len(points), dtype = bool)
+
+        if mapped.any():
+            (rows, cols) = (y[mapped].astype(np.intp), x[mapped].astype(np.intp))
+
+            (pans[mapped], tilts[mapped]) = positions[rows, cols].T
+            valid[mapped] = valid_positions[rows, cols]
+
+        if not mapped.all():
+            (pans[~mapped], tilts[~mapped], valid[~mapped], *_) = self.__interpolate(grid, x[~mapped], y[~mapped])
+
+        if not valid.all():
+            raise ZeroDivisionError("A calibration grid square has no width or height")
+
+        return (pans, tilts)
+
+    # How calculate_turret_position() has always found the pan and tilt for a
+    # point, vectorised: walk down the grid while the point is below the next
+    # row, and right while it's beyond the next column, then interpolate
+    # across the square reached. Points in a square with no width or height
+    # come back as not valid.
+    #
+    # With float32, points that come out too near half way between two
+    # positions for float32 to be sure which they round to are done again in
+    # float64, so that the answer is always the same.
+    @classmethod
+    def __interpolate(cls, grid, x, y, dtype = np.float64):
+        (grid_x, grid_y, grid_pan, grid_tilt) = grid
+
+        x = np.asarray(x, dtype = dtype)
+        y = np.asarray(y, dtype = dtype)
+
+        row = np.zeros(len(x), dtype = np.intp)
+        col = np.zeros(len(x), dtype = np.intp)
+        walking = np.ones(len(x), dtype = bool)
+
+        while True:
+            walking &= (row < cls.NUM_ROWS - 2) & (col < cls.NUM_COLS - 2)
+
+            if not walking.any():
+                break
+
+            down = walking & (y > grid_y[row + 1, col])
+            right = walking & ~down & (x > grid_x[row, col + 1])
+
+            row += down
+            col += right
+
+            walking &= down | right
+
+        (left, right) = (grid_x[row, col].astype(dtype), grid_x[row, col + 1].astype(dtype))
+        (top, bottom) = (grid_y[row, col].astype(dtype), grid_y[row + 1, col].astype(dtype))
+
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            pan_ratio = (x - left)/(right - left)
+            tilt_ratio = (y - top)/(bottom - top)
+
+        valid = np.isfinite(pan_ratio) & np.isfinite(tilt_ratio)
+
+        pan_ratio[~valid] = 0
+        tilt_ratio[~valid] = 0
+
+        pan_offset = pan_ratio * (grid_pan[col] - grid_pan[col + 1]).astype(dtype)
+        tilt_offset = tilt_ratio * (grid_tilt[row + 1] - grid_tilt[row]).astype(dtype)
+
+        pan = grid_pan[col] - np.round(pan_offset).astype(np.int32)
+        tilt = grid_tilt[row] + np.round(tilt_offset).astype(np.int32)
+
+        if dtype != np.float64:
+            unsure = np.zeros(len(x), dtype = bool)
+
+            for offset in (pan_offset, tilt_offset):
+                unsure |= np.abs(offset - np.floor(offset) - 0.5) <= 2.0 ** -18 * (1 + np.abs(offset))
+
+            if unsure.any():
+                (pan[unsure], tilt[unsure], valid[unsure], *_) = cls.__interpolate(grid, x[unsure], y[unsure])
+
+        return (pan, tilt, valid, row, col, pan_ratio, tilt_ratio)
+
+    def calibration(self):
+        with self.lock:
+            return copy.deepcopy(self.data)
+
+    # The outside of the calibration grid as a polygon in screen coordinates,
+    # skipping points not yet calibrated, or None without at least three. Found
+    # whenever the calibration changes, so it is the same array until then,
+    # which mustn't be changed.
+    def grid_outline(self):
+        with self.lock:
+            return self.outline
+
+    @staticmethod
+    def __outline(data):
+        points = np.stack((data["grid"]["x"], data["grid"]["y"]), axis = -1)
+
+        outline = np.concatenate((points[0, :], points[1:, -1], points[-1, -2::-1], points[-2:0:-1, 0]))
+        outline = outline[(outline >= 0).all(axis = 1)]
+
+        if len(outline) < 3:
+            return None
+
+        outline = outline.astype(np.int32)
+        outline.flags.writeable = False
+
+        return outline
+
+    # Also called as calibration.json changes, which includes after saving it;
+    # the map is compiled before taking the lock, so lookups carry on meanwhile
+    def load(self):
+        try:
+            with open(self.CONFIG_FILE, "r") as calibration_file:
+                data = json.load(calibration_file)
+        except FileNotFoundError:
+            calibration_log.warning("Calibration file %s not found", self.CONFIG_FILE)
+            return
+        except ValueError as e:
+            calibration_log.error("Ignoring %s: %s", self.CONFIG_FILE, e)
+            return
+
+        with self.lock:
+            if data == self.data:
+                return
+
+        compiled = self.__compile(data, self.frame_size)
+        outline = self.__outline(data)
+
+        with self.lock:
+            (self.data, self.compiled, self.outline) = (data, compiled, outline)
+
+        calibration_log.info("Loaded calibration from %s", self.CONFIG_FILE)
+
+    def calibrate(self, data, save = True):
+        compiled = self.__compile(data, self.frame_size)
+        outline = self.__outline(data)
+
+        with self.lock:
+            (self.data, self.compiled, self.outline) = (data, compiled, outline)
+
+            if save:
+                self.__save()
+
+    # Once the frame size is known, as the camera is opened; the map is
+    # compiled again if it has changed
+    def set_frame_size(self, frame_size):
+        with self.lock:
+            if frame_size == self.frame_size:
+                return
+
+            self.frame_size = frame_size
+            data = self.data
+
+        if data is None:
+            return
+
+        compiled = self.__compile(data, frame_size)
+
+        with self.lock:
+            # Unless calibrated again meanwhile
+            if self.data is data:
+                self.compiled = compiled
+
+    # Compiles the grid into a map of the turret position for every pixel of
+    # the frame, so most lookups are a single index. The map is interpolated
+    # a few rows at a time, in float32, to be quick and small enough for a Pi.
+    @classmethod
+    def __compile(cls, data, frame_size):
+        grid = data["grid"]
+        grid = tuple(np.array(grid[key], dtype = np.int32) for key in [ "x", "y", "pan", "tilt" ])
+
+        (positions, valid) = (None, None)
+
+        if frame_size is not None and min(frame_size) > 0:
+            (width, height) = frame_size
+
+            positions = np.empty((height, width, 2), dtype = np.int32)
+            valid = np.empty((height, width), dtype = bool)
+
+            x = np.tile(np.arange(width, dtype = np.float32), cls.MAP_CHUNK_ROWS)
+
+            for top in range(0, height, cls.MAP_CHUNK_ROWS):
+                rows = min(cls.MAP_CHUNK_ROWS, height - top)
+                y = np.repeat(np.arange(top, top + rows, dtype = np.float32), width)
+
+                (pan, tilt, chunk_valid, *_) = cls.__interpolate(grid, x[:rows * width], y, np.float32)
+
+                positions[top:top + rows, :, 0] = pan.reshape(rows, width)
+                positions[top:top + rows, :, 1] = tilt.reshape(rows, width)
+                valid[top:top + rows] = chunk_valid.reshape(rows, width)
+
+        return (positions, valid, grid)
+
+    def __save(self):
+        calibration_log.debug("Saving updated configuration: %s into %s", self.data, self.CONFIG_FILE)
+
+        with open(self.CONFIG_FILE, "w") as calibration_file:
+            json.dump(self.data, calibration_file)
+
+#
+# Turns a BGR frame into the image handed to the blob detector in a handful of
+# passes, without allocating per frame. A pixel is kept if any of its channels
+# is at or below that channel's Otsu threshold, and everything else is blacked
+# out. The detector only looks at a greyscale version of the image, so the mask
+# is applied to a greyscale copy rather than to all three channels; the result
+# is identical, as the conversion works pixel by pixel.
+#
+# Optionally the thresholds are kept from frame to frame until a coarse colour
+# histogram of a sparse sample of the frame drifts from the one they were
+# computed from.
+#
+
+class Preprocessor:
+    SAMPLE_SCALE = 4 # sample one pixel in this many, in each direction
+    SAMPLE_BINS = [ 8, 8, 8 ]
+
+    def __init__(self):
+        self.channels = None
+        self.binary = None
+        self.bright = None
+        self.grey = None
+        self.sample = None
+
+        self.thresholds = None
+        self.sample_histogram = None
+        self.reuse_thresholds = False
+        self.histogram_drift = 0.05
+
+        self.thresholds_computed = 0
+        self.thresholds_reused = 0
+
+    def configure(self, reuse_thresholds, histogram_drift):
+        self.reuse_thresholds = reuse_thresholds
+        self.histogram_drift = histogram_drift
+        self.thresholds = None
+
+    def __allocate(self, height, width):
+        self.channels = [ np.empty((height, width), dtype = np.uint8) for _ in range(3) ]
+        self.binary = np.empty((height, width), dtype = np.uint8)
+        self.bright = np.empty((height, width), dtype = np.uint8)
+        self.grey = np.empty((height, width), dtype = np.uint8)
+        self.sample = np.empty((max(1, height // self.SAMPLE_SCALE), max(1, width // self.SAMPLE_SCALE), 3), dtype = np.uint8)
+
+        self.thresholds = None
+
+    def __thresholds_still_valid(self, frame):
+        cv2.resize(frame, self.sample.shape[1::-1], dst = self.sample, interpolation = cv2.INTER_NEAREST)
+
+        histogram = cv2.calcHist([ self.sample ], [ 0, 1, 2 ], None, self.SAMPLE_BINS, [ 0, 256, 0, 256, 0, 256 ])
+        histogram /= self.sample.shape[0] * self.sample.shape[1]
+
+        if self.thresholds is not None:
+            # Total variation distance, between 0 and 1
+            if 0.5 * cv2.norm(histogram, self.sample_histogram, cv2.NORM_L1) <= self.histogram_drift:
+                return True
+
+        self.sample_histogram = histogram
+
+        return False
+
+    def __update_thresholds(self, frame):
+        if self.reuse_thresholds and self.__thresholds_still_valid(frame):
+            self.thresholds_reused += 1
+            return
+
+        cv2.split(frame, self.channels)
+
+        # Only the threshold is wanted; the binary image is thrown away
+        self.thresholds = [
+            int(cv2.threshold(channel, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst = self.binary)[0])
+            for channel in self.channels
+        ]
+
+        self.thresholds_computed += 1
+
+    def process(self, frame):
+        (height, width) = frame.shape[:2]
+
+        if self.grey is None or self.grey.shape != (height, width):
+            self.__allocate(height, width)
+
+        self.__update_thresholds(frame)
+
+        # 255 wherever every channel is above its threshold, i.e. pixels to drop
+        lower = tuple(threshold + 1 for threshold in self.thresholds)
+        cv2.inRange(frame, lower, (255, 255, 255), dst = self.bright)
+
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst = self.grey)
+
+        # Saturating subtraction takes dropped pixels to 0 and leaves the rest
+        cv2.subtract(self.grey, self.bright, dst = self.grey)
+
+        return self.grey
+
+    # HSV for each of the given (x, y) points, converting only those pixels
+    @staticmethod
+    def hsv_at(frame, points):
+        if not len(points):
+            return np.empty((0, 3), dtype = np.uint8)
+
+        points = np.asarray(points, dtype = np.intp)
+        pixels = frame[points[:, 1], points[:, 0]].reshape(-1, 1, 3)
+
+        return cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+
+#
+# The part of each frame worth searching for blobs. The calibration grid bounds
+# where the turret can aim, so the frame can be cropped to it, widened by a
+# margin, and pixels outside the grid or inside any excluded polygons masked
+# off. Set under [Region] in detection.ini.
+#
+
+class DetectionRegion:
+    def __init__(self):
+        self.crop_to_calibration = False
+        self.mask_to_grid = False
+        self.margin = 0
+        self.exclusions = []
+
+        self.key = None
+        self.rect = None
+        self.mask = None
+
+    def configure(self, crop_to_calibration, mask_to_grid, margin, exclusions):
+        self.crop_to_calibration = crop_to_calibration
+        self.mask_to_grid = mask_to_grid
+        self.margin = margin
+        self.exclusions = exclusions
+
+        self.key = None
+
+    # Polygons are separated by semicolons, and their points by spaces, e.g.
+    # "0,0 100,0 100,50; 300,200 400,200 400,300 300,300"
+    @staticmethod
+    def parse_polygons(text):
+        polygons = []
+
+        for polygon in text.split(";"):
+            points = [ [ int(value) for value in point.split(",") ] for point in polygon.split() ]
+
+            if not points:
+                continue
+
+            if len(points) < 3 or any(len(point) != 2 for point in points):
+                raise ValueError(f"Polygon {polygon.strip()} needs at least three x,y points")
+
+            polygons.append(np.array(points, dtype = np.int32))
+
+        return polygons
+
+    # Whether update() needs the calibration grid's outline
+    def uses_outline(self):
+        return self.crop_to_calibration or self.mask_to_grid
+
+    # Returns the (x, y, width, height) of the frame to search, and a mask of
+    # that size, or None if every pixel in it is to be searched. The outline
+    # is the calibration grid's, if any.
+    def update(self, outline, shape):
+        if not self.uses_outline():
+            outline = None
+
+        key = (shape[:2], None if outline is None else outline.tobytes())
+
+        if key != self.key:
+            self.__build(outline, *shape[:2])
+            self.key = key
+
+        return (self.rect, self.mask)
+
+    def __build(self, outline, height, width):
+        (x, y, right, bottom) = (0, 0, width, height)
+
+        if outline is not None and self.crop_to_calibration:
+            (left, top, outline_width, outline_height) = cv2.boundingRect(outline)
+
+            x = min(max(0, left - self.margin), width - 1)
+            y = min(max(0, top - self.margin), height - 1)
+            right = max(min(width, left + outline_width + self.margin), x + 1)
+            bottom = max(min(height, top + outline_height + self.margin), y + 1)
+
+        self.rect = (x, y, right - x, bottom - y)
+        self.mask = None
+
+        if (outline is not None and self.mask_to_grid) or self.exclusions:
+            if outline is not None and self.mask_to_grid:
+                self.mask = np.zeros((bottom - y, right - x), dtype = np.uint8)
+
+                outline = outline - np.int32((x, y))
+
+                cv2.fillPoly(self.mask, [ outline ], 255)
+
+                if self.margin:
+                    cv2.polylines(self.mask, [ outline ], True, 255, thickness = 2 * self.margin + 1)
+            else:
+                self.mask = np.full((bottom - y, right - x), 255, dtype = np.uint8)
+
+            cv2.fillPoly(self.mask, self.exclusions, 0, offset = (-x, -y))
+
+        searched = (right - x) * (bottom - y) if self.mask is None else cv2.countNonZero(self.mask)
+
+        detection_log.info("Searching %dx%d at (%d, %d) for blobs, %.0f%% of the frame", right - x, bottom - y, x, y, 100 * searched / (width * height))
+
+    # Masks off the preprocessed image of the region
+    def apply(self, image):
+        if self.mask is not None:
+            cv2.bitwise_and(image, self.mask, dst = image)
+
+    # Drops keypoints centred outside the mask and moves the rest into full
+    # frame coordinates
+    def to_frame(self, keypoints):
+        (x, y, width, height) = self.rect
+
+        if self.mask is not None:
+            keypoints = [
+                keypoint for keypoint in keypoints
+                if self.mask[min(int(keypoint.pt[1]), height - 1), min(int(keypoint.pt[0]), width - 1)]
+            ]
+
+        if x or y:
+            for keypoint in keypoints:
+                keypoint.pt = (keypoint.pt[0] + x, keypoint.pt[1] + y)
+
+        return keypoints
+
+#
+# Blob detection engines, chosen by name under [Engine] in detection.ini. Each
+# takes the preprocessed greyscale image and returns cv2.KeyPoints, applying
+# the filters from [Parameters].
+#
+
+class DetectionEngine(abc.ABC):
+    def __init__(self, params, config):
+        self.params = params
+
+    @abc.abstractmethod
+    def detect(self, image):
+        pass
+
+class SimpleBlobEngine(DetectionEngine):
+    NAME = "simpleblob"
+
+    def __init__(self, params, config):
+        super().__init__(params, config)
+
+        self.detector = cv2.SimpleBlobDetector_create(params)
+
+    def detect(self, image):
+        return self.detector.detect(image)
+
+#
+# Binarizes once, rather than at every step from threshold.min to threshold.max,
+# and finds blobs as connected components. Only components that pass the area
+# filter on their pixel count have their outline traced, to apply the remaining
+# filters exactly as SimpleBlobDetector does.
+#
+# Both bright regions and the dark regions inside them are traced, whatever
+# filter.color is, as SimpleBlobDetector tests the colour at a blob's centre;
+# a bright ring is a dark blob if its middle is dark.
+#
+# Unless given, the threshold is the lowest at which SimpleBlobDetector would
+# have seen a bright blob often enough to satisfy repeatability.min.
+#
+
+class ConnectedComponentsEngine(DetectionEngine):
+    NAME = "components"
+
+    def __init__(self, params, config):
+        super().__init__(params, config)
+
+        threshold = config.get("Engine", "threshold", fallback = "")
+
+        if threshold:
+            self.threshold = float(threshold)
+        else:
+            self.threshold = params.minThreshold + (params.minRepeatability - 1) * params.thresholdStep
+
+        self.binary = None
+
+    def detect(self, image):
+        if self.binary is None or self.binary.shape != image.shape:
+            self.binary = np.empty(image.shape, dtype = np.uint8)
+
+        cv2.threshold(image, self.threshold, 255, cv2.THRESH_BINARY, dst = self.binary)
+
+        # Labelling is the expensive part, so only label the area with anything
+        # bright in it; no dark region outside it can be a hole
+        (x, y, width, height) = cv2.boundingRect(self.binary)
+
+        if not width:
+            return []
+
+        binary = self.binary[y:y + height, x:x + width]
+
+        blobs = []
+
+        blobs += self.__find_blobs(binary, (x, y), 8, holes = False)
+        blobs += self.__find_blobs(cv2.bitwise_not(binary), (x, y), 4, holes = True)
+
+        return self.__separate(blobs)
+
+    # Bright regions are traced 8-connected, which leaves the dark regions
+    # between them 4-connected
+    def __find_blobs(self, mask, origin, connectivity, holes):
+        params = self.params
+
+        (count, labels, stats, _) = cv2.connectedComponentsWithStatsWithAlgorithm(mask, connectivity, cv2.CV_32S, cv2.CCL_GRANA)
+
+        (x, y, width, height, pixels) = stats[1:].T
+
+        candidates = np.ones(count - 1, dtype = bool)
+
+        if params.filterByArea:
+            # A traced outline runs through the centres of the pixels at its
+            # edge, so encloses a little less than the pixel count of a bright
+            # region and a little more than that of a dark one
+            edge = 2 * (width + height) + 4
+            candidates &= (pixels + edge >= params.minArea) & (pixels < params.maxArea + edge)
+
+        if holes:
+            # Dark regions reaching the edge of the bright area aren't holes
+            candidates &= (x > 0) & (y > 0) & (x + width < mask.shape[1]) & (y + height < mask.shape[0])
+
+        blobs = []
+
+        trace = self.__hole if holes else self.__outline
+
+        for label in np.flatnonzero(candidates) + 1:
+            blob = self.__filter(trace(labels, int(label), stats[label], origin))
+
+            if blob:
+                blobs.append(blob)
+
+        return blobs
+
+    @staticmethod
+    def __outline(labels, label, stats, origin):
+        (x, y, width, height) = (int(value) for value in stats[:4])
+
+        component = (labels[y:y + height, x:x + width] == label).view(np.uint8)
+        (contours, _) = cv2.findContours(component, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset = (origin[0] + x, origin[1] + y))
+
+        return max(contours, key = len)
+
+    # A dark region is outlined as the inside edge of the bright pixels around it
+    @staticmethod
+    def __hole(labels, label, stats, origin):
+        (x, y, width, height) = (int(value) for value in stats[:4])
+
+        # Everything but the region itself, including a ring of pixels around it
+        surround = (labels[y - 1:y + height + 1, x - 1:x + width + 1] != label).view(np.uint8)
+        surround = cv2.copyMakeBorder(surround, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value = 0)
+        (contours, hierarchy) = cv2.findContours(surround, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_NONE, offset = (origin[0] + x - 2, origin[1] + y - 2))
+
+        return next(contour for (contour, links) in zip(contours, hierarchy[0]) if links[3] >= 0)
+
+    # The same tests, in the same order, as SimpleBlobDetector's findBlobs()
+    def __filter(self, contour):
+        params = self.params
+        moments = cv2.moments(contour)
+
+        if params.filterByArea:
+            area = moments["m00"]
+
+            if area < params.minArea or area >= params.maxArea:
+                return None
+
+        if params.filterByCircularity:
+            area = moments["m00"]
+            perimeter = cv2.arcLength(contour, True)
+
+            if not perimeter:
+                return None
+
+            ratio = 4 * math.pi * area / (perimeter * perimeter)
+
+            if ratio < params.minCircularity or ratio >= params.maxCircularity:
+                return None
+
+        if params.filterByInertia:
+            denominator = math.sqrt((2 * moments["mu11"]) ** 2 + (moments["mu20"] - moments["mu02"]) ** 2)
+
+            if denominator > 1e-2:
+                cosmin = (moments["mu20"] - moments["mu02"]) / denominator
+                sinmin = 2 * moments["mu11"] / denominator
+                imin = 0.5 * (moments["mu20"] + moments["mu02"]) - 0.5 * (moments["mu20"] - moments["mu02"]) * cosmin - moments["mu11"] * sinmin
+                imax = 0.5 * (moments["mu20"] + moments["mu02"]) + 0.5 * (moments["mu20"] - moments["mu02"]) * cosmin + moments["mu11"] * sinmin
+                ratio = imin / imax
+            else:
+                ratio = 1
+
+            if ratio < params.minInertiaRatio or ratio >= params.maxInertiaRatio:
+                return None
+
+        if params.filterByConvexity:
+            hull_area = cv2.contourArea(cv2.convexHull(contour))
+
+            if abs(hull_area) < sys.float_info.epsilon:
+                return None
+
+            ratio = cv2.contourArea(contour) / hull_area
+
+            if ratio < params.minConvexity or ratio >= params.maxConvexity:
+                return None
+
+        if not moments["m00"]:
+            return None
+
+        x = moments["m10"] / moments["m00"]
+        y = moments["m01"] / moments["m00"]
+
+        if params.filterByColor:
+            (row, column) = (int(round(y)), int(round(x)))
+
+            if not (0 <= row < self.binary.shape[0] and 0 <= column < self.binary.shape[1]):
+                return None
+
+            if self.binary[row, column] != params.blobColor:
+                return None
+
+        distances = np.sort(np.hypot(contour[:, 0, 0] - x, contour[:, 0, 1] - y))
+        radius = (distances[(len(distances) - 1) // 2] + distances[len(distances) // 2]) / 2
+
+        return (x, y, radius, moments["m00"])
+
+    # Where blobs are closer than distance_between_blobs.min, keep the largest
+    def __separate(self, blobs):
+        keypoints = []
+        kept = []
+
+        for (x, y, radius, area) in sorted(blobs, key = lambda blob: -blob[3]):
+            if any(
+                math.hypot(x - other_x, y - other_y) < max(self.params.minDistBetweenBlobs, radius, other_radius)
+                for (other_x, other_y, other_radius) in kept
+            ):
+                continue
+
+            kept.append((x, y, radius))
+            keypoints.append(cv2.KeyPoint(float(x), float(y), float(2 * radius)))
+
+        return keypoints
+
+DETECTION_ENGINES = {
+    SimpleBlobEngine.NAME: SimpleBlobEngine,
+    ConnectedComponentsEngine.NAME: ConnectedComponentsEngine
+}
+
+class BlobFinder:
+    CONFIG_FILE_NAME = "detection.ini"
+
+    @staticmethod
+    def __params_to_string(params):
+        s = f"threshold from {params.minThreshold} to {params.maxThreshold} via {params.thresholdStep} steps, "
+
+        if params.filterByColor:
+          s += f"filter: colour is {params.blobColor}, "
+
+        if params.filterByArea:
+          s += f"filter: {params.minArea:6.2} < area < {params.maxArea:6.2}, "
+
+        if params.filterByCircularity:
+          s += f"filter: {params.minCircularity:6.2} < circularity < {params.maxCircularity:6.2}, "
+
+        if params.filterByConvexity:
+          s += f"filter: {params.minConvexity:6.2} < convexity < {params.maxConvexity:6.2}, "
+
+        if params.filterByInertia:
+          s += f"filter: {params.minInertiaRatio:6.2} < inertia ratio < {params.maxInertiaRatio:6.2}, "
+
+        s += f"minimum distance between blobs is {int(params.minDistBetweenBlobs)}, "
+        s += f"minimum repeatability is {params.minRepeatability}"
+
+        return s
+
+    @staticmethod
+    def __update_option(config, params, option, param_name, activate_if_found_param = None):
+        if not config.has_option("Parameters", option):
+            return
+
+        value = getattr(params, param_name)
+
+        if isinstance(value, int):
+            value = config.getint("Parameters", option)
+        elif isinstance(value, float):
+            value = config.getfloat("Parameters", option)
+        else:
+            value = config.get("Parameters", option)
+
+        setattr(params, param_name, value)
+
+        if activate_if_found_param:
+            setattr(params, activate_if_found_param, True)
+
+    @classmethod
+    def detection_parameters(cls, config):
+        params = cv2.SimpleBlobDetector_Params()
+
+        params.filterByColor = False
+        params.filterByArea = False
+        params.filterByCircularity = False
+        params.filterByConvexity = False
+        params.filterByInertia = False
+
+        cls.__update_option(config, params, "filter.color", "blobColor", activate_if_found_param = "filterByColor")
+        cls.__update_option(config, params, "filter.area.min", "minArea", activate_if_found_param = "filterByArea")
+        cls.__update_option(config, params, "filter.area.max", "maxArea", activate_if_found_param = "filterByArea")
+        cls.__update_option(config, params, "filter.circularity.min", "minCircularity", activate_if_found_param = "filterByCircularity")
+        cls.__update_option(config, params, "filter.circularity.max", "maxCircularity", activate_if_found_param = "filterByCircularity")
+        cls.__update_option(config, params, "filter.convexity.min", "minConvexity", activate_if_found_param = "filterByConvexity")
+        cls.__update_option(config, params, "filter.convexity.max", "maxConvexity", activate_if_found_param = "filterByConvexity")
+        cls.__update_option(config, params, "filter.inertia.min", "minInertiaRatio", activate_if_found_param = "filterByInertia")
+        cls.__update_option(config, params, "filter.inertia.max", "maxInertiaRatio", activate_if_found_param = "filterByInertia")
+        cls.__update_option(config, params, "threshold.min", "minThreshold")
+        cls.__update_option(config, params, "threshold.step", "thresholdStep")
+        cls.__update_option(config, params, "threshold.max", "maxThreshold")
+        cls.__update_option(config, params, "distance_between_blobs.min", "minDistBetweenBlobs")
+        cls.__update_option(config, params, "repeatability.min", "minRepeatability")
+
+        return params
+
+    @classmethod
+    def create_detector(cls, config):
+        params = cls.detection_parameters(config)
+        engine = config.get("Engine", "name", fallback = SimpleBlobEngine.NAME)
+
+        if engine not in DETECTION_ENGINES:
+            detection_log.error("Unknown detection engine %s in %s, using %s", engine, cls.CONFIG_FILE_NAME, SimpleBlobEngine.NAME)
+            engine = SimpleBlobEngine.NAME
+
+        return DETECTION_ENGINES[engine](params, config)
+
+    # Given a ConfigWatcher, reloads detection.ini as it changes, and otherwise
+    # only loads it once
+    def __init__(self, controls, watcher = None):
+        self.controls = controls
+
+        # Whether to draw the blobs on the frame, as well as describing them to
+        # /detections for the browser to draw
+        self.annotate = True
+
+        # The (detector, preprocessor, region) to find blobs with, replaced as
+        # a whole when detection.ini changes
+        self.setup = None
+        self.reload()
+
+        if watcher:
+            watcher.watch(self.CONFIG_FILE_NAME, self.reload)
+
+    def reload(self):
+        setup = self.__load()
+
+        if setup:
+            self.setup = setup
+
+    # Returns None if the file has gone, to carry on with the current setup
+    def __load(self):
+        preprocessor = Preprocessor()
+        region = DetectionRegion()
+
+        config_file_path = pathlib.Path(self.CONFIG_FILE_NAME)
+
+        # Only check for non-existence of file on startup
+        if self.setup is None and not config_file_path.exists():
+            params = cv2.SimpleBlobDetector_Params()
+
+            detection_log.info("%s not found, using defaults for blob detection: %s", self.CONFIG_FILE_NAME, self.__params_to_string(params))
+
+            config = configparser.ConfigParser()
+
+            config["Parameters"] = {};
+            config["Parameters"]["threshold.min"] = str(params.minThreshold)
+            config["Parameters"]["threshold.step"] = str(params.thresholdStep)
+            config["Parameters"]["threshold.max"] = str(params.maxThreshold)
+            config["Parameters"]["distance_between_blobs.min"] = str(params.minDistBetweenBlobs)
+            config["Parameters"]["repeatability.min"] = str(params.minRepeatability)
+            config["Parameters"]["filter.color"] = str(params.blobColor)
+            config["Parameters"]["filter.area.min"] = str(params.minArea)
+            config["Parameters"]["filter.area.max"] = str(params.maxArea)
+            config["Parameters"]["filter.circularity.min"] = str(params.minCircularity)
+            config["Parameters"]["filter.circularity.max"] = str(params.maxCircularity)
+            config["Parameters"]["filter.convexity.min"] = str(params.minConvexity)
+            config["Parameters"]["filter.convexity.max"] = str(params.maxConvexity)
+            config["Parameters"]["filter.inertia.min"] = str(params.minInertiaRatio)
+            config["Parameters"]["filter.inertia.max"] = str(params.maxInertiaRatio)
+
+            config["Preprocessing"] = {}
+            config["Preprocessing"]["reuse thresholds"] = "no"
+            config["Preprocessing"]["histogram drift"] = str(preprocessor.histogram_drift)
+
+            config["Engine"] = {}
+            config["Engine"]["name"] = SimpleBlobEngine.NAME
+
+            config["Region"] = {}
+            config["Region"]["crop to calibration"] = "no"
+            config["Region"]["mask to grid"] = "no"
+            config["Region"]["margin"] = "0"
+            config["Region"]["exclude"] = ""
+
+            with open(self.CONFIG_FILE_NAME, "w") as config_file:
+                config.write(config_file)
+
+            return (SimpleBlobEngine(params, config), preprocessor, region)
+
+        try:
+            detection_log.debug("Loading %s", self.CONFIG_FILE_NAME)
+
+            config = configparser.ConfigParser()
+
+            with open(self.CONFIG_FILE_NAME, "r") as config_file:
+                config.read_file(config_file)
+        except FileNotFoundError:
+            # This odd case arises when the file is re-written using gvim, as the file temporarily
+            # vanishes as gvim backs it up; we simply do nothing, as it'll be back momentarily.
+            return None
+
+        detector = self.create_detector(config)
+
+        preprocessor.configure(
+            config.getboolean("Preprocessing", "reuse thresholds", fallback = False),
+            config.getfloat("Preprocessing", "histogram drift", fallback = 0.05))
+
+        try:
+            exclusions = DetectionRegion.parse_polygons(config.get("Region", "exclude", fallback = ""))
+        except ValueError as e:
+            detection_log.error("Ignoring exclusions in %s: %s", self.CONFIG_FILE_NAME, e)
+            exclusions = []
+
+        region.configure(
+            config.getboolean("Region", "crop to calibration", fallback = False),
+            config.getboolean("Region", "mask to grid", fallback = False),
+            config.getint("Region", "margin", fallback = 0),
+            exclusions)
+
+        detection_log.info("Loaded configuration from %s, using %s engine with %s", self.CONFIG_FILE_NAME, detector.NAME, self.__params_to_string(detector.params))
+
+        return (detector, preprocessor, region)
+
+    # Only the outline this needs is looked up and, with detection workers,
+    # sent to them
+    def grid_outline(self, calibration):
+        (_, _, region) = self.setup
+
+        return calibration.grid_outline() if region.uses_outline() else None
+
+    def identify_blobs(self, frame, calibration, turret, controls = None):
+        return self.act_on_blobs(frame, self.find_blobs(frame, self.grid_outline(calibration)), calibration, turret, controls)
+
+    # The part of identify_blobs() that only reads the frame, so may run in a
+    # worker process. Returns the keypoints and an array of their Colour values.
+    def find_blobs(self, frame, outline):
         # mask = cv2.inRange(frame, colour_lower, colour_upper)
         # mask = cv2.erode(mask, None, iterations = 0)
         # mask = cv2.dilate(mask, None, iterations = 0)
         # frame = cv2.bitwise_and(frame, frame, mask = mask)
 
-        #detection_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        (detector, preprocessor, region) = self.setup
+
+        ((x, y, width, height), _) = region.update(outline, frame.shape)
+
+        with metrics.stage("threshold"):
+            detection_frame = preprocessor.process(frame[y:y + height, x:x + width])
+            region.apply(detection_frame)
+
+        with metrics.stage("detect"):
+            keypoints = region.to_frame(detector.detect(detection_frame))
+
+        #detection_log.debug("Detected %d sets of keypoints", len(keypoints))
+
+        with metrics.stage("classify"):
+            hsv_points = preprocessor.hsv_at(frame, [ (int(k.pt[0]), int(k.pt[1])) for k in keypoints ])
+            colours = Colour.classify_hsv_array(hsv_points)
+
+        return (keypoints, colours)
+
+    # Acts on the controls in the given ControlsSnapshot, or else the current
+    # controls. Returns each keypoint's TurretControls category, and the index
+    # of the keypoint targeted, if any.
+    def act_on_blobs(self, frame, blobs, calibration, turret, controls = None):
+        (keypoints, colours) = blobs
+        controls = controls or self.controls.snapshot()
+
+        shootable_keypoints = []
+        categories = None
+        target = None
+
+        if not keypoints and controls.autofire and turret.is_firing():
+            detection_log.debug("No targets")
+            turret.fire(False)
+
+        if keypoints:
+            categories = controls.categories[colours]
+
+            safe = (categories & TurretControls.SAFE) != 0
+            shootable = ~safe & ((categories & TurretControls.SHOOTABLE) != 0)
+
+            safe_keypoints = [ keypoint for (keypoint, is_safe) in zip(keypoints, safe) if is_safe ]
+            shootable_keypoints = [ keypoint for (keypoint, is_shootable) in zip(keypoints, shootable) if is_shootable ]
+            other_keypoints = [
+                keypoint for (keypoint, is_safe, is_shootable) in zip(keypoints, safe, shootable)
+                if not (is_safe or is_shootable)
+            ]
+
+            shootable_colour = (0, 0, 255)
+
+            if not controls.autofire:
+                safe_colour = (0, 255, 0)
+                other_colour = (0, 255, 255) # bgr
+
+                if self.annotate:
+                    with metrics.stage("annotate"):
+                        frame = cv2.drawKeypoints(
+                            frame,
+                            shootable_keypoints,
+                            frame,
+                            color = shootable_colour,
+                            flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+
+                        frame = cv2.drawKeypoints(
+                            frame,
+                            safe_keypoints,
+                            frame,
+                            color = safe_colour,
+                            flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+
+                        frame = cv2.drawKeypoints(
+                            frame,
+                            other_keypoints,
+                            frame,
+                            color = other_colour,
+                            flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+            else:
+                if shootable_keypoints:
+                    pan, tilt = turret.turret_position()
+
+                    points = [ (int(keypoint.pt[0]), int(keypoint.pt[1])) for keypoint in shootable_keypoints ]
+
+                    with metrics.stage("calibration"):
+                        (new_pans, new_tilts) = calibration.calculate_turret_positions(points)
+
+                    # The first of the targets needing the least movement
+                    nearest = int(np.argmin(np.abs(pan - new_pans) + np.abs(tilt - new_tilts)))
+
+                    target_pan = int(new_pans[nearest])
+                    target_tilt = int(new_tilts[nearest])
+                    target_keypoint = shootable_keypoints[nearest]
+                    target = int(np.flatnonzero(shootable)[nearest])
+
+                    if self.annotate:
+                        with metrics.stage("annotate"):
+                            frame = cv2.drawKeypoints(
+                                frame,
+                                [ target_keypoint ],
+                                frame,
+                                color = shootable_colour,
+                                flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+
+                    turret.move(target_pan, target_tilt)
+                    turret.fire(True)
+                elif turret.is_firing():
+                    detection_log.debug("No shootable targets")
+                    turret.fire(False)
+
+        return (categories, target)
+
+class Scanner(Daemon):
+    def __init__(
+        self,
+        turret,
+        calibration,
+        pause_before_resuming_scanning,
+        pause_between_turret_positions,
+        turret_pan_increment
+    ):
+        super().__init__("ScannerThread")
+        self.turret = turret
+        self.calibration = calibration
+        self.__turret_active()
+        self.enabled = False
+        self.when_next_move = None
+        self.panning_left = True # otherwise panning right
+        self.pause_before_resuming_scanning = pause_before_resuming_scanning
+        self.pause_between_turret_positions = pause_between_turret_positions
+        self.turret_pan_increment = turret_pan_increment
+
+    def configure(self, pause_before_resuming_scanning, pause_between_turret_positions, turret_pan_increment):
+        with self.condition:
+            self.pause_before_resuming_scanning = pause_before_resuming_scanning
+            self.pause_between_turret_positions = pause_between_turret_positions
+            self.turret_pan_increment = turret_pan_increment
+
+            self.condition.notify()
+
+    def __turret_active(self):
+        self.when_last_active = datetime.datetime.now().timestamp()
+
+    def turret_active(self):
+        with self.condition:
+            self.__turret_active()
+
+            self.condition.notify()
+
+    def enable(self, enabled):
+        with self.condition:
+            self.enabled = enabled
+
+            self.condition.notify()
+
+    def run(self):
+        while not self.done:
+            with self.condition:
+                if not self.enabled:
+                    self.when_next_move = None
+
+                    turret_log.debug("Waiting for scanner to be enabled")
+                    self.condition.wait()
+                    continue
+
+                now = datetime.datetime.now().timestamp()
+
+                if self.when_last_active + self.pause_before_resuming_scanning > now:
+                    self.when_next_move = None
+
+                    self.condition.wait(self.pause_before_resuming_scanning - (now - self.when_last_active))
+                    continue
+
+                if self.when_next_move and self.when_next_move > now:
+                    self.condition.wait(self.when_next_move - now)
+                    continue
+
+                # Time to move the turret!
+
+                turret_log.debug("Moving turret as part of scan")
+
+                current_pan, _ = self.turret.turret_position()
+
+                (pan_left_limit, pan_right_limit) = self.calibration.pan_limits()
+                (tilt_up_limit, tilt_down_limit) = self.calibration.tilt_limits()
+
+                new_tilt = tilt_up_limit + int((tilt_down_limit - tilt_up_limit)/2)
+
+                if self.panning_left:
+                    if current_pan + self.turret_pan_increment > pan_left_limit:
+                        self.panning_left = False
+                        continue
+
+                    new_pan = current_pan + self.turret_pan_increment
+                else:
+                    if current_pan - self.turret_pan_increment < pan_right_limit:
+                        self.panning_left = True
+                        continue
+
+                    new_pan = current_pan - self.turret_pan_increment
+
+                self.turret.move(new_pan, new_tilt)
+                self.when_next_move = now + self.pause_between_turret_positions
+                continue
+
+        turret_log.info("Stopping scanner")
+
+        self.cleanup_complete.set()
+
+#
+# Frames of the serial protocol spoken with the Arduino.
+#
+# Version 1 is eight ASCII characters, "a", then pan and tilt as three digits
+# each and "1" or "0" for firing, and is never answered.
+#
+# Version 2 frames are
+#
+#   SYNC, version, type, sequence, length, payload, CRC high, CRC low
+#
+# where the CRC is CRC-16/CCITT-FALSE over everything from version to the end
+# of the payload. Everything after SYNC is byte stuffed: SYNC, ESCAPE and "a"
+# are sent as ESCAPE followed by the byte XOR 0x20. So a version 2 frame never
+# contains "a", and firmware that only knows version 1 ignores it, while the
+# version 2 firmware still accepts version 1 frames.
+#
+
+class SerialProtocol:
+    SYNC = 0xA5
+    ESCAPE = 0x7D
+    V1_START = ord("a")
+
+    VERSION = 2
+    MAX_PAYLOAD = 32
+
+    # Host to device
+    MOVE = 0x01   # pan, tilt, flags
+    HELLO = 0x02  # baud rate to switch to, 32 bit little endian, or 0 to stay
+    PING = 0x03
+    STOP = 0x04
+
+    # Device to host
+    ACK = 0x81    # pan, tilt, flags; the sequence is that of the frame acknowledged
+    WELCOME = 0x82 # version, baud rate being switched to
+
+    # MOVE and ACK flags
+    FIRING = 0x01
+    ACK_REQUESTED = 0x02
+
+    @staticmethod
+    def encode_v1(pan, tilt, firing):
+        return f"a{pan:03d}{tilt:03d}{int(firing)}".encode("ascii")
+
+    @classmethod
+    def encode(cls, frame_type, sequence, payload = b""):
+        body = bytes([ cls.VERSION, frame_type, sequence & 0xFF, len(payload) ]) + bytes(payload)
+        body += cls.crc16(body).to_bytes(2, "big")
+
+        stuffed = bytearray([ cls.SYNC ])
+
+        for byte in body:
+            if byte in (cls.SYNC, cls.ESCAPE, cls.V1_START):
+                stuffed += bytes([ cls.ESCAPE, byte ^ 0x20 ])
+            else:
+                stuffed.append(byte)
+
+        return bytes(stuffed)
+
+    @staticmethod
+    def crc16(data):
+        crc = 0xFFFF
+
+        for byte in data:
+            crc ^= byte << 8
+
+            for _ in range(8):
+                crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else crc << 1
+                crc &= 0xFFFF
+
+        return crc
+
+# Turns the bytes received into version 2 frames, skipping anything else
+class SerialFrameDecoder:
+    def __init__(self):
+        self.body = None
+        self.escaped = False
+        self.crc_errors = 0
+
+    # Returns (type, sequence, payload) for each whole frame in data
+    def feed(self, data):
+        frames = []
+
+        for byte in data:
+            if byte == SerialProtocol.SYNC:
+                self.body = bytearray()
+                self.escaped = False
+                continue
+
+            if self.body is None:
+                continue
+
+            if byte == SerialProtocol.ESCAPE:
+                self.escaped = True
+                continue
+
+            if self.escaped:
+                byte ^= 0x20
+                self.escaped = False
+
+            self.body.append(byte)
+
+            if len(self.body) >= 4 and self.body[3] > SerialProtocol.MAX_PAYLOAD:
+                self.body = None
+            elif len(self.body) >= 4 and len(self.body) == 4 + self.body[3] + 2:
+                frame = self.__complete(bytes(self.body))
+                self.body = None
+
+                if frame:
+                    frames.append(frame)
+
+        return frames
+
+    def __complete(self, body):
+        if SerialProtocol.crc16(body[:-2]) != int.from_bytes(body[-2:], "big"):
+            self.crc_errors += 1
+            return None
+
+        if body[0] != SerialProtocol.VERSION:
+            return None
+
+        return (body[1], body[2], body[4:-2])
+
+#
+# The serial connection to the Arduino. Starts out speaking version 1, while
+# asking the device for version 2 with HELLO; if it answers, commands are sent
+# as version 2 from then on, at the faster baud rate if one was asked for and
+# the device accepted it, and otherwise carry on as version 1.
+#
+# Reads everything the device sends on a thread of its own, matching
+# acknowledgements to the commands sent to measure each one's round trip, and
+# keeping the position the device last reported. A version 2 device is pinged
+# every PING_INTERVAL seconds, which keeps it at the faster baud rate, as it
+# goes back to the one it started at if it hears nothing for DEVICE_TIMEOUT
+# seconds. If nothing is heard from it for that long, whether the link stalled
+# or the device was reset, PSG goes back to that baud rate and version 1 too,
+# and asks for version 2 again.
+#
+# Writes give up after WRITE_TIMEOUT seconds, so a stalled link can't hold up
+# the thread writing for long; the framing lets the device recover from a
+# partly written frame. A change of baud rate is recorded under the lock, and
+# made with only the write lock held, so the lock is never held waiting for a
+# write.
+#
+
+class SerialLink(Daemon):
+    WRITE_TIMEOUT = 0.5
+    HELLO_INTERVAL = 0.5
+    HELLO_ATTEMPTS = 8 # The Arduino resets when the port is opened, so allow for it to boot
+    ACK_TIMEOUT = 0.5
+    PING_INTERVAL = 1.0
+    DEVICE_TIMEOUT = 3.0 # NEGOTIATED_BAUD_TIMEOUT_MS in the sketch
+    LATENCIES_KEPT = 1000
+
+    def __init__(self, comport, baudrate, protocol = "auto", negotiate_baudrate = 0, acknowledge = True):
+        super().__init__("SerialReader")
+
+        self.serial = serial.Serial(port = comport, baudrate = baudrate, timeout = 0.05, write_timeout = self.WRITE_TIMEOUT)
+        self.write_lock = threading.Lock()
+        self.decoder = SerialFrameDecoder()
+
+        self.initial_baudrate = baudrate
+        self.negotiate_baudrate = negotiate_baudrate
+        # What the port should be switched to, before anything more is written
+        self.baudrate = baudrate
+        self.acknowledge = acknowledge
+        self.version = 1
+        self.hello_attempts = 0
+        self.when_last_hello = 0
+        self.when_last_sent = 0
+        self.when_last_heard = None
+        self.sequence = 0
+
+        # Sequence number -> when sent, for commands awaiting acknowledgement
+        self.awaiting = collections.OrderedDict()
+        self.latencies = collections.deque(maxlen = self.LATENCIES_KEPT)
+
+        self.sent = 0
+        self.acknowledged = 0
+        self.lost = 0
+        self.write_failures = 0
+        self.renegotiations = 0
+        self.device_position = None
+
+        if protocol != "1":
+            self.__negotiate()
+
+    # Returns whether the command was written
+    def send_position(self, pan, tilt, firing):
+        with self.condition:
+            if self.version == 1:
+                frame = SerialProtocol.encode_v1(pan, tilt, firing)
+            else:
+                flags = (SerialProtocol.FIRING if firing else 0) | (SerialProtocol.ACK_REQUESTED if self.acknowledge else 0)
+                frame = self.__frame(SerialProtocol.MOVE, bytes([ pan, tilt, flags ]), self.acknowledge)
+
+        return self.__write(frame)
+
+    def send_stop(self):
+        with self.condition:
+            frame = b"z0000000" if self.version == 1 else self.__frame(SerialProtocol.STOP)
+
+        return self.__write(frame)
+
+    def statistics(self):
+        with self.condition:
+            latencies = sorted(self.latencies)
+
+            def percentile(fraction):
+                return round(1000 * latencies[min(len(latencies) - 1, int(fraction * len(latencies)))], 2) if latencies else None
+
+            return {
+                "protocol": self.version,
+                "baudrate": self.serial.baudrate,
+                "sent": self.sent,
+                "acknowledged": self.acknowledged,
+                "lost": self.lost,
+                "write_failures": self.write_failures,
+                "renegotiations": self.renegotiations,
+                "awaiting": len(self.awaiting),
+                "crc_errors": self.decoder.crc_errors,
+                "latency_ms": { "p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1) },
+                "device_position": self.device_position,
+                "seconds_since_heard": None if self.when_last_heard is None else round(time.monotonic() - self.when_last_heard, 2)
+            }
+
+    def run(self):
+        while not self.done:
+            try:
+                data = self.serial.read(max(1, self.serial.in_waiting))
+            except serial.SerialException as e:
+                turret_log.error("Serial read failed: %s", e)
+                time.sleep(self.PING_INTERVAL)
+                continue
+
+            now = time.monotonic()
+
+            for (frame_type, sequence, payload) in self.decoder.feed(data):
+                self.__received(frame_type, sequence, payload, now)
+
+            self.__housekeeping(now)
+
+            # Read at the new baud rate straight away, even with nothing to write
+            if self.serial.baudrate != self.baudrate:
+                with self.write_lock:
+                    self.__switch_baudrate()
+
+        self.serial.close()
+
+        self.cleanup_complete.set()
+
+    # Must be called with the lock held; if awaited, the frame is expected to
+    # be acknowledged
+    def __frame(self, frame_type, payload = b"", awaited = False):
+        self.sequence = (self.sequence + 1) & 0xFF
+
+        if awaited:
+            self.awaiting[self.sequence] = time.monotonic()
+
+        return SerialProtocol.encode(frame_type, self.sequence, payload)
+
+    def __write(self, frame):
+        try:
+            with self.write_lock, metrics.stage("serial_write"):
+                self.__switch_baudrate()
+                self.serial.write(frame)
+        except serial.SerialTimeoutException:
+            turret_log.warning("Gave up writing to the device after %s s", self.WRITE_TIMEOUT)
+            written = False
+        except serial.SerialException as e:
+            turret_log.error("Serial write failed: %s", e)
+            written = False
+        else:
+            written = True
+
+        with self.condition:
+            if written:
+                self.sent += 1
+                self.when_last_sent = time.monotonic()
+            else:
+                self.write_failures += 1
+
+        return written
+
+    # Must be called with the write lock held, and not the lock
+    def __switch_baudrate(self):
+        if self.serial.baudrate != self.baudrate:
+            self.serial.baudrate = self.baudrate
+
+    def __received(self, frame_type, sequence, payload, now):
+        with self.condition:
+            self.when_last_heard = now
+
+            if frame_type == SerialProtocol.ACK and len(payload) >= 3:
+                self.device_position = { "pan": payload[0], "tilt": payload[1], "firing": bool(payload[2] & SerialProtocol.FIRING) }
+
+                when_sent = self.awaiting.pop(sequence, None)
+
+                if when_sent is not None:
+                    self.latencies.append(now - when_sent)
+                    self.acknowledged += 1
+            elif frame_type == SerialProtocol.WELCOME and len(payload) >= 5 and self.version == 1:
+                baudrate = int.from_bytes(payload[1:5], "little")
+
+                self.version = 2
+                self.hello_attempts = 0
+
+                turret_log.info("Device speaks protocol version %d, switching to version 2 at %d baud", payload[0], baudrate or self.baudrate)
+
+                if baudrate:
+                    self.baudrate = baudrate
+
+    # Sends HELLO_ATTEMPTS HELLOs, and gives up HELLO_INTERVAL after the last;
+    # must be called with the lock held
+    def __negotiate(self):
+        self.hello_attempts = self.HELLO_ATTEMPTS + 1
+        self.when_last_hello = 0
+
+    # Back to how the device starts out, as it will have gone back to it; must
+    # be called with the lock held
+    def __renegotiate(self):
+        turret_log.warning(
+            "Nothing heard from the device for %s s, back to version 1 at %d baud",
+            self.DEVICE_TIMEOUT,
+            self.initial_baudrate)
+
+        self.baudrate = self.initial_baudrate
+        self.version = 1
+        self.renegotiations += 1
+        self.lost += len(self.awaiting)
+        self.awaiting.clear()
+
+        # Anything half received was at the other baud rate
+        crc_errors = self.decoder.crc_errors
+        self.decoder = SerialFrameDecoder()
+        self.decoder.crc_errors = crc_errors
+
+        self.__negotiate()
+
+    def __housekeeping(self, now):
+        frame = None
+
+        with self.condition:
+            # Acknowledgements arrive in order, so only the oldest need checking
+            while self.awaiting and now - next(iter(self.awaiting.values())) > self.ACK_TIMEOUT:
+                self.awaiting.popitem(last = False)
+                self.lost += 1
+
+            if self.version == 2 and now - self.when_last_heard > self.DEVICE_TIMEOUT:
+                self.__renegotiate()
+
+            if self.version == 1 and self.hello_attempts and now - self.when_last_hello >= self.HELLO_INTERVAL:
+                self.hello_attempts -= 1
+                self.when_last_hello = now
+
+                if not self.hello_attempts:
+                    turret_log.info("No answer to HELLO, so the device only speaks protocol version 1")
+                else:
+                    frame = self.__frame(SerialProtocol.HELLO, self.negotiate_baudrate.to_bytes(4, "little"))
+            elif self.version == 2 and now - self.when_last_sent >= self.PING_INTERVAL:
+                frame = self.__frame(SerialProtocol.PING, awaited = True)
+
+        if frame:
+            self.__write(frame)
+
+#
+# Holds the turret's position and whether it's firing, and sends them to the
+# device on a thread of its own. Callers only ever wait to update the state,
+# never for the device; if the state changes several times before the last
+# change has been sent, only the latest is sent. The state is also re-sent
+# frequency times a second while nothing changes. A command can be lost, as
+# writes give up when the link stalls and the device can be reset, so
+# re-sending puts the turret where PSG thinks it is, and keeps the link at
+# the negotiated baud rate, which the device gives up on if it hears nothing.
+#
+
+class TurretController(Daemon):
+    def __init__(self, comport = None, baudrate = None, frequency = 0.5, protocol = "auto", negotiate_baudrate = 0, acknowledge = True):
+        super().__init__("TurretThread")
+        self.link = SerialLink(comport, baudrate, protocol, negotiate_baudrate, acknowledge) if comport else None
+
+        self.pan = 0
+        self.tilt = 0
+        self.firing = False
+        self.frequency = frequency
+        self.always_fire = False
+
+        self.last_message = None
+
+        # Changes since the state was last picked up to be sent, and the frame
+        # that led to the latest, while tracing
+        self.changes = 0
+        self.origin = None
+
+        self.sent = 0
+        self.keepalives = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+        self.move(self.pan, self.tilt)
+
+    def alwaysfire(self, enabled):
+        with self.condition:
+            self.always_fire = enabled
+            self.firing = enabled
+
+            self.__changed()
+
+    def turret_position(self):
+        with self.condition:
+            return (self.pan, self.tilt)
+
+    def turret_position_str(self):
+        with self.condition:
+            return self.__turret_position_str()
+            
+
+    def __turret_position_str(self):
+        return f"({self.pan}\N{DEGREE SIGN}, {self.tilt}\N{DEGREE SIGN})"
+
+    def is_firing(self):
+        with self.condition:
+            return self.firing
+
+    def fire(self, firing):
+        with self.condition:
+            if self.always_fire:
+                return
+
+            if self.firing == firing:
+                return
+
+            self.firing = firing
+
+            self.__changed()
+
+    def move(self, pan, tilt):
+        if pan < 0 or pan > 180:
+            turret_log.warning("Pan %s\N{DEGREE SIGN} out of range, changing to be within 0..180", pan)
+            pan = 0 if pan < 0 else pan
+            pan = 180 if pan > 180 else pan
+
+        if tilt < 0 or tilt > 180:
+            turret_log.warning("Tilt %s\N{DEGREE SIGN} out of range, changing to be within 0..180", tilt)
+            tilt = 0 if tilt < 0 else tilt
+            tilt = 180 if tilt > 180 else tilt
+
+        with self.condition:
+            if pan == self.pan and tilt == self.tilt:
+                turret_log.debug("Turret already at (%s\N{DEGREE SIGN}, %s\N{DEGREE SIGN}), not moving", self.pan, self.tilt)
+                return
+
+            turret_log.info("Moving turret to pan %s\N{DEGREE SIGN}, tilt %s\N{DEGREE SIGN}", pan, tilt)
+
+            self.pan = pan
+            self.tilt = tilt
+
+            self.__changed()
+
+    # Must be called with the lock held
+    def __changed(self):
+        self.changes += 1
+        self.origin = tracer.origin() if tracer.active else None
+
+        self.condition.notify()
+
+    # Counts of commands sent to the device, and statistics of the serial
+    # link, if any
+    def statistics(self):
+        with self.condition:
+            commands = {
+                "sent": self.sent,
+                "keepalives": self.keepalives,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped
+            }
+
+        return { "commands": commands, "link": self.link.statistics() if self.link else None }
+
+    def run(self):
+        if self.link:
+            self.link.start()
+
+        keepalive_interval = 1.0 / self.frequency if self.frequency and self.link else None
+
+        while True:
+            with self.condition:
+                if not self.changes and not self.done:
+                    self.condition.wait(keepalive_interval)
+
+                if self.done:
+                    break
+
+                message = (self.pan, self.tilt, self.firing)
+
+                # Only the latest of several changes is sent
+                (changes, self.changes) = (self.changes, 0)
+                (origin, self.origin) = (self.origin if changes else None, None)
+                self.coalesced += max(0, changes - 1)
+
+            tracer.set_origin(origin)
+
+            # Without the lock, so a slow link doesn't hold up callers
+            if changes:
+                #if controls.autofire():
+                event_queue.publishTurretStatus(*message)
+
+                self.__write_to_device(message)
+
+                tracer.latency("frame to turret", origin)
+            else:
+                self.__write_to_device(message, keepalive = True)
+
+        turret_log.info("Stopping serial controller")
+
+        if self.link:
+            self.link.send_stop()
+            self.link.terminate()
+
+        self.cleanup_complete.set()
+
+    # The message is (pan, tilt, firing)
+    def __write_to_device(self, message, keepalive = False):
+        if not keepalive and self.last_message and self.last_message == message:
+            turret_log.debug("Not sending %s as identical to last sent", message)
+            return
+
+        turret_log.debug("Sending to device: %s%s", message, " to keep it awake" if keepalive else "")
+
+        if not self.link:
+            return
+
+        written = self.link.send_position(*message)
+
+        # A message that wasn't written is sent again with the next change or
+        # keepalive
+        self.last_message = message if written else None
+
+        with self.condition:
+            if not written:
+                self.dropped += 1
+            elif keepalive:
+                self.keepalives += 1
+            else:
+                self.sent += 1
+
+class BorrowedFrame:
+    def __init__(self, ring, slot, sequence, image, origin):
+        self.ring = ring
+        self.slot = slot
+        self.sequence = sequence
+        self.image = image
+        self.origin = origin
+
+        (self.frame_id, self.captured) = origin
+
+    def release(self):
+        if self.ring:
+            self.ring.release(self.slot)
+            self.ring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+#
+# A fixed set of preallocated frame buffers shared between a single writer and
+# any number of readers. The writer fills a free slot and publishes it under a
+# new sequence number; readers borrow read-only views of the latest frame, and
+# the slot is not reused until every borrower has released it. Readers detect
+# dropped frames from gaps in the sequence numbers.
+#
+# A slot may also publish a frame borrowed from another ring, in which case
+# that frame is released once the slot is no longer needed.
+#
+# Each frame carries its origin: the ID of the frame it was captured as, which
+# is its sequence number in the ring it was captured into, and the
+# time.perf_counter() at which it was captured. A frame derived from another
+# keeps the other's origin, so it can be traced back to when it was first seen.
+#
+# The writer may fill several slots at once, publishing or abandoning each in
+# turn. Shared slots are backed by named shared memory, so that other processes
+# can read a slot while it is being filled.
+#
+
+class FrameRing:
+    def __init__(self, slots = 4, shared = False):
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+        self.shared = shared
+
+        self.buffers = [ None ] * slots
+        self.memories = [ None ] * slots
+        self.views = [ None ] * slots
+        self.owners = [ None ] * slots
+        self.sequences = [ 0 ] * slots
+        self.borrowers = [ 0 ] * slots
+        self.origins = [ None ] * slots
+
+        # Shared memory already replaced by memory for a different frame size,
+        # kept mapped as stale views of it may still be around
+        self.retired = []
+
+        self.writing = set()
+        self.latest = None
+        self.sequence = 0
+        self.dropped = 0
+
+        # The newest sequence number borrowed, and whether the writer is
+        # waiting for it to change
+        self.taken = 0
+        self.awaiting_reader = False
+
+    def acquire(self, shape):
+        with self.condition:
+            slot = self.__free_slot()
+
+            if slot is None:
+                self.dropped += 1
+                return None
+
+            self.writing.add(slot)
+
+        buffer = self.buffers[slot]
+
+        if buffer is None or buffer.shape != shape:
+            buffer = self.__allocate(slot, shape)
+
+        return (slot, buffer)
+
+    def __allocate(self, slot, shape):
+        if not self.shared:
+            self.buffers[slot] = np.empty(shape, dtype = np.uint8)
+            return self.buffers[slot]
+
+        if self.memories[slot]:
+            self.memories[slot].unlink()
+            self.retired.append(self.memories[slot])
+
+        self.memories[slot] = multiprocessing.shared_memory.SharedMemory(create = True, size = int(np.prod(shape)))
+        self.buffers[slot] = np.ndarray(shape, dtype = np.uint8, buffer = self.memories[slot].buf)
+
+        return self.buffers[slot]
+
+    # The name another process can attach to, to read an acquired shared slot
+    def shared_name(self, slot):
+        return self.memories[slot].name
+
+    # Gives back an acquired slot without publishing it
+    def abandon(self, slot):
+        with self.condition:
+            self.writing.discard(slot)
+
+    def close(self):
+        with self.condition:
+            for memory in self.memories:
+                if memory:
+                    memory.unlink()
+
+            self.memories = [ None ] * len(self.memories)
+
+    # A frame derived from another is given its origin; otherwise the frame
+    # was captured when given, or now
+    def publish(self, slot, origin = None, captured = None):
+        view = self.buffers[slot].view()
+        view.flags.writeable = False
+
+        return self.__publish(slot, view, None, origin, captured)
+
+    def publish_borrowed(self, borrowed):
+        with self.condition:
+            slot = self.__free_slot()
+
+            if slot is None:
+                self.dropped += 1
+                borrowed.release()
+                return None
+
+            self.writing.add(slot)
+
+        return self.__publish(slot, borrowed.image, borrowed, borrowed.origin, None)
+
+    def __publish(self, slot, view, owner, origin, captured):
+        with self.condition:
+            self.views[slot] = view
+            self.owners[slot] = owner
+
+            self.sequence += 1
+            self.sequences[slot] = self.sequence
+            self.origins[slot] = origin or (self.sequence, captured or time.perf_counter())
+
+            previous = self.latest
+
+            self.latest = slot
+            self.writing.discard(slot)
+
+            if previous is not None:
+                self.__recycle(previous)
+
+            self.condition.notify_all()
+
+            return self.sequence
+
+    def borrow(self, after = 0, timeout = None):
+        with self.condition:
+            if self.sequence <= after:
+                self.condition.wait_for(lambda: self.sequence > after, timeout)
+
+                if self.sequence <= after:
+                    return None
+
+            slot = self.latest
+            self.borrowers[slot] += 1
+
+            self.taken = self.sequences[slot]
+
+            if self.awaiting_reader:
+                self.condition.notify_all()
+
+            return BorrowedFrame(self, slot, self.sequences[slot], self.views[slot], self.origins[slot])
+
+    # For a writer that mustn't get ahead of its reader: waits until a frame at
+    # least as new as the given sequence number has been borrowed
+    def wait_until_taken(self, sequence, timeout = None):
+        with self.condition:
+            self.awaiting_reader = True
+            taken = self.condition.wait_for(lambda: self.taken >= sequence, timeout)
+            self.awaiting_reader = False
+
+            return taken
+
+    def release(self, slot):
+        with self.condition:
+            self.borrowers[slot] -= 1
+
+            if slot != self.latest:
+                self.__recycle(slot)
+
+    def __recycle(self, slot):
+        # Hand a borrowed frame back to its own ring as soon as nobody can see it
+        if self.borrowers[slot] or not self.owners[slot]:
+            return
+
+        owner = self.owners[slot]
+
+        self.views[slot] = None
+        self.owners[slot] = None
+
+        owner.release()
+
+    def __free_slot(self):
+        free = [
+            slot for slot in range(len(self.buffers))
+            if slot != self.latest and slot not in self.writing and not self.borrowers[slot]
+        ]
+
+        if not free:
+            return None
+
+        # Reuse the slot holding the oldest frame
+        return min(free, key = lambda slot: self.sequences[slot])
+
+#
+# A recording made with --record is a directory holding:
+#
+#   segment-NNNN.mjpeg  the frames at full size, each a JPEG, one after another
+#   index.bin           a header, then a fixed size INDEX_DTYPE entry for each
+#                       frame: its ID, when it was captured, in seconds from the
+#                       first frame, and where it is in which segment
+#   detections.bin      a header, then for each frame detections were looked
+#                       for in, its ID, when it was captured, the width of the
+#                       frame the blobs were found in, the turret's pan, tilt
+#                       and firing after acting on them, and the blobs found,
+#                       each as x, y, size and Colour value
+#
+# so any frame can be found and decoded straight away, without decoding those
+# before it. Whatever was written before PSG stopped can be read back, even if
+# it stopped part way through writing an entry.
+#
+
+class Recording:
+    INDEX = "index.bin"
+    DETECTIONS = "detections.bin"
+
+    VERSION = 1
+
+    # Magic, version, frame width and height, and the time.time() of the first frame
+    INDEX_HEADER = struct.Struct("<8sHHHd")
+    INDEX_DTYPE = np.dtype([ ("frame", "<u4"), ("captured", "<f8"), ("segment", "<u2"), ("offset", "<u8"), ("length", "<u4") ])
+
+    DETECTIONS_HEADER = struct.Struct("<8sH")
+    DETECTIONS_ENTRY = struct.Struct("<IdHBBBH")
+    BLOB = struct.Struct("<fffB")
+
+    @classmethod
+    def is_recording(cls, path):
+        return os.path.isfile(os.path.join(path, cls.INDEX))
+
+    @staticmethod
+    def segment_name(segment):
+        return f"segment-{segment:04d}.mjpeg"
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(os.path.join(path, self.INDEX), "rb") as index_file:
+            header = index_file.read(self.INDEX_HEADER.size)
+            index = index_file.read()
+
+        (magic, version, self.width, self.height, self.started) = self.INDEX_HEADER.unpack(header)
+
+        if magic != b"PSGINDEX" or version != self.VERSION:
+            raise ValueError(f"{path} is not a recording PSG can read")
+
+        whole_entries = len(index) // self.INDEX_DTYPE.itemsize
+        self.index = np.frombuffer(index, dtype = self.INDEX_DTYPE, count = whole_entries)
+
+        self.detections = self.__read_detections()
+        self.segments = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def __read_detections(self):
+        detections = {}
+
+        try:
+            with open(os.path.join(self.path, self.DETECTIONS), "rb") as detections_file:
+                data = detections_file.read()
+        except FileNotFoundError:
+            return detections
+
+        offset = self.DETECTIONS_HEADER.size
+
+        while offset + self.DETECTIONS_ENTRY.size <= len(data):
+            (frame, captured, width, pan, tilt, firing, count) = self.DETECTIONS_ENTRY.unpack_from(data, offset)
+            offset += self.DETECTIONS_ENTRY.size
+
+            if offset + count * self.BLOB.size > len(data):
+                break
+
+            blobs = [ self.BLOB.unpack_from(data, offset + n * self.BLOB.size) for n in range(count) ]
+            offset += count * self.BLOB.size
+
+            detections[frame] = {
+                "captured": captured,
+                "width": width,
+                "turret": (pan, tilt, bool(firing)),
+                "blobs": [ (x, y, size, Colour(colour)) for (x, y, size, colour) in blobs ]
+            }
+
+        return detections
+
+    # The decoded image of the frame at the given position
+    def frame(self, position):
+        entry = self.index[position]
+        segment = int(entry["segment"])
+
+        if segment not in self.segments:
+            self.segments[segment] = open(os.path.join(self.path, self.segment_name(segment)), "rb")
+
+        segment_file = self.segments[segment]
+        segment_file.seek(int(entry["offset"]))
+
+        return cv2.imdecode(np.frombuffer(segment_file.read(int(entry["length"])), dtype = np.uint8), cv2.IMREAD_COLOR)
+
+    def captured(self, position):
+        return float(self.index[position]["captured"])
+
+    # What was detected in the frame at the given position, if anything was
+    # looked for, as read from detections.bin
+    def detected(self, position):
+        return self.detections.get(int(self.index[position]["frame"]))
+
+    # The position of the first frame captured at or after the given number of
+    # seconds into the recording
+    def position_at(self, seconds):
+        return min(int(np.searchsorted(self.index["captured"], seconds)), len(self.index) - 1)
+
+    def fps(self):
+        if len(self.index) < 2 or self.index["captured"][-1] <= 0:
+            return None
+
+        return (len(self.index) - 1) / self.index["captured"][-1]
+
+    def close(self):
+        for segment_file in self.segments.values():
+            segment_file.close()
+
+        self.segments = {}
+
+#
+# Writes recordings, for --record, on a thread of its own so that encoding
+# never holds up capture or detection. Frames wait to be written in a queue of
+# at most queue_length, and when it is full, the oldest or newest frame is
+# dropped, as set under [Recording] in psg.ini, and counted; where a new
+# segment is to start is kept, whichever frames are dropped. What is detected
+# in each frame is queued separately, in a queue of the same length, dropping
+# the oldest when it is full, and is kept until the first frame has been
+# written, as that is when the recording is created.
+#
+# A new segment is started after the given number of minutes or megabytes, if
+# any, and whenever the video source asks, such as at the end of each video.
+#
+
+class VideoRecorder(Daemon):
+    # Frames whose capture times the frame rate is measured over
+    RATE_SAMPLE = 30
+
+    def __init__(self, queue_length = 60, drop = "oldest", minutes = 10, megabytes = 0, quality = 90):
+        super().__init__("RecorderThread")
+
+        self.queue_length = queue_length
+        self.drop_newest = drop == "newest"
+        self.seconds_per_segment = 60 * minutes
+        self.bytes_per_segment = megabytes * 2**20
+        self.quality = quality
+
+        # Frames to write as (frame ID, captured, image), and None where a new
+        # segment is to be started, and what was detected in them, to write
+        self.frames = collections.deque()
+        self.queued = 0
+        self.detections = collections.deque()
+        self.capture_times = collections.deque(maxlen = self.RATE_SAMPLE)
+
+        self.path = None
+        self.first_captured = None
+        self.index_file = None
+        self.detections_file = None
+        self.segment = -1
+        self.segment_file = None
+        self.segment_offset = 0
+        self.when_segment_started = None
+
+        self.written = 0
+        self.dropped = 0
+        self.detections_dropped = 0
+        self.segments = 0
+
+    def record(self, frame, frame_id, captured):
+        with self.condition:
+            self.capture_times.append(captured)
+
+            if self.drop_newest and self.queued >= self.queue_length:
+                self.dropped += 1
+                return
+
+        # The capture thread reuses the frame, so it is copied, but not while
+        # holding up the writer
+        copy = frame.copy()
+
+        with self.condition:
+            if self.queued >= self.queue_length:
+                self.__drop_oldest()
+
+            self.frames.append((frame_id, captured, copy))
+            self.queued += 1
+            self.condition.notify()
+
+    # Must be called with the lock held
+    def __drop_oldest(self):
+        for (index, frame) in enumerate(self.frames):
+            if frame is not None:
+                del self.frames[index]
+                self.queued -= 1
+                self.dropped += 1
+                return
+
+    # The blobs are (keypoints, colours) as from BlobFinder.find_blobs(), found
+    # in a frame of the given width, and the turret (pan, tilt, firing)
+    def detected(self, origin, width, blobs, turret):
+        (keypoints, colours) = blobs
+
+        blob_list = [ (keypoint.pt[0], keypoint.pt[1], keypoint.size, int(colour)) for (keypoint, colour) in zip(keypoints, colours) ]
+
+        with self.condition:
+            if len(self.detections) >= self.queue_length:
+                self.detections.popleft()
+                self.detections_dropped += 1
+
+            self.detections.append((origin, width, blob_list, turret))
+            self.condition.notify()
+
+    # Frames recorded from now on go in a new segment
+    def new_segment(self):
+        with self.condition:
+            self.frames.append(None)
+            self.condition.notify()
+
+    def __fps(self):
+        if len(self.capture_times) < 2 or self.capture_times[-1] <= self.capture_times[0]:
+            return None
+
+        return (len(self.capture_times) - 1) / (self.capture_times[-1] - self.capture_times[0])
+
+    # Must be called with the lock held
+    def __detections_to_write(self):
+        return self.detections and self.detections_file
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.frames and not self.__detections_to_write() and not self.done:
+                    self.condition.wait()
+
+                if self.done and not self.frames and not self.__detections_to_write():
+                    break
+
+                frame = self.frames.popleft() if self.frames else False
+
+                if frame:
+                    self.queued -= 1
+
+            if frame is None:
+                self.__close_segment()
+            elif frame:
+                self.__write_frame(*frame)
+
+            # Those from before the first frame wait until it has created the recording
+            with self.condition:
+                detections = list(self.detections) if self.detections_file else []
+
+                if detections:
+                    self.detections.clear()
+
+            for detection in detections:
+                self.__write_detections(*detection)
+
+        self.__close()
+
+        video_log.info("Stopped recording: %d frame(s) written to %d segment(s), %d dropped", self.written, self.segments, self.dropped)
+        self.cleanup_complete.set()
+
+    def __write_frame(self, frame_id, captured, image):
+        if not self.index_file:
+            self.__open(image.shape, captured)
+
+        if self.segment_file and self.__segment_full():
+            self.__close_segment()
+
+        if not self.segment_file:
+            self.__open_segment()
+
+        (flag, encoded_image) = cv2.imencode(".jpg", image, [ cv2.IMWRITE_JPEG_QUALITY, self.quality ])
+
+        if not flag:
+            video_log.error("Failed to encode frame %s for recording", frame_id)
+            return
+
+        data = encoded_image.tobytes()
+
+        self.segment_file.write(data)
+
+        entry = np.array([ (frame_id or 0, captured - self.first_captured, self.segment, self.segment_offset, len(data)) ], dtype = Recording.INDEX_DTYPE)
+        self.index_file.write(entry.tobytes())
+
+        self.segment_offset += len(data)
+
+        with self.condition:
+            self.written += 1
+
+    def __write_detections(self, origin, width, blobs, turret):
+        (frame_id, captured) = origin
+        (pan, tilt, firing) = turret
+
+        entry = Recording.DETECTIONS_ENTRY.pack(frame_id, captured - self.first_captured, width, pan, tilt, firing, len(blobs))
+        entry += b"".join(Recording.BLOB.pack(*blob) for blob in blobs)
+
+        self.detections_file.write(entry)
+
+    def __segment_full(self):
+        if self.seconds_per_segment and time.monotonic() - self.when_segment_started >= self.seconds_per_segment:
+            return True
+
+        return self.bytes_per_segment and self.segment_offset >= self.bytes_per_segment
+
+    def __open(self, shape, captured):
+        path = f"recording-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        suffix = 1
+
+        while os.path.exists(path):
+            path = f"recording-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{suffix}"
+            suffix += 1
+
+        os.makedirs(path)
+
+        (height, width) = shape[:2]
+
+        self.path = path
+        self.first_captured = captured
+
+        # Unbuffered, so that whatever is in the index has been written to its segment
+        self.index_file = open(os.path.join(path, Recording.INDEX), "wb", buffering = 0)
+        self.index_file.write(Recording.INDEX_HEADER.pack(
+            b"PSGINDEX", Recording.VERSION, width, height, time.time() - (time.perf_counter() - captured)))
+
+        self.detections_file = open(os.path.join(path, Recording.DETECTIONS), "wb")
+        self.detections_file.write(Recording.DETECTIONS_HEADER.pack(b"PSGBLOBS", Recording.VERSION))
+
+        video_log.info("Recording %dx%d to %s", width, height, path)
+
+    def __open_segment(self):
+        self.segment += 1
+        self.segment_file = open(os.path.join(self.path, Recording.segment_name(self.segment)), "wb", buffering = 0)
+        self.segment_offset = 0
+        self.when_segment_started = time.monotonic()
+
+        with self.condition:
+            self.segments += 1
+
+    def __close_segment(self):
+        if not self.segment_file:
+            return
+
+        self.segment_file.close()
+        self.segment_file = None
+
+        video_log.info("Finished %s in %s, %d dropped so far", Recording.segment_name(self.segment), self.path, self.dropped)
+
+    def __close(self):
+        self.__close_segment()
+
+        for open_file in [ self.index_file, self.detections_file ]:
+            if open_file:
+                open_file.close()
+
+    def statistics(self):
+        with self.condition:
+            return {
+                "path": self.path,
+                "written": self.written,
+                "dropped": self.dropped,
+                "detections_dropped": self.detections_dropped,
+                "queued": self.queued,
+                "segments": self.segments,
+                "fps": self.__fps()
+            }
+
+class VideoSource(Daemon):
+    # Sources with a configuration file reload it with reload_configuration()
+    CONFIG_FILE = None
+
+    # The recorder, if any, is a VideoRecorder
+    def __init__(self, recorder, width):
+        super().__init__("VideoSource")
+        self.recorder = recorder
+        self.frames = FrameRing(slots = 6)
+        self.width = width
+
+    # Called once the frame has been published, as the given frame ID, or None
+    # if it was dropped
+    def received_frame(self, frame, frame_id, captured):
+        if self.recorder:
+            self.recorder.record(frame, frame_id, captured)
+
+    def configuration(self, *args):
+        return None
+
+    def reload_configuration(self):
+        pass
+
+    def end_of_video(self):
+        if self.recorder:
+            self.recorder.new_segment()
+
+    # For sources that mustn't get ahead of the video processor
+    def keep_pace_with_reader(self, sequence):
+        while sequence and not self.done and not self.frames.wait_until_taken(sequence, timeout = 1):
+            pass
+
+    # What this thread traces from now is part of the next frame published
+    def trace_next_frame(self):
+        if tracer.active:
+            tracer.set_origin((self.frames.sequence + 1, time.perf_counter()))
+
+    # The (width, height) of the frames published, scaled as publish_frame()
+    # scales them, or None if the source can't tell
+    def frame_size(self):
+        (_, width, height) = self.get_video_properties()
+
+        if not width or not height:
+            return None
+
+        return (self.width, int(height * self.width/float(width)))
+
+    # Returns the frame's sequence number, which is its ID, or None if it was
+    # dropped
+    def publish_frame(self, frame, captured = None):
+        (height, width) = frame.shape[:2]
+
+        # Scale as imutils.resize() would, but straight into a preallocated slot
+        if width == self.width:
+            shape = frame.shape
+        else:
+            shape = (int(height * self.width/float(width)), self.width) + frame.shape[2:]
+
+        acquired = self.frames.acquire(shape)
+
+        if not acquired:
+            video_log.debug("No free frame slot, dropping frame")
+            return None
+
+        (slot, buffer) = acquired
+
+        with metrics.stage("resize"):
+            if shape == frame.shape:
+                np.copyto(buffer, frame)
+            else:
+                cv2.resize(frame, (shape[1], shape[0]), dst = buffer, interpolation = cv2.INTER_AREA)
+
+        return self.frames.publish(slot, captured = captured)
+
+    # Returns a BorrowedFrame newer than the given sequence number, or None if
+    # none arrives within a second; the caller must release it
+    def read(self, after = 0, timeout = 1):
+        return self.frames.borrow(after, timeout = timeout)
+
+class WebCam(VideoSource):
+    def __init__(self, recorder, width):
+        super().__init__(recorder, width)
+
+        self.video_stream = cv2.VideoCapture()
+        self.video_stream.open(index = 0)
+
+    def get_video_properties(self):
+        return (
+            self.video_stream.get(cv2.CAP_PROP_FPS),
+            self.video_stream.get(cv2.CAP_PROP_FRAME_WIDTH),
+            self.video_stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        )
+
+    def run(self):
+        frame = None
+
+        while not self.done:
+            self.trace_next_frame()
+
+            # Decode into the previous frame's buffer rather than a new one
+            with metrics.stage("capture"):
+                (grabbed_frame, frame) = self.video_stream.read(frame)
+
+            if not grabbed_frame:
+                frame = None
+                continue
+
+            captured = time.perf_counter()
+
+            self.received_frame(frame, self.publish_frame(frame, captured), captured)
+
+        self.cleanup_complete.set()
+
+if sys.platform == "linux":
+    class PiCam(VideoSource):
+        CONFIG_FILE = "picam.json"
+
+        DEFAULT_CONFIGURATION = {
+            "type": "picam",
+            "brightness": 50,
+            "contrast": 0,
+            "saturation": 0,
+            "exposure_mode": "auto",
+            "ISO": 0,
+            "awb_mode": "auto"
+        }
+
+        def __init__(self, recorder, width, brightness, contrast, saturation, exposure_mode, iso, awb_mode):
+            super().__init__(recorder, width)
+            self.height = int(width * 3/4)
+
+            try:
+                with self.lock, open(self.CONFIG_FILE, "r") as config_file:
+                    self.__configuration = json.load(config_file)
+
+            except FileNotFoundError:
+                self.__configuration = self.DEFAULT_CONFIGURATION
+
+            import picamera
+
+            self.camera = picamera.PiCamera()
+            self.camera.resolution = (self.width, self.height)
+            self.camera.framerate = 32
+
+            self.__apply_configuration()
+
+            time.sleep(0.1)
+
+        def __apply_configuration(self):
+            video_log.debug("%s", self.__configuration)
+
+            self.camera.brightness = self.__configuration["brightness"]
+            self.camera.contrast = self.__configuration["contrast"]
+            self.camera.saturation = self.__configuration["saturation"]
+            self.camera.exposure_mode = self.__configuration["exposure_mode"]
+            self.camera.ISO = self.__configuration["ISO"]
+            self.camera.awb_mode = self.__configuration["awb_mode"]
+
+        def configuration(self, *args):
+            with self.condition:
+                if len(args):
+                    self.__configuration = args[0]
+
+                    self.__apply_configuration()
+
+                with open(self.CONFIG_FILE, "w") as config_file:
+                    json.dump(self.__configuration, config_file)
+
+                return self.__configuration
+
+        def reload_configuration(self):
+            try:
+                with open(self.CONFIG_FILE, "r") as config_file:
+                    configuration = json.load(config_file)
+            except FileNotFoundError:
+                return
+            except ValueError as e:
+                video_log.error("Ignoring %s: %s", self.CONFIG_FILE, e)
+                return
+
+            with self.condition:
+                # Including when configuration() has just saved it
+                if configuration == self.__configuration:
+                    return
+
+                self.__configuration = configuration
+
+                self.__apply_configuration()
+
+        def get_video_properties(self):
+            return (
+                self.camera.framerate,
+                self.width,
+                self.height
+            )
+
+        def run(self):
+            import picamera.array
+
+            raw_capture = picamera.array.PiRGBArray(self.camera, size = (self.width, self.height))
+
+            self.trace_next_frame()
+            capturing = time.perf_counter()
+
+            for frame in self.camera.capture_continuous(raw_capture, format = "bgr", use_video_port = True):
+                if self.done:
+                    break
+
+                captured = time.perf_counter()
+
+                if metrics.timing():
+                    metrics.observe("capture", captured - capturing, capturing)
+
+                self.received_frame(frame.array, self.publish_frame(frame.array, captured), captured)
+
+                raw_capture.truncate(0)
+
+                self.trace_next_frame()
+                capturing = time.perf_counter()
+
+            self.cleanup_complete.set()
+
+#
+# Keeps each video VideoFiles plays, once decoded and scaled to the width PSG
+# works at, in a file of raw frames under the given directory, so that playing
+# it again reads the frames straight from a memory mapping of the file rather
+# than decoding them. A video is cached the first time it is played through to
+# the end. Once the files come to more than the given number of megabytes, the
+# least recently played are deleted; a video bigger than that isn't cached.
+#
+# Files are named after the video's path, size and modification time, and the
+# width, so a changed video or width is decoded again.
+#
+
+class FrameCache:
+    # Magic, version, frame count, height, width, frames per second
+    HEADER = struct.Struct("<8sHIIId")
+    VERSION = 1
+    SUFFIX = ".frames"
+
+    def __init__(self, path, megabytes):
+        self.path = path
+        self.limit = int(megabytes * 1024 * 1024)
+
+        os.makedirs(path, exist_ok = True)
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def __file_name(self, video, width):
+        stat = os.stat(video)
+        key = f"{os.path.abspath(video)}|{stat.st_size}|{stat.st_mtime_ns}|{width}"
+
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest() + self.SUFFIX)
+
+    # Returns the video's frames as a read-only (frames, height, width, 3)
+    # array mapped from the cache, and its frames per second, or None if it
+    # isn't cached
+    def open(self, video, width):
+        file_name = self.__file_name(video, width)
+
+        try:
+            with open(file_name, "rb") as cache_file:
+                (magic, version, count, height, frame_width, fps) = self.HEADER.unpack(cache_file.read(self.HEADER.size))
+
+            if magic != b"PSGFRAME" or version != self.VERSION or not count:
+                raise ValueError(f"{file_name} is not a frame cache file")
+
+            frames = np.memmap(file_name, dtype = np.uint8, mode = "r", offset = self.HEADER.size, shape = (count, height, frame_width, 3))
+
+            # The modification time orders the files by when they were last played
+            os.utime(file_name)
+        except (OSError, ValueError, struct.error):
+            with self.lock:
+                self.misses += 1
+
+            return None
+
+        with self.lock:
+            self.hits += 1
+
+        video_log.debug("Playing %s from %s", video, file_name)
+
+        return (frames, fps)
+
+    # Returns a FrameCacheWriter to add the video's frames to, as they are
+    # decoded
+    def writer(self, video, width, fps):
+        return FrameCacheWriter(self, self.__file_name(video, width), width, fps)
+
+    # Deletes the least recently played files until the rest, and the given
+    # number of bytes about to be added, fit
+    def make_room(self, adding = 0):
+        cached = []
+
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(self.SUFFIX):
+                try:
+                    stat = os.stat(os.path.join(self.path, file_name))
+                except OSError:
+                    continue
+
+                cached.append((stat.st_mtime, stat.st_size, file_name))
+
+        total = sum(size for (_, size, _) in cached) + adding
+
+        for (_, size, file_name) in sorted(cached):
+            if total <= self.limit:
+                break
+
+            try:
+                # Windows won't delete a file still mapped by another VideoFiles
+                os.remove(os.path.join(self.path, file_name))
+            except OSError:
+                continue
+
+            total -= size
+
+            with self.lock:
+                self.evicted += 1
+
+            video_log.debug("Evicted %s from the frame cache", file_name)
+
+    def size(self):
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.name.endswith(self.SUFFIX))
+
+#
+# Writes a video's frames to a FrameCache file as they are decoded, scaling each
+# to the cache's width. The file only takes the place of any older one, and
+# becomes available to FrameCache.open(), once finish() is called at the end of
+# the video; abandon() deletes it.
+#
+
+class FrameCacheWriter:
+    def __init__(self, cache, file_name, width, fps):
+        self.cache = cache
+        self.file_name = file_name
+        self.width = width
+        self.fps = fps
+
+        self.cache_file = None
+        self.frame = None
+        self.count = 0
+
+    # Returns the scaled frame, which is reused for the next one
+    def write(self, frame):
+        (height, width) = frame.shape[:2]
+        shape = (int(height * self.width/float(width)), self.width, 3)
+
+        if self.frame is None:
+            self.frame = np.empty(shape, dtype = np.uint8)
+
+        with metrics.stage("resize"):
+            if frame.shape != shape:
+                cv2.resize(frame, (shape[1], shape[0]), dst = self.frame, interpolation = cv2.INTER_AREA)
+            else:
+                np.copyto(self.frame, frame)
+
+        # The header is written once the number of frames is known
+        if self.count == 0:
+            self.cache_file = open(self.file_name + ".partial", "wb")
+            self.cache_file.write(bytes(FrameCache.HEADER.size))
+
+        if self.cache_file:
+            if (self.count + 1) * self.frame.nbytes > self.cache.limit:
+                video_log.debug("%s is too big for the frame cache", self.file_name)
+                self.abandon()
+            else:
+                self.cache_file.write(self.frame.data)
+
+        self.count += 1
+
+        return self.frame
+
+    def finish(self):
+        if not self.cache_file:
+            return
+
+        (height, width) = self.frame.shape[:2]
+
+        self.cache_file.seek(0)
+        self.cache_file.write(FrameCache.HEADER.pack(b"PSGFRAME", FrameCache.VERSION, self.count, height, width, self.fps))
+        self.cache_file.close()
+        self.cache_file = None
+
+        self.cache.make_room(adding = os.path.getsize(self.file_name + ".partial"))
+
+        try:
+            os.replace(self.file_name + ".partial", self.file_name)
+        except OSError as e:
+            video_log.warning("Could not add %s to the frame cache: %s", self.file_name, e)
+
+    def abandon(self):
+        if not self.cache_file:
+            return
+
+        self.cache_file.close()
+        self.cache_file = None
+
+        with contextlib.suppress(OSError):
+            os.remove(self.file_name + ".partial")
+
+#
+# Plays video files in turn, at the speed they were recorded, and round again.
+# Unpaced, each frame is instead published as soon as the one before it has
+# been read, so that every frame is processed as fast as it can be; without
+# repeating, the thread finishes after the last video. With a FrameCache, a
+# video played before is read from the cache rather than decoded.
+#
+
+class VideoFiles(VideoSource):
+    def __init__(self, recorder, width, videos, paced = True, repeat = True, cache = None):
+        super().__init__(recorder, width)
+
+        self.video_stream = cv2.VideoCapture()
+        self.fps = None
+        self.videos = videos
+        self.paced = paced
+        self.repeat = repeat
+        self.played = 0
+
+        self.cache = cache
+        self.cache_writer = None
+
+        # The current video's frames, and the position of the next, when it is
+        # played from the cache
+        self.cached = None
+        self.position = 0
+
+        # What the video stream decodes into
+        self.decoded = None
+
+        self.__load_video()
+
+    def __load_video(self):
+        video = self.videos.pop(0)
+        self.videos.append(video)
+        self.played += 1
+
+        self.end_of_video()
+
+        video_log.debug("Playing %s", video)
+
+        (self.cached, self.position, self.cache_writer) = (None, 0, None)
+
+        if self.cache:
+            opened = self.cache.open(video, self.width)
+
+            if opened:
+                with self.condition:
+                    (self.cached, self.fps) = opened
+
+                self.video_stream.release()
+                return
+
+        self.video_stream.open(video)
+
+        with self.condition:
+            self.fps = self.video_stream.get(cv2.CAP_PROP_FPS)
+
+        if self.cache:
+            self.cache_writer = self.cache.writer(video, self.width, self.fps)
+
+    def get_video_properties(self):
+        if self.cached is not None:
+            return (self.fps, self.cached.shape[2], self.cached.shape[1])
+
+        return (
+            self.fps,
+            self.video_stream.get(cv2.CAP_PROP_FRAME_WIDTH),
+            self.video_stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        )
+
+    def __read(self):
+        if self.cached is not None:
+            if self.position >= len(self.cached):
+                return (False, None)
+
+            self.position += 1
+
+            # A view of the mapping; publish_frame() copies it into the ring
+            return (True, self.cached[self.position - 1])
+
+        (grabbed_frame, self.decoded) = self.video_stream.read(self.decoded)
+
+        if not grabbed_frame:
+            self.decoded = None
+
+            if self.cache_writer:
+                self.cache_writer.finish()
+
+            return (False, None)
+
+        if self.cache_writer:
+            return (True, self.cache_writer.write(self.decoded))
+
+        return (True, self.decoded)
+
+    def run(self):
+        while not self.done:
+            self.trace_next_frame()
+
+            with metrics.stage("capture"):
+                (grabbed_frame, frame) = self.__read()
+
+            if not grabbed_frame:
+                if not self.repeat and self.played >= len(self.videos):
+                    break
+
+                self.__load_video()
+                continue
+
+            if self.paced:
+                time.sleep(1.0/self.fps)
+
+            # As if from a camera, when the frame is due
+            captured = time.perf_counter()
+
+            sequence = self.publish_frame(frame, captured)
+            self.received_frame(frame, sequence, captured)
+
+            if not self.paced:
+                self.keep_pace_with_reader(sequence)
+
+        # Stopped part way through a video
+        if self.cache_writer:
+            self.cache_writer.abandon()
+
+        self.end_of_video()
+        self.cleanup_complete.set()
+
+#
+# Plays a recording made with --record, at the pace it was captured, or,
+# unpaced, as VideoFiles does. seek() goes straight to any frame, by position
+# or by time into the recording, without decoding those in between.
+#
+
+class RecordingSource(VideoSource):
+    def __init__(self, recorder, width, path, paced = True, repeat = True):
+        super().__init__(recorder, width)
+
+        self.recording = Recording(path)
+        self.paced = paced
+        self.repeat = repeat
+
+        if not len(self.recording):
+            raise ValueError(f"{path} has no frames recorded")
+
+        # The position of the next frame to play, and whether to play it
+        # straight away, rather than when it is due
+        self.position = 0
+        self.seeked = True
+
+    def get_video_properties(self):
+        return (self.recording.fps(), self.recording.width, self.recording.height)
+
+    def seek(self, position = None, seconds = None):
+        if position is None:
+            position = self.recording.position_at(seconds)
+
+        if not 0 <= position < len(self.recording):
+            raise ValueError(f"There are only {len(self.recording)} frames")
+
+        video_log.info("Seeking to frame %d, %.2f s into the recording", position, self.recording.captured(position))
+
+        with self.condition:
+            self.position = position
+            self.seeked = True
+            self.condition.notify()
+
+    def run(self):
+        # What time.perf_counter() the start of the recording corresponds to
+        started = None
+
+        while not self.done:
+            with self.condition:
+                if self.position >= len(self.recording):
+                    if not self.repeat:
+                        break
+
+                    self.position = 0
+                    self.seeked = True
+
+                    self.end_of_video()
+
+                position = self.position
+                self.position += 1
+
+                if self.seeked:
+                    self.seeked = False
+                    started = time.perf_counter() - self.recording.captured(position)
+
+            self.trace_next_frame()
+
+            with metrics.stage("capture"):
+                frame = self.recording.frame(position)
+
+            if self.paced:
+                with self.condition:
+                    due = started + self.recording.captured(position)
+                    self.condition.wait_for(lambda: self.done or self.seeked, max(0, due - time.perf_counter()))
+
+            captured = time.perf_counter()
+
+            sequence = self.publish_frame(frame, captured)
+            self.received_frame(frame, sequence, captured)
+
+            if not self.paced:
+                self.keep_pace_with_reader(sequence)
+
+        self.recording.close()
+
+        self.end_of_video()
+        self.cleanup_complete.set()
+
+# Plays the videos, or the recording made with --record if that is what they are
+def open_videos(recorder, width, videos, paced = True, repeat = True, cache = None):
+    if len(videos) == 1 and Recording.is_recording(videos[0]):
+        return RecordingSource(recorder, width, videos[0], paced, repeat)
+
+    return VideoFiles(recorder, width, list(videos), paced, repeat, cache)
+
+#
+# Runs BlobFinder.find_blobs() in worker processes, so detection isn't bound by
+# the GIL. Frames are handed over through shared FrameRing slots, by name, and
+# each worker has its own BlobFinder, and ConfigWatcher reloading detection.ini
+# as it changes.
+#
+# Results are returned in the order the frames were submitted. If the oldest
+# frame's result hasn't arrived within RESULT_TIMEOUT, that frame is given up
+# on, and its result discarded as stale if it turns up later.
+#
+# Workers are forked, so the pool must be created before any threads other
+# than the logging thread are started, and is only available where fork is.
+# What workers log is passed back to be written by this process.
+#
+
+class DetectionPool:
+    RESULT_TIMEOUT = 1.0
+
+    @staticmethod
+    def available():
+        return "fork" in multiprocessing.get_all_start_methods()
 
-        masked_blue = self.__threshold_and_invert(frame[:,:,0])
-        masked_green = self.__threshold_and_invert(frame[:,:,1])
-        masked_red = self.__threshold_and_invert(frame[:,:,2])
+    def __init__(self, workers):
+        context = multiprocessing.get_context("fork")
 
-        masked = cv2.bitwise_or(cv2.bitwise_or(masked_blue, masked_green), masked_red)
-        mask = cv2.merge((masked, masked, masked))
+        # Built before forking, so that the workers share it
+        Colour.table()
 
-        detection_frame = cv2.bitwise_and(frame, mask)
-        hsv_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        # Workers share the one tracker of shared memory, rather than each
+        # starting their own that would unlink it when they exit
+        multiprocessing.resource_tracker.ensure_running()
 
-        detector = self.__update_detector()
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.log_records = context.Queue()
 
-        keypoints = detector.detect(detection_frame)
+        self.workers = [
+            context.Process(target = self.work, args = (self.tasks, self.results, self.log_records), name = f"DetectionWorker{n}", daemon = True)
+            for n in range(workers)
+        ]
 
-        #logging.debug(f"Detected {len(keypoints)} sets of keypoints")
+        for worker in self.workers:
+            worker.start()
 
-        shootable_keypoints = []
+        self.log_listener = logging.handlers.QueueListener(self.log_records, *logging.getLogger().handlers)
+        self.log_listener.start()
 
-        if not keypoints and controls.autofire() and turret.is_firing():
-            logging.debug("No targets")
-            turret.fire(False)
+        # Submitted frames, oldest first: sequence -> [ context, blobs, when submitted ]
+        self.pending = collections.OrderedDict()
 
-        if keypoints:
-            safe_keypoints = []
-            other_keypoints = []
+        self.completed = 0
+        self.abandoned = 0
+        self.discarded = 0
 
-            for keypoint in keypoints:
-                point = hsv_frame[int(keypoint.pt[1])][int(keypoint.pt[0])]
-                point_colour = Colour.classifyHSV(point)
+    @staticmethod
+    def work(tasks, results, log_records):
+        # Parallelism comes from the processes
+        cv2.setNumThreads(1)
 
-                #logging.debug(point_colour.name)
+        # The logging thread wasn't forked along with this process
+        logging.getLogger().handlers = [ logging.handlers.QueueHandler(log_records) ]
 
-                if self.controls.is_safe_colour(point_colour):
-                    safe_keypoints.append(keypoint)
-                elif self.controls.is_shootable_colour(point_colour):
-                    shootable_keypoints.append(keypoint)
-                else:
-                    other_keypoints.append(keypoint)
+        watcher = ConfigWatcher()
+        blob_finder = BlobFinder(None, watcher)
+        watcher.start()
 
-            shootable_colour = (0, 0, 255)
+        # Timed whether or not metrics are enabled, as tracing may be started at any time
+        metrics.forwarded = []
+        worker = multiprocessing.current_process().name
 
-            if not controls.autofire():
-                safe_colour = (0, 255, 0)
-                other_colour = (0, 255, 255) # bgr
+        memories = {}
+
+        while True:
+            task = tasks.get()
+
+            if task is None:
+                break
+
+            (sequence, name, shape, outline) = task
+
+            if name not in memories:
+                memories[name] = multiprocessing.shared_memory.SharedMemory(name = name)
 
-                frame = cv2.drawKeypoints(
-                    frame,
-                    shootable_keypoints,
-                    frame,
-                    color = shootable_colour,
-                    flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
-
-                frame = cv2.drawKeypoints(
-                    frame,
-                    safe_keypoints,
-                    frame,
-                    color = safe_colour,
-                    flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
-
-                frame = cv2.drawKeypoints(
-                    frame,
-                    other_keypoints,
-                    frame,
-                    color = other_colour,
-                    flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+            frame = np.ndarray(shape, dtype = np.uint8, buffer = memories[name].buf)
+
+            (keypoints, colours) = blob_finder.find_blobs(frame, outline)
+
+            results.put((
+                sequence,
+                ([ (keypoint.pt[0], keypoint.pt[1], keypoint.size) for keypoint in keypoints ], colours),
+                (worker, metrics.take_forwarded())))
+
+    def busy(self):
+        return len(self.pending) >= len(self.workers)
+
+    # The context is handed back with the frame's result
+    def submit(self, sequence, context, ring, slot, outline):
+        self.pending[sequence] = [ context, None, time.monotonic() ]
+
+        self.tasks.put((sequence, ring.shared_name(slot), ring.buffers[slot].shape, outline))
+
+    # Returns (context, blobs) for each frame whose result is ready, in the
+    # order submitted, with blobs of None for frames given up on. If wait is
+    # set, waits for at least the oldest frame.
+    def collect(self, wait = False):
+        ready = []
+
+        while self.pending:
+            (sequence, (context, blobs, submitted)) = next(iter(self.pending.items()))
+
+            if blobs is not None:
+                (points, colours) = blobs
+
+                ready.append((context, ([ cv2.KeyPoint(x, y, size) for (x, y, size) in points ], colours)))
             else:
-                if shootable_keypoints:
-                    lowest_cost = None
-                    target = None
+                deadline = submitted + self.RESULT_TIMEOUT
 
-                    pan, tilt = turret.turret_position()
+                if self.__receive(max(0, deadline - time.monotonic()) if wait and not ready else 0):
+                    continue
 
-                    target_pan = pan
-                    target_tilt = tilt
-                    target_keypoint = None
+                if time.monotonic() < deadline:
+                    break
 
-                    for keypoint in shootable_keypoints:
-                        point = ScreenCoords(int(keypoint.pt[0]), int(keypoint.pt[1]))
-                        new_pan, new_tilt = calibration.calculate_turret_position(point)
+                detection_log.warning("Gave up waiting for blobs in frame %d", sequence)
 
-                        cost = abs(pan - new_pan) + abs(tilt - new_tilt)
+                ready.append((context, None))
+                self.abandoned += 1
 
-                        if lowest_cost is None or cost < lowest_cost:
-                            lowest_cost = cost
-                            target_pan = new_pan
-                            target_tilt = new_tilt
-                            target_keypoint = keypoint
+            del self.pending[sequence]
 
-                    frame = cv2.drawKeypoints(
-                        frame,
-                        [ target_keypoint ],
-                        frame,
-                        color = shootable_colour,
-                        flags = cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+        # Pick up anything else that has arrived, without waiting
+        while self.__receive(0):
+            pass
 
-                    turret.move(target_pan, target_tilt)
-                    turret.fire(True)
-                elif turret.is_firing():
-                    logging.debug("No shootable targets")
-                    turret.fire(False)
+        self.completed += sum(1 for (_, blobs) in ready if blobs is not None)
 
-        return frame
+        return ready
 
-class Scanner(Daemon):
-    def __init__(
-        self,
-        turret,
-        calibration,
-        pause_before_resuming_scanning,
-        pause_between_turret_positions,
-        turret_pan_increment
-    ):
-        super().__init__("ScannerThread")
-        self.turret = turret
+    def __receive(self, timeout):
+        try:
+            (sequence, blobs, (worker, timings)) = self.results.get(timeout = timeout) if timeout else self.results.get_nowait()
+        except queue.Empty:
+            return False
+
+        # The sequence number is the frame's ID
+        for (stage, seconds, started) in timings:
+            metrics.observe(stage, seconds, started, (sequence, None), worker)
+
+        if sequence in self.pending:
+            self.pending[sequence][1] = blobs
+        else:
+            self.discarded += 1
+
+        return True
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+
+        for worker in self.workers:
+            worker.join(1)
+
+            if worker.is_alive():
+                worker.terminate()
+
+        self.tasks.close()
+        self.tasks.join_thread()
+
+        self.log_listener.stop()
+
+class VideoProcessor(Daemon):
+    # How long to wait for a new frame while blobs are still being found in
+    # earlier ones, before checking for their results again
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, controls, calibration, turret, video_source, pool = None, watcher = None):
+        super().__init__("VideoThread")
+
+        self.pool = pool
+        self.frames = FrameRing(slots = 4 + len(pool.workers), shared = True) if pool else FrameRing()
+        self.video_source = video_source
+        self.controls = controls
         self.calibration = calibration
-        self.__turret_active()
-        self.enabled = False
-        self.when_next_move = None
-        self.panning_left = True # otherwise panning right
-        self.pause_before_resuming_scanning = pause_before_resuming_scanning
-        self.pause_between_turret_positions = pause_between_turret_positions
-        self.turret_pan_increment = turret_pan_increment
+        self.turret = turret
+        self.blob_finder = BlobFinder(self.controls, watcher)
 
-    def __turret_active(self):
-        self.when_last_active = datetime.datetime.now().timestamp()
+        # Whether the last detections published had any blobs to draw
+        self.detections_shown = False
 
-    def turret_active(self):
-        with self.condition:
-            self.__turret_active()
+    def run(self):
+        sequence = 0
 
-            self.condition.notify()
+        while not self.done:
+            if self.pool:
+                self.__apply(self.pool.collect(wait = self.pool.busy()))
 
-    def enable(self, enabled):
+            waiting = time.perf_counter()
+
+            frame = self.video_source.read(sequence, timeout = self.POLL_INTERVAL if self.pool and self.pool.pending else 1)
+
+            if frame is None:
+                continue
+
+            tracer.set_origin(frame.origin)
+            tracer.complete("wait for frame", waiting, time.perf_counter() - waiting)
+
+            if frame.sequence > sequence + 1 and sequence:
+                video_log.debug("Skipped %d frame(s) before frame %d", frame.sequence - sequence - 1, frame.sequence)
+
+            sequence = frame.sequence
+
+            # The same controls apply throughout the frame
+            controls = self.controls.snapshot()
+
+            if not (controls.tracking or controls.autofire):
+                # Finish the frames already being worked on, so frames are published in order
+                while self.pool and self.pool.pending:
+                    self.__apply(self.pool.collect(wait = True))
+
+                # Nothing to draw, so pass the captured frame straight through
+                if self.detections_shown:
+                    self.__publish_detections(frame.origin, frame.image.shape)
+
+                self.frames.publish_borrowed(frame)
+                continue
+
+            with frame:
+                acquired = self.frames.acquire(frame.image.shape)
+
+                if not acquired:
+                    continue
+
+                (slot, buffer) = acquired
+
+                np.copyto(buffer, frame.image)
+
+            if self.pool:
+                self.pool.submit(sequence, (slot, buffer, frame.origin), self.frames, slot, self.blob_finder.grid_outline(self.calibration))
+            else:
+                blobs = self.blob_finder.find_blobs(buffer, self.blob_finder.grid_outline(self.calibration))
+                found = self.blob_finder.act_on_blobs(buffer, blobs, self.calibration, self.turret, controls)
+                self.__detected(frame.origin, buffer, blobs, found, controls)
+                self.frames.publish(slot, frame.origin)
+
+        if self.pool:
+            self.pool.close()
+
+        self.frames.close()
+
+        video_log.info("Stopping video stream")
+        self.cleanup_complete.set()
+
+    def __apply(self, ready):
+        for ((slot, buffer, origin), blobs) in ready:
+            if blobs is None:
+                self.frames.abandon(slot)
+                continue
+
+            tracer.set_origin(origin)
+
+            controls = self.controls.snapshot()
+
+            found = self.blob_finder.act_on_blobs(buffer, blobs, self.calibration, self.turret, controls)
+            self.__detected(origin, buffer, blobs, found, controls)
+            self.frames.publish(slot, origin)
+
+    # What was found in the frame goes alongside it in the recording, if any,
+    # and to /detections
+    def __detected(self, origin, image, blobs, found, controls):
+        recorder = self.video_source.recorder
+
+        if recorder:
+            recorder.detected(origin, image.shape[1], blobs, self.turret.turret_position() + (self.turret.is_firing(),))
+
+        self.__publish_detections(origin, image.shape, blobs, found, controls.autofire)
+
+    # For the browser to draw over the frame, as act_on_blobs() would have: every
+    # blob, or with autofire, only the target
+    def __publish_detections(self, origin, shape, blobs = ((), ()), found = (None, None), autofire = False):
+        (keypoints, colours) = blobs
+        (categories, target) = found
+
+        described = []
+
+        for (index, keypoint) in enumerate(keypoints):
+            category = int(categories[index])
+
+            described.append({
+                "x": round(float(keypoint.pt[0]), 1),
+                "y": round(float(keypoint.pt[1]), 1),
+                "size": round(float(keypoint.size), 1),
+                "colour": Colour(int(colours[index])).name,
+                "category": "safe" if category & TurretControls.SAFE else "shootable" if category & TurretControls.SHOOTABLE else "other",
+                "target": index == target
+            })
+
+        event_queue.publish("detections", {
+            "frame": origin[0] if origin else None,
+            "width": shape[1],
+            "height": shape[0],
+            "autofire": autofire,
+            "blobs": described
+        })
+
+        self.detections_shown = bool(described)
+
+#
+# Encodes each processed frame once per distinct (JPEG quality, scale) profile,
+# however many viewers are watching, and hands the same multipart chunk to every
+# subscriber of that profile. Each subscriber keeps its own sequence cursor, so
+# it waits for a new frame rather than re-sending the current one, and a viewer
+# that falls behind simply skips to the latest frame.
+#
+
+class StreamProfile:
+    def __init__(self):
+        self.subscribers = 0
+        self.sequence = 0
+        self.chunk = None
+        self.origin = None
+
+#
+# Per-viewer controller that steps JPEG quality and scale down, below the
+# limits the viewer asked for, while sending a frame takes a large part of the
+# time between frames, and back up again once the link has recovered.
+#
+
+class StreamController:
+    # (quality, scale) multipliers, from best to cheapest
+    STEPS = [ (1.0, 1.0), (0.8, 1.0), (0.6, 1.0), (0.6, 0.75), (0.5, 0.5), (0.4, 0.5), (0.3, 0.25) ]
+
+    MINIMUM_QUALITY = 10
+
+    CONGESTED = 0.5 # of the frame interval
+    RECOVERED = 0.15
+
+    DOWNGRADE_HOLD = 1 # seconds
+    UPGRADE_HOLD = 5
+
+    def __init__(self, quality, scale, adaptive):
+        self.quality = quality
+        self.scale = scale
+        self.adaptive = adaptive
+
+        self.step = 0
+        self.send_time = 0
+        self.when_last_changed = time.monotonic()
+
+    def profile(self):
+        (quality_factor, scale_factor) = self.STEPS[self.step]
+
+        # Round so that viewers on similar settings share the same encoding
+        quality = max(self.MINIMUM_QUALITY, 5 * round(self.quality * quality_factor / 5))
+        scale = round(self.scale * scale_factor, 2)
+
+        return (quality, scale)
+
+    def sent(self, send_time, frame_interval):
+        if not self.adaptive or not frame_interval:
+            return self.profile()
+
+        self.send_time = 0.8 * self.send_time + 0.2 * send_time
+
+        now = time.monotonic()
+        held = now - self.when_last_changed
+
+        if self.send_time > self.CONGESTED * frame_interval and held > self.DOWNGRADE_HOLD:
+            if self.step < len(self.STEPS) - 1:
+                self.step += 1
+                self.when_last_changed = now
+
+                stream_log.debug("Viewer congested (%.1f ms per frame), stepping down to %s", self.send_time * 1000, self.profile())
+        elif self.send_time < self.RECOVERED * frame_interval and held > self.UPGRADE_HOLD:
+            if self.step > 0:
+                self.step -= 1
+                self.when_last_changed = now
+
+                stream_log.debug("Viewer recovered (%.1f ms per frame), stepping up to %s", self.send_time * 1000, self.profile())
+
+        return self.profile()
+
+class MJPEGBroadcaster(Daemon):
+    # Keep the kernel from queueing seconds of stale frames for a slow viewer
+    SEND_BUFFER_SIZE = 32768
+
+    def __init__(self, frames, quality = 95, scale = 1.0, max_fps = 0, adaptive = True):
+        super().__init__("EncoderThread")
+
+        self.frames = frames
+        self.profiles = {}
+        self.frames_encoded = 0
+        self.frame_interval = None
+        self.when_last_frame = None
+
+        self.quality = quality
+        self.scale = scale
+        self.max_fps = max_fps
+        self.adaptive = adaptive
+
+        self.listeners = []
+
+    # Defaults for viewers connecting from now on
+    def configure(self, quality, scale, max_fps, adaptive):
         with self.condition:
-            self.enabled = enabled
+            (self.quality, self.scale, self.max_fps, self.adaptive) = (quality, scale, max_fps, adaptive)
 
-            self.condition.notify()
+    # Callbacks are made with the lock held, so must not block
+    def add_listener(self, callback):
+        with self.condition:
+            self.listeners.append(callback)
 
     def run(self):
+        sequence = 0
+
         while not self.done:
             with self.condition:
-                if not self.enabled:
-                    self.when_next_move = None
-
-                    logging.debug("Waiting for scanner to be enabled")
+                if not self.profiles:
                     self.condition.wait()
                     continue
 
-                now = datetime.datetime.now().timestamp()
+                profiles = list(self.profiles.items())
 
-                if self.when_last_active + self.pause_before_resuming_scanning > now:
-                    self.when_next_move = None
+            waiting = time.perf_counter()
 
-                    self.condition.wait(self.pause_before_resuming_scanning - (now - self.when_last_active))
-                    continue
+            frame = self.frames.borrow(sequence, timeout = 1)
 
-                if self.when_next_move and self.when_next_move > now:
-                    self.condition.wait(self.when_next_move - now)
+            if frame is None:
+                continue
+
+            tracer.set_origin(frame.origin)
+            tracer.complete("wait for frame", waiting, time.perf_counter() - waiting)
+
+            chunks = []
+
+            with frame:
+                sequence = frame.sequence
+
+                for ((quality, scale), profile) in profiles:
+                    chunks.append((profile, self.__encode(frame.image, quality, scale)))
+
+            now = time.monotonic()
+
+            with self.condition:
+                for (profile, chunk) in chunks:
+                    if chunk:
+                        profile.sequence = sequence
+                        profile.chunk = chunk
+                        profile.origin = frame.origin
+
+                self.frames_encoded += len(chunks)
+
+                if self.when_last_frame:
+                    interval = now - self.when_last_frame
+                    self.frame_interval = interval if not self.frame_interval else 0.9 * self.frame_interval + 0.1 * interval
+
+                self.when_last_frame = now
+
+                self.condition.notify_all()
+
+                for listener in self.listeners:
+                    listener()
+
+        stream_log.info("Stopping video encoder")
+        self.cleanup_complete.set()
+
+    def __encode(self, image, quality, scale):
+        if scale < 1:
+            (height, width) = image.shape[:2]
+            image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation = cv2.INTER_AREA)
+
+        with metrics.stage("encode"):
+            (flag, encoded_image) = cv2.imencode("*.jpg", image, [ cv2.IMWRITE_JPEG_QUALITY, quality ])
+
+        if not flag:
+            stream_log.error("Failed to encode video frame")
+            return None
+
+        return (
+            b"--frame\r\n"
+            b"Content-Type: image/jpeg\r\n\r\n" +
+            encoded_image.tobytes() +
+            b"\r\n")
+
+    def subscribe(self, key):
+        with self.condition:
+            profile = self.profiles.get(key)
+
+            if not profile:
+                profile = StreamProfile()
+                self.profiles[key] = profile
+
+            profile.subscribers += 1
+
+            self.condition.notify_all()
+
+            return profile
+
+    def unsubscribe(self, key):
+        with self.condition:
+            profile = self.profiles[key]
+            profile.subscribers -= 1
+
+            if not profile.subscribers:
+                del self.profiles[key]
+
+    # Returns (sequence, chunk, origin of the frame), with a chunk of None if
+    # there isn't a newer one
+    def latest(self, profile, after):
+        with self.condition:
+            if profile.sequence <= after:
+                return (after, None, None)
+
+            return (profile.sequence, profile.chunk, profile.origin)
+
+    def next_chunk(self, profile, after):
+        with self.condition:
+            if profile.sequence <= after:
+                self.condition.wait_for(lambda: self.done or profile.sequence > after, 1) # 1 second
+
+                if profile.sequence <= after:
+                    return (after, None, None)
+
+            return (profile.sequence, profile.chunk, profile.origin)
+
+    # Any limit not given by the viewer falls back to the configured default
+    def viewer(self, quality = None, scale = None, max_fps = None, adaptive = None):
+        with self.condition:
+            defaults = (self.quality, self.scale, self.max_fps, self.adaptive)
+
+        return StreamViewer(
+            self,
+            quality or defaults[0],
+            scale or defaults[1],
+            defaults[2] if max_fps is None else max_fps,
+            defaults[3] if adaptive is None else adaptive)
+
+    # Generator function to produce frames for a single viewer
+    def stream(self, *args):
+        viewer = self.viewer(*args)
+
+        try:
+            sequence = 0
+
+            while not self.done:
+                delay = viewer.delay()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+                (sequence, chunk, origin) = self.next_chunk(viewer.profile, sequence)
+
+                if chunk is None:
+                    stream_log.info("Waiting for video...")
                     continue
 
-                # Time to move the turret!
+                when_sent = time.monotonic()
 
-                logging.debug("Moving turret as part of scan")
+                yield chunk
 
-                current_pan, _ = self.turret.turret_position()
+                # The server only asks for the next chunk once this one has been written
+                viewer.sent(when_sent, time.monotonic() - when_sent, origin)
+        finally:
+            viewer.close()
 
-                (pan_left_limit, pan_right_limit) = self.calibration.pan_limits()
-                (tilt_up_limit, tilt_down_limit) = self.calibration.tilt_limits()
+# A single viewer's subscription to an MJPEGBroadcaster
+class StreamViewer:
+    def __init__(self, broadcaster, quality, scale, max_fps, adaptive):
+        self.broadcaster = broadcaster
+        self.controller = StreamController(quality, scale, adaptive)
+        self.max_fps = max_fps
+        self.when_next_due = 0
+
+        self.key = self.controller.profile()
+        self.profile = broadcaster.subscribe(self.key)
+
+        stream_log.debug("Viewer connected at quality %s, scale %s, max %s fps", quality, scale, max_fps or "unlimited")
+
+    # How long to hold off before the next frame to stay within max_fps
+    def delay(self):
+        if not self.max_fps:
+            return 0
+
+        return self.when_next_due - time.monotonic()
+
+    def sent(self, when_sent, send_time, origin = None):
+        if tracer.active:
+            tracer.complete("send", time.perf_counter() - send_time, send_time, origin)
+            tracer.latency("frame to viewer", origin)
+
+        if self.max_fps:
+            self.when_next_due = when_sent + 1.0/self.max_fps
+
+        frame_interval = max(self.broadcaster.frame_interval or 0, 1.0/self.max_fps if self.max_fps else 0)
+
+        key = self.controller.sent(send_time, frame_interval)
+
+        if key != self.key:
+            self.broadcaster.unsubscribe(self.key)
+            self.profile = self.broadcaster.subscribe(key)
+            self.key = key
+
+    def close(self):
+        self.broadcaster.unsubscribe(self.key)
+
+        stream_log.debug("Viewer disconnected")
+
+#
+# Wakes every coroutine waiting on it when notify() is called from any thread.
+# Waiters take the current event before checking for work, so a notification
+# arriving between the check and the wait is not lost.
+#
+
+class AsyncNotifier:
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.__wake)
+
+    def __wake(self):
+        self.event.set()
+        self.event = asyncio.Event()
+
+    async def wait(self, event, timeout):
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+#
+# ASGI application for running under an asyncio server. The video and event
+# streams are served as coroutines, so an idle viewer costs no thread; every
+# other route is handed to the Flask application on a small thread pool.
+#
+
+class AsyncServer:
+    def __init__(self, app, broadcaster, events):
+        import asgiref.wsgi
+
+        self.wsgi = asgiref.wsgi.WsgiToAsgi(app)
+        self.broadcaster = broadcaster
+        self.events = events
+
+        self.frames_notifier = None
+        self.events_notifier = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.__lifespan(receive, send)
+        elif scope["type"] == "http" and scope["path"] == "/video":
+            await self.__video(scope, receive, send)
+        elif scope["type"] == "http" and scope["path"] == "/events":
+            await self.__events(scope, receive, send, [ "turret" ])
+        elif scope["type"] == "http" and scope["path"] == "/detections":
+            await self.__events(scope, receive, send, [ "detections" ])
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def __lifespan(self, receive, send):
+        while True:
+            message = await receive()
+
+            if message["type"] == "lifespan.startup":
+                loop = asyncio.get_running_loop()
+
+                self.frames_notifier = AsyncNotifier(loop)
+                self.events_notifier = AsyncNotifier(loop)
+
+                self.broadcaster.add_listener(self.frames_notifier.notify)
+                self.events.add_listener(self.events_notifier.notify)
+
+                await send({ "type": "lifespan.startup.complete" })
+            elif message["type"] == "lifespan.shutdown":
+                await send({ "type": "lifespan.shutdown.complete" })
+                return
+
+    @staticmethod
+    async def __watch_for_disconnect(receive, disconnected):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+        disconnected.set()
+
+    @staticmethod
+    async def __respond(send, status, body = b""):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [ (b"content-type", b"text/plain") ]
+        })
+        await send({ "type": "http.response.body", "body": body })
+
+    async def __video(self, scope, receive, send):
+        arguments = werkzeug.datastructures.MultiDict(
+            urllib.parse.parse_qsl(scope["query_string"].decode("latin-1")))
+
+        (options, error) = stream_options(arguments)
+
+        if error:
+            await self.__respond(send, http.HTTPStatus.BAD_REQUEST, error.encode("utf_8"))
+            return
+
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(self.__watch_for_disconnect(receive, disconnected))
+
+        viewer = self.broadcaster.viewer(*options)
+
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": http.HTTPStatus.OK,
+                "headers": [ (b"content-type", b"multipart/x-mixed-replace; boundary=frame") ]
+            })
+
+            sequence = 0
+
+            while not disconnected.is_set() and not self.broadcaster.done:
+                delay = viewer.delay()
+
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                event = self.frames_notifier.event
+
+                (sequence, chunk, origin) = self.broadcaster.latest(viewer.profile, sequence)
+
+                if chunk is None:
+                    await self.frames_notifier.wait(event, 1) # 1 second
+                    continue
 
-                new_tilt = tilt_up_limit + int((tilt_down_limit - tilt_up_limit)/2)
+                when_sent = time.monotonic()
 
-                if self.panning_left:
-                    if current_pan + self.turret_pan_increment > pan_left_limit:
-                        self.panning_left = False
-                        continue
+                # The server holds this back while the client's buffer is full
+                await send({ "type": "http.response.body", "body": chunk, "more_body": True })
 
-                    new_pan = current_pan + self.turret_pan_increment
-                else:
-                    if current_pan - self.turret_pan_increment < pan_right_limit:
-                        self.panning_left = True
-                        continue
+                viewer.sent(when_sent, time.monotonic() - when_sent, origin)
+        finally:
+            viewer.close()
+            watcher.cancel()
 
-                    new_pan = current_pan - self.turret_pan_increment
+    async def __events(self, scope, receive, send, kinds):
+        disconnected = asyncio.Event()
+        watcher = asyncio.create_task(self.__watch_for_disconnect(receive, disconnected))
 
-                self.turret.move(new_pan, new_tilt)
-                self.when_next_move = now + self.pause_between_turret_positions
-                continue
+        subscriber = self.events.subscribe(kinds)
 
-        logging.info("Stopping scanner")
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": http.HTTPStatus.OK,
+                "headers": [ (b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache") ]
+            })
+            await send({ "type": "http.response.body", "body": f"retry: {self.events.RETRY}\n\n".encode("utf_8"), "more_body": True })
 
-        self.cleanup_complete.set()
+            while not disconnected.is_set() and self.events.running:
+                delay = subscriber.delay()
 
-class TurretController(Daemon):
-    def __init__(self, comport = None, baudrate = None, frequency = 0.5):
-        super().__init__("TurretThread")
-        self.serial = serial.Serial(port = comport, baudrate = baudrate) if comport else None
+                if delay > 0:
+                    await asyncio.sleep(delay)
 
-        self.pan = 0
-        self.tilt = 0
-        self.firing = False
-        self.frequency = frequency
-        self.always_fire = False
+                event = self.events_notifier.event
 
-        self.last_message = None
+                message = subscriber.take()
 
-        self.move(self.pan, self.tilt)
+                if message is None:
+                    await self.events_notifier.wait(event, min(1, subscriber.until_heartbeat())) # 1 second at most
+                    continue
 
-    def alwaysfire(self, enabled):
-        with self.condition:
-            self.always_fire = enabled
-            self.firing = enabled
+                await send({ "type": "http.response.body", "body": message.encode("utf_8"), "more_body": True })
+        finally:
+            subscriber.close()
+            watcher.cancel()
 
-            self.condition.notify()
+    def run(self, host, port):
+        import uvicorn
 
-    def turret_position(self):
-        with self.condition:
-            return (self.pan, self.tilt)
+        # Accepted connections inherit the listening socket's send buffer size
+        listener = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MJPEGBroadcaster.SEND_BUFFER_SIZE)
+        listener.bind((host, port))
 
-    def turret_position_str(self):
-        with self.condition:
-            return self.__turret_position_str()
-            
+        server = uvicorn.Server(uvicorn.Config(self, lifespan = "on", log_config = None, access_log = False))
+        server.run(sockets = [ listener ])
 
-    def __turret_position_str(self):
-        return f"({self.pan}\N{DEGREE SIGN}, {self.tilt}\N{DEGREE SIGN})"
+#
+# Recorded video and a made up calibration, for the benchmarks in benchmarks.py
+# and the tests
+#
 
-    def is_firing(self):
-        with self.condition:
-            return self.firing
+# Decodes up to limit frames, spread across the videos, scaled as VideoSource would
+def recorded_frames(videos, width, limit):
+    frames = []
 
-    def fire(self, firing):
-        with self.condition:
-            if self.always_fire:
-                return
+    for video in videos:
+        if Recording.is_recording(video):
+            recording = Recording(video)
+            read = lambda position: (position < len(recording), recording.frame(position) if position < len(recording) else None)
+            release = recording.close
+        else:
+            video_stream = cv2.VideoCapture(video)
+            read = lambda _: video_stream.read()
+            release = video_stream.release
 
-            if self.firing == firing:
-                return
+        for position in range(limit // len(videos)):
+            (grabbed_frame, frame) = read(position)
 
-            self.firing = firing
+            if not grabbed_frame:
+                break
 
-            self.condition.notify()
+            (height, frame_width) = frame.shape[:2]
+            frames.append(cv2.resize(frame, (width, int(height * width/float(frame_width))), interpolation = cv2.INTER_AREA))
+
+        release()
+
+    return frames
+
+# An uneven grid, as clicked by hand, over most of the frame
+def made_up_calibration(width, height):
+    random = np.random.default_rng(1)
+    xs = np.linspace(0.1 * width, 0.9 * width, Calibration.NUM_COLS)
+    ys = np.linspace(0.1 * height, 0.9 * height, Calibration.NUM_ROWS)
+
+    return {
+        "pan_left": 180,
+        "pan_right": 0,
+        "tilt_up": 0,
+        "tilt_down": 180,
+        "grid": {
+            "x": [ [ int(x + random.integers(-8, 8)) for x in xs ] for _ in ys ],
+            "y": [ [ int(y + random.integers(-8, 8)) for _ in xs ] for y in ys ],
+            "pan": [ 150, 120, 90, 60, 30 ],
+            "tilt": [ 40, 65, 90, 115, 140 ]
+        }
+    }
 
-    def move(self, pan, tilt):
-        if pan < 0 or pan > 180:
-            logging.warning(f"Pan {pan}\N{DEGREE SIGN} out of range, changing to be within 0..180")
-            pan = 0 if pan < 0 else pan
-            pan = 180 if pan > 180 else pan
+#
+# When PSG reached each stage of starting up, in seconds from STARTED: being
+# imported, the turret's serial port and the camera being opened, the web
+# application being ready, and the video processor publishing its first frame,
+# ready to stream. They are logged once the first frame is reached, and shown
+# on /metrics.
+#
 
-        if tilt < 0 or tilt > 180:
-            logging.warning(f"Tilt {tilt}\N{DEGREE SIGN} out of range, changing to be within 0..180")
-            tilt = 0 if tilt < 0 else tilt
-            tilt = 180 if tilt > 180 else tilt
+class Startup:
+    MILESTONES = [ "imported", "turret", "camera", "web", "first frame" ]
 
-        with self.condition:
-            if pan == self.pan and tilt == self.tilt:
-                logging.debug(f"Turret already at {self.__turret_position_str()}, not moving")
-                return
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.milestones = {}
+        self.first_frame = threading.Event()
 
-            logging.info(f"Moving turret to pan {pan}\N{DEGREE SIGN}, tilt {tilt}\N{DEGREE SIGN}")
+    def reached(self, milestone):
+        seconds = time.perf_counter() - STARTED
 
-            self.pan = pan
-            self.tilt = tilt
+        with self.lock:
+            self.milestones.setdefault(milestone, seconds)
 
-            self.condition.notify()
+    # NaN until it is reached, as Prometheus expects
+    def seconds(self, milestone):
+        with self.lock:
+            return self.milestones.get(milestone, math.nan)
 
-    def run(self):
-        while True:
-            with self.condition:
-                self.condition.wait()
+    def results(self):
+        with self.lock:
+            return dict(self.milestones)
 
-                if self.done:
-                    break
+    # Waits on a thread of its own for the first frame to be published
+    def watch_for_first_frame(self, frames):
+        def wait():
+            with frames.borrow(0):
+                self.reached("first frame")
 
-                message = f"a{self.pan:03d}{self.tilt:03d}{int(self.firing)}"
+            log.info("Started in %.2f s: %s", self.seconds("first frame"),
+                ", ".join(f"{milestone} {seconds:.2f} s" for (milestone, seconds) in self.results().items()))
 
-                #if controls.autofire():
-                event_queue.publishTurretStatus(self.pan, self.tilt, self.firing)
+            self.first_frame.set()
 
-                self.__write_to_device(message)
+        threading.Thread(target = wait, name = "Startup", daemon = True).start()
 
-                #self.condition.wait(0.1)
-                #if self.frequency:
-                #    self.condition.wait(1.0/self.frequency)
-                #else:
-                #    self.condition.wait()
+startup = Startup()
 
-        logging.info("Stopping serial controller")
+# Settings from psg.ini that may change while running
+def stream_settings(config):
+    return (
+        config.getint("Video", "Stream JPEG quality", fallback = 95),
+        config.getfloat("Video", "Stream scale", fallback = 1.0),
+        config.getfloat("Video", "Stream maximum fps", fallback = 0),
+        config.getboolean("Video", "Adaptive streaming", fallback = True))
 
-        self.__write_to_device("z0000000")
+def scanning_settings(config):
+    return (
+        config.getfloat("Scanning", "Pause before resuming scanning", fallback = 2.0),
+        config.getfloat("Scanning", "Pause between turret positions", fallback = 0.7),
+        config.getint("Scanning", "Turret pan increment", fallback = 10))
 
-        self.cleanup_complete.set()
+# Returns the (quality, scale, fps, adaptive) requested of /video, or an error
+def stream_options(arguments):
+    quality = arguments.get("quality", type = int)
+    scale = arguments.get("scale", type = float)
+    max_fps = arguments.get("fps", type = float)
+    adaptive = arguments.get("adaptive", type = lambda s: s.lower() in [ "1", "yes", "true", "on" ])
 
-    def __write_to_device(self, message):
-        if self.last_message and self.last_message == message:
-            logging.debug(f"Not sending {message} as identical to last sent")
-            return
+    if quality is not None and not 1 <= quality <= 100:
+        return (None, "quality must be between 1 and 100")
 
-        logging.debug(f"Sending to device: {message}")
+    if scale is not None and not 0 < scale <= 1:
+        return (None, "scale must be greater than 0 and at most 1")
 
-        if self.serial:
-            self.serial.write(bytearray(message, "utf_8"))
-            self.last_message = message
+    if max_fps is not None and max_fps < 0:
+        return (None, "fps cannot be negative")
 
-class VideoSource(Daemon):
-    def __init__(self, record, width):
-        super().__init__("VideoSource")
-        self.record = record
-        self.frame = None
-        self.capture = None
-        self.width = width
+    return ((quality, scale, max_fps, adaptive), None)
 
-    def received_frame(self, frame):
-        if not self.record:
-            return
+#
+# PSG itself: the turret, the camera or videos and everything else, built from
+# psg.ini and the command line by create_app(). Nothing runs until start().
+#
+# Opening the turret's serial port, opening the camera and importing Flask can
+# each take a second or more on a Raspberry Pi, so they are done in parallel.
+#
 
-        if not self.capture:
-            self.__start_recording()
+class PSG:
+    def __init__(self, config, args, videos):
+        self.config = config
 
-        self.capture.write(frame)
+        # Worker processes are forked, so must be started before any threads
+        self.detection_pool = self.__detection_pool(config)
 
-    def configuration(self, *args):
-        return None
+        self.controls = TurretControls()
+        event_queue.controls = self.controls
 
-    def end_of_video(self):
-        self.__stop_recording()
+        self.calibration = Calibration()
+        self.calibration.load()
 
-    def __start_recording(self):
-        if not self.record:
-            return
+        self.recorder = self.__recorder(config) if args.record else None
 
-        self.__stop_recording()
+        self.frame_cache = None
 
-        output_filename = f"recording-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.avi"
+        if videos and config.get("Video", "Frame cache", fallback = ""):
+            self.frame_cache = FrameCache(
+                config.get("Video", "Frame cache"),
+                config.getfloat("Video", "Frame cache megabytes", fallback = 1024))
 
-        (fps, width, height) = self.get_video_properties()
+        with concurrent.futures.ThreadPoolExecutor(max_workers = 3, thread_name_prefix = "Startup") as executor:
+            turret = executor.submit(self.__open_turret, config, args.com_port)
+            camera = executor.submit(self.__open_camera, config, args, videos)
+            web = executor.submit(import_now, flask)
 
-        logging.debug(f"Writing video ({width}x{height} @ {fps} fps to {output_filename}")
+            self.controller = turret.result()
+            self.video_source = camera.result()
+            web.result()
 
-        self.capture = cv2.VideoWriter(
-            output_filename,
-            cv2.VideoWriter_fourcc(*'XVID'),
-            20.0,
-            (int(width), int(height))
-        )
-    
-    def __stop_recording(self):
-        if self.capture:
-            self.capture.release()
+        # The turret position for every pixel is worked out now the size is known
+        self.calibration.set_frame_size(self.video_source.frame_size())
 
-    def read(self):
-        while True:
-            with self.condition:
-                if self.frame is None:
-                    self.condition.wait(1) # 1 second
-                    continue
+        self.config_watcher = ConfigWatcher()
 
-                frame = self.frame
-                frame = imutils.resize(frame, width = self.width)
+        self.video_processor = VideoProcessor(self.controls, self.calibration, self.controller, self.video_source, self.detection_pool, self.config_watcher)
+        self.broadcaster = MJPEGBroadcaster(self.video_processor.frames, *stream_settings(config))
+        self.scanner = Scanner(self.controller, self.calibration, *scanning_settings(config))
 
-                self.frame = None
+        self.video_processor.blob_finder.annotate = config.getboolean("Video", "Annotate frames", fallback = False)
 
-                return frame
+        self.__register_metrics()
 
-class WebCam(VideoSource):
-    def __init__(self, record, width):
-        super().__init__(record, width)
+        self.config_watcher.watch("psg.ini", self.reload_settings)
+        self.config_watcher.watch(Calibration.CONFIG_FILE, self.calibration.load)
 
-        self.video_stream = cv2.VideoCapture()
-        self.video_stream.open(index = 0)
+        if self.video_source.CONFIG_FILE:
+            self.config_watcher.watch(self.video_source.CONFIG_FILE, self.video_source.reload_configuration)
 
-    def get_video_properties(self):
-        return (
-            self.video_stream.get(cv2.CAP_PROP_FPS),
-            self.video_stream.get(cv2.CAP_PROP_FRAME_WIDTH),
-            self.video_stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        )
+    def __detection_pool(self, config):
+        detection_workers = config.getint("Video", "Detection workers", fallback = 0)
 
-    def run(self):
-        while not self.done:
-            (grabbed_frame, frame) = self.video_stream.read()
+        if detection_workers <= 0:
+            return None
 
-            if not grabbed_frame:
-                continue
+        if not DetectionPool.available():
+            detection_log.warning("Detection workers need fork(), which isn't available here, so finding blobs on the video thread")
+            return None
 
-            with self.condition:
-                self.received_frame(frame)
+        # So that the workers share it, rather than each importing it
+        import_now(cv2)
 
-                self.frame = frame.copy()
-                self.condition.notify_all()
+        detection_log.info("Finding blobs in %d worker process(es)", detection_workers)
 
-        self.cleanup_complete.set()
+        return DetectionPool(detection_workers)
 
-if sys.platform == "linux":
-    import picamera.array
-    import picamera
+    def __recorder(self, config):
+        recording_drop = config.get("Recording", "Drop", fallback = "oldest")
 
-    class PiCam(VideoSource):
-        CONFIG_FILE = "picam.json"
+        if recording_drop not in [ "oldest", "newest" ]:
+            print(f"{sys.argv[0]} configuration file psg.ini has an unknown Drop under [Recording]: {recording_drop}")
+            sys.exit(1)
 
-        DEFAULT_CONFIGURATION = {
-            "type": "picam",
-            "brightness": 50,
-            "contrast": 0,
-            "saturation": 0,
-            "exposure_mode": "auto",
-            "ISO": 0,
-            "awb_mode": "auto"
-        }
+        return VideoRecorder(
+            queue_length = config.getint("Recording", "Queue length", fallback = 60),
+            drop = recording_drop,
+            minutes = config.getfloat("Recording", "Minutes per segment", fallback = 10),
+            megabytes = config.getfloat("Recording", "Megabytes per segment", fallback = 0),
+            quality = config.getint("Recording", "JPEG quality", fallback = 90))
 
-        def __init__(self, record, width, brightness, contrast, saturation, exposure_mode, iso, awb_mode):
-            super().__init__(record, width)
-            self.height = int(width * 3/4)
+    # com_port, from --com-port, is used instead of COM Port under [Arduino],
+    # and none runs without the Arduino
+    def __open_turret(self, config, com_port = None):
+        command_frequency = config.getfloat("Controller", "Command frequency (Hz)", fallback = 5)
 
-            try:
-                with self.lock, open(self.CONFIG_FILE, "r") as config_file:
-                    self.__configuration = json.load(config_file)
+        if com_port is None and config.has_section("Arduino"):
+            if not config.has_option("Arduino", "COM Port"):
+                print(f"{sys.argv[0]} configuration file psg.ini needs a value for COM Port under [Arduino]")
+                sys.exit(1)
 
-            except FileNotFoundError:
-                self.__configuration = self.DEFAULT_CONFIGURATION
+            com_port = config.get("Arduino", "COM port")
 
-            self.camera = picamera.PiCamera()
-            self.camera.resolution = (self.width, self.height)
-            self.camera.framerate = 32
+        if com_port is not None and com_port != "none":
+            arduino_baudrate = config.getint("Arduino", "Baud rate", fallback = 9600)
+            arduino_protocol = config.get("Arduino", "Protocol", fallback = "auto")
 
-            self.__apply_configuration()
+            if arduino_protocol not in [ "auto", "1" ]:
+                print(f"{sys.argv[0]} configuration file psg.ini has an unknown Protocol under [Arduino]: {arduino_protocol}")
+                sys.exit(1)
 
-            time.sleep(0.1)
+            controller = TurretController(
+                com_port,
+                arduino_baudrate,
+                frequency = command_frequency,
+                protocol = arduino_protocol,
+                negotiate_baudrate = config.getint("Arduino", "Negotiated baud rate", fallback = 0),
+                acknowledge = config.getboolean("Arduino", "Acknowledge commands", fallback = True))
+        else:
+            controller = TurretController(frequency = command_frequency)
+
+        startup.reached("turret")
+
+        return controller
+
+    def __open_camera(self, config, args, videos):
+        video_width = config.getint("Video", "Width", fallback = 400)
+
+        if videos:
+            video_source = open_videos(self.recorder, video_width, videos, cache = self.frame_cache)
+        elif args.picam:
+            video_source = PiCam(
+                self.recorder,
+                video_width,
+                config.getint("Pi Camera", "Brightness", fallback = 50),
+                config.getint("Pi Camera", "Contrast", fallback = 0),
+                config.getint("Pi Camera", "Saturation", fallback = 0),
+                config.get("Pi Camera", "Exposure mode", fallback = "auto"),
+                config.getint("Pi Camera", "ISO", fallback = 0),
+                config.get("Pi Camera", "Automatic white balance mode", fallback = "auto")
+            )
+        else:
+            video_source = WebCam(self.recorder, video_width)
+
+        startup.reached("camera")
+
+        return video_source
+
+    def __register_metrics(self):
+        metrics.register("psg_frames_total", "counter", "Frames captured, and processed", lambda: self.video_source.frames.sequence, stage = "captured")
+        metrics.register("psg_frames_total", "counter", "Frames captured, and processed", lambda: self.video_processor.frames.sequence, stage = "processed")
+        metrics.register("psg_frames_dropped_total", "counter", "Frames dropped for want of a free buffer, or given up on by the detection workers",
+            lambda: self.video_source.frames.dropped, stage = "capture")
+        metrics.register("psg_frames_dropped_total", "counter", "Frames dropped for want of a free buffer, or given up on by the detection workers",
+            lambda: self.video_processor.frames.dropped, stage = "processing")
+        metrics.register("psg_frames_encoded_total", "counter", "Frames encoded for the video stream, once for each quality and scale", lambda: self.broadcaster.frames_encoded)
+        metrics.register("psg_stream_viewers", "gauge", "Viewers of the video stream", lambda: sum(profile.subscribers for profile in list(self.broadcaster.profiles.values())))
+        metrics.register("psg_turret_commands_total", "counter", "Commands for the turret, by what became of them", lambda: self.controller.sent, outcome = "sent")
+        metrics.register("psg_turret_commands_total", "counter", "Commands for the turret, by what became of them", lambda: self.controller.keepalives, outcome = "keepalive")
+        metrics.register("psg_turret_commands_total", "counter", "Commands for the turret, by what became of them", lambda: self.controller.coalesced, outcome = "coalesced")
+        metrics.register("psg_turret_commands_total", "counter", "Commands for the turret, by what became of them", lambda: self.controller.dropped, outcome = "dropped")
+
+        metrics.register("psg_event_subscribers", "gauge", "Open /events streams", lambda: event_queue.subscribers)
+        metrics.register("psg_events_total", "counter", "Events published, sent to each subscriber, superseded before they could be sent, and heartbeats sent",
+            lambda: event_queue.published, outcome = "published")
+        metrics.register("psg_events_total", "counter", "Events published, sent to each subscriber, superseded before they could be sent, and heartbeats sent",
+            lambda: event_queue.sent, outcome = "sent")
+        metrics.register("psg_events_total", "counter", "Events published, sent to each subscriber, superseded before they could be sent, and heartbeats sent",
+            lambda: event_queue.coalesced, outcome = "coalesced")
+        metrics.register("psg_events_total", "counter", "Events published, sent to each subscriber, superseded before they could be sent, and heartbeats sent",
+            lambda: event_queue.heartbeats, outcome = "heartbeat")
+
+        for milestone in Startup.MILESTONES:
+            metrics.register("psg_startup_seconds", "gauge", "Seconds from PSG starting to each stage of starting up, up to its first frame",
+                lambda milestone = milestone: startup.seconds(milestone), milestone = milestone)
+
+        if self.detection_pool:
+            metrics.register("psg_frames_dropped_total", "counter", "Frames dropped for want of a free buffer, or given up on by the detection workers",
+                lambda: self.detection_pool.abandoned, stage = "detection")
+            metrics.register("psg_detection_queue_depth", "gauge", "Frames waiting for the detection workers", lambda: len(self.detection_pool.pending))
+
+        if self.recorder:
+            metrics.register("psg_recording_frames_total", "counter", "Frames recorded, and dropped as the recording fell behind", lambda: self.recorder.written, outcome = "written")
+            metrics.register("psg_recording_frames_total", "counter", "Frames recorded, and dropped as the recording fell behind", lambda: self.recorder.dropped, outcome = "dropped")
+            metrics.register("psg_recording_detections_dropped_total", "counter", "Detections dropped as the recording fell behind", lambda: self.recorder.detections_dropped)
+            metrics.register("psg_recording_queue_depth", "gauge", "Frames waiting to be recorded", lambda: self.recorder.queued)
+
+        if self.frame_cache:
+            metrics.register("psg_frame_cache_videos_total", "counter", "Videos played from the frame cache, decoded instead, and evicted from it",
+                lambda: self.frame_cache.hits, outcome = "hit")
+            metrics.register("psg_frame_cache_videos_total", "counter", "Videos played from the frame cache, decoded instead, and evicted from it",
+                lambda: self.frame_cache.misses, outcome = "miss")
+            metrics.register("psg_frame_cache_videos_total", "counter", "Videos played from the frame cache, decoded instead, and evicted from it",
+                lambda: self.frame_cache.evicted, outcome = "evicted")
+
+        if self.controller.link:
+            metrics.register("psg_serial_awaiting_acknowledgement", "gauge", "Commands sent to the turret and not yet acknowledged", lambda: len(self.controller.link.awaiting))
+
+    # Everything under [Logging], [Scanning] and the stream defaults under [Video]
+    # take effect as psg.ini changes; the rest once PSG is restarted
+    def reload_settings(self):
+        settings = configparser.ConfigParser()
 
-        def __apply_configuration(self):
-            logging.debug(self.__configuration)
+        try:
+            with open("psg.ini", "r") as config_file:
+                settings.read_file(config_file)
+        except FileNotFoundError:
+            return
 
-            self.camera.brightness = self.__configuration["brightness"]
-            self.camera.contrast = self.__configuration["contrast"]
-            self.camera.saturation = self.__configuration["saturation"]
-            self.camera.exposure_mode = self.__configuration["exposure_mode"]
-            self.camera.ISO = self.__configuration["ISO"]
-            self.camera.awb_mode = self.__configuration["awb_mode"]
+        configure_log_levels(settings)
+        self.broadcaster.configure(*stream_settings(settings))
+        self.video_processor.blob_finder.annotate = settings.getboolean("Video", "Annotate frames", fallback = False)
+        self.scanner.configure(*scanning_settings(settings))
 
-        def configuration(self, *args):
-            with self.condition:
-                if len(args):
-                    self.__configuration = args[0]
+        log.info("Reloaded psg.ini")
 
-                    self.__apply_configuration()
+    def start(self):
+        # Even if interrupted, so that the file being written is finished properly
+        if self.recorder:
+            self.recorder.start()
+            atexit.register(self.recorder.terminate)
 
-                with open(self.CONFIG_FILE, "w") as config_file:
-                    json.dump(self.__configuration, config_file)
+        self.config_watcher.start()
+        self.broadcaster.start()
+        self.video_processor.start()
+        self.video_source.start()
+        self.controller.start()
 
-                return self.__configuration
+        startup.watch_for_first_frame(self.video_processor.frames)
 
-        def get_video_properties(self):
-            return (
-                self.camera.framerate,
-                self.width,
-                self.height
-            )
+        self.controller.move(90, 90)
 
-        def run(self):
-            raw_capture = picamera.array.PiRGBArray(self.camera, size = (self.width, self.height))
+        self.scanner.start()
 
-            for frame in self.camera.capture_continuous(raw_capture, format = "bgr", use_video_port = True):
-                if self.done:
-                    break
+    def stop(self):
+        self.scanner.terminate()
+        self.controller.terminate()
+        self.broadcaster.terminate()
+        self.video_processor.terminate()
+        self.video_source.terminate()
+        self.config_watcher.terminate()
+        event_queue.terminate()
 
-                with self.condition:
-                    self.received_frame(frame.array)
+#
+# The web interface to PSG
+#
 
-                    self.frame = frame.array.copy()
-                    self.condition.notify_all()
+def web_application(psg):
+    app = flask.Flask(__name__, static_url_path = "", static_folder = "static")
 
-                raw_capture.truncate(0)
+    @app.route("/")
+    def index():
+        return flask.render_template(
+            "index.html",
+            grid_ids = [ f"{x}-{y}" for x in range(0, Calibration.NUM_ROWS) for y in range(0, Calibration.NUM_COLS) ]
+        )
 
-            self.cleanup_complete.set()
+    @app.route("/video")
+    def video():
+        (options, error) = stream_options(flask.request.args)
 
-class VideoFiles(VideoSource):
-    def __init__(self, record, width, videos):
-        super().__init__(record, width)
+        if error:
+            return (error, http.HTTPStatus.BAD_REQUEST)
 
-        self.video_stream = cv2.VideoCapture()
-        self.fps = None
-        self.videos = videos
+        connection = flask.request.environ.get("werkzeug.socket")
 
-        self.__load_video()
+        if connection:
+            connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MJPEGBroadcaster.SEND_BUFFER_SIZE)
 
-    def __load_video(self):
-        video = self.videos.pop(0)
-        self.videos.append(video)
+        return flask.Response(
+            psg.broadcaster.stream(*options),
+            mimetype = "multipart/x-mixed-replace; boundary=frame")
 
-        self.end_of_video()
+    @app.route("/<path:path>")
+    def send_static(path):
+        return flask.send_from_directory("static", path)
 
-        logging.debug(f"Playing {video}")
+    @app.route("/calibrate", methods = [ 'POST' ])
+    def calibrate():
+        web_log.debug("%s", flask.request.json)
 
-        self.video_stream.open(video)
+        psg.calibration.calibrate(flask.request.json)
 
-    def get_video_properties(self):
-        return (
-            self.fps,
-            self.video_stream.get(cv2.CAP_PROP_FRAME_WIDTH),
-            self.video_stream.get(cv2.CAP_PROP_FRAME_HEIGHT)
-        )
+        return ("", http.HTTPStatus.NO_CONTENT)
 
-    def run(self):
-        while not self.done:
-            (grabbed_frame, frame) = self.video_stream.read()
+    @app.route("/calibration", methods = [ 'GET' ])
+    def get_calibration():
+        web_log.debug("Retrieving calibration")
 
-            if not grabbed_frame:
-                self.__load_video()
-                continue
+        current_calibration = psg.calibration.calibration();
 
-            with self.condition:
-                if not self.fps:
-                    self.fps = self.video_stream.get(cv2.CAP_PROP_FPS)
+        if not current_calibration:
+            # Return 204 (No Content)
+            return ("", http.HTTPStatus.NO_CONTENT)
 
-            time.sleep(1.0/self.fps)
+        return json.dumps(current_calibration)
 
-            with self.condition:
-                self.received_frame(frame)
+    @app.route("/turret_position", methods = [ 'GET' ])
+    def turret_position():
+        web_log.debug("Get turret position: %s", psg.controller.turret_position_str())
 
-                self.frame = frame.copy()
-                self.condition.notify_all()
+        pan, tilt = psg.controller.turret_position()
+        return json.dumps({ "pan": pan, "tilt": tilt })
 
-        self.cleanup_complete.set()
+    @app.route("/recording", methods = [ 'GET' ])
+    def recording():
+        return json.dumps(psg.recorder.statistics() if psg.recorder else None)
 
-class VideoProcessor(Daemon):
-    def __init__(self, controls, calibration, turret, video_source):
-        super().__init__("VideoThread")
+    # Jumps to {"frame": position} or {"seconds": time into the recording}, when
+    # playing a recording
+    @app.route("/seek", methods = [ 'POST' ])
+    def seek():
+        if not isinstance(psg.video_source, RecordingSource):
+            return ("Only a recording can be sought in", http.HTTPStatus.NOT_FOUND)
 
-        self.frame = None
-        self.video_source = video_source
-        self.controls = controls
-        self.calibration = calibration
-        self.turret = turret
-        self.blob_finder = BlobFinder(self.controls)
+        try:
+            psg.video_source.seek(flask.request.json.get("frame"), flask.request.json.get("seconds"))
+        except (ValueError, TypeError) as e:
+            return (str(e), http.HTTPStatus.BAD_REQUEST)
 
-    def run(self):
-        while not self.done:
-            frame = self.video_source.read()
+        return ("", http.HTTPStatus.NO_CONTENT)
 
-            if self.controls.tracking() or self.controls.autofire():
-                frame = self.blob_finder.identify_blobs(frame, self.calibration, self.turret)
+    @app.route("/turret_link", methods = [ 'GET' ])
+    def turret_link():
+        return json.dumps(psg.controller.statistics())
 
-            with self.condition:
-                self.frame = frame.copy()
-                self.condition.notify_all()
+    # Traces everything PSG does for the given number of seconds, and returns it
+    # as Chrome trace events to open in a trace viewer
+    @app.route("/trace", methods = [ 'GET' ])
+    def trace():
+        seconds = flask.request.args.get("seconds", default = 10, type = float)
 
-        logging.info("Stopping video stream")
-        self.cleanup_complete.set()
+        if not 0 < seconds <= 60:
+            return ("seconds must be greater than 0 and at most 60", http.HTTPStatus.BAD_REQUEST)
 
-    # Generator function to produce frames
-    def get_next_frame(self):
-        while True:
-            with self.condition:
-                if self.frame is None:
-                    logging.info("Waiting for video...")
-                    self.condition.wait(1) # 1 second
-                    continue
+        if not tracer.start():
+            return ("Already tracing", http.HTTPStatus.CONFLICT)
 
-                (flag, encoded_image) = cv2.imencode("*.jpg", self.frame)
+        web_log.info("Tracing for %s s", seconds)
 
-                if not flag:
-                    logging.error("Failed to encode video frame")
-                    continue
+        time.sleep(seconds)
 
-            # Build output frame
+        filename = f"psg-trace-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
 
-            yield(
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" +
-                bytearray(encoded_image) +
-                b"\r\n")
+        return flask.Response(
+            json.dumps(tracer.stop()),
+            mimetype = "application/json",
+            headers = { "Content-Disposition": f"attachment; filename={filename}" })
 
-logging.basicConfig(
-    format = "{asctime}|{levelname:<5}|{threadName:>12}|{message}",
-    style = "{",
-    datefmt = "%Y%m%d|%H:%M:%S",
-    level = logging.DEBUG,
-    handlers = [
-        logging.handlers.RotatingFileHandler(
-            "psg.log",
-            maxBytes = 1000000,
-            backupCount = 5
-        ),
-        logging.StreamHandler()
-    ]
-)
+    @app.route("/metrics", methods = [ 'GET' ])
+    def get_metrics():
+        if not metrics.enabled:
+            return ("Metrics are disabled under [Metrics] in psg.ini", http.HTTPStatus.NOT_FOUND)
 
-#if __name__ != "__main__":
-#    logging.error(f"{sys.argv[0]} is not intended to be imported")
-#    sys.exit(1)
+        return flask.Response(metrics.exposition(), mimetype = "text/plain; version=0.0.4")
 
-logging.info("Starting PSG")
+    @app.route("/move", methods = [ 'POST' ])
+    def move():
+        web_log.debug("Moving to pan %s, tilt %s", flask.request.json["pan"], flask.request.json["tilt"])
 
-config = configparser.ConfigParser()
-config.read("psg.ini")
+        psg.scanner.turret_active()
+        psg.controller.move(flask.request.json["pan"], flask.request.json["tilt"])
 
-if not config:
-    print(f"{sys.argv[0]} requires a configuration file named psg.ini")
-    sys.exit(1)
+        return ("", http.HTTPStatus.NO_CONTENT)
 
-http_host = config.get("Web Server", "Host", fallback = "localhost")
-http_port = config.getint("Web Server", "Port", fallback = 80)
+    @app.route("/target", methods = [ 'POST' ])
+    def target():
+        web_log.debug("Targeting (%s, %s)", flask.request.form["x"], flask.request.form["y"])
 
-argument_parser = argparse.ArgumentParser()
-argument_parser.add_argument(
-    "--video",
-    type = str,
-    required = False,
-    help = "Name of video file, or directory containing video files")
-argument_parser.add_argument(
-    "--record",
-    action = 'store_true',
-    help = "Record the video in one or more timestamped files")
-argument_parser.add_argument(
-    "--picam",
-    action = 'store_true',
-    help = "Attempt to utilise the Raspberry Pi camera")
+        return ("", http.HTTPStatus.NO_CONTENT)
 
-args = argument_parser.parse_args()
+    @app.route("/fire", methods = [ 'POST' ])
+    def fire():
+        web_log.debug("Firing: %s at %s", flask.request.json["firing"], psg.controller.turret_position_str())
 
-controls = TurretControls()
-video_processor = None
+        psg.scanner.turret_active()
+        psg.controller.fire(flask.request.json["firing"])
 
-command_frequency = config.getfloat("Controller", "Command frequency (Hz)", fallback = 5)
+        return ("", http.HTTPStatus.NO_CONTENT)
 
-if config.has_section("Arduino"):
-    if not config.has_option("Arduino", "COM Port"):
-        print(f"{sys.argv[0]} configuration file psg.ini needs a value for COM Port under [Arduino]")
-        sys.exit(1)
+    @app.route("/aim", methods = [ 'POST' ])
+    def aim():
+        web_log.debug("Aim: %s", flask.request.json)
 
-    arduino_comport = config.get("Arduino", "COM port")
-    arduino_baudrate = config.getint("Arduino", "Baud rate", fallback = 9600)
+        # Several points may be given at once, as "points": [ [ x, y ], ... ], to
+        # find where the turret would aim for each of them without moving it
+        if "points" in flask.request.json:
+            (pans, tilts) = psg.calibration.calculate_turret_positions(flask.request.json["points"])
 
-    controller = TurretController(arduino_comport, arduino_baudrate, frequency = command_frequency)
-else:
-    controller = TurretController(frequency = command_frequency)
+            return json.dumps([ { "pan": int(pan), "tilt": int(tilt) } for (pan, tilt) in zip(pans, tilts) ])
 
-videos = []
+        pan, tilt = psg.calibration.calculate_turret_position(
+            ScreenCoords(flask.request.json["x"], flask.request.json["y"])
+        )
 
-if args.video:
-# Is it a file or directory?
-    if os.path.isfile(args.video):
-        # It's a file
-        videos.append(args.video)
-    elif os.path.isdir(args.video):
-        # It's a directory, so scan it looking for files
-        for entry in os.scandir(args.video):
-            # Skip non-files
-            if not entry.is_file():
-                continue
+        if "move_and_fire" in flask.request.json:
+            psg.controller.move(pan, tilt)
+            psg.controller.fire(True)
 
-            videos.append(entry.path)
-    else:
-        raise ValueError(f"{args.video} is not a file or directory")
+        return json.dumps({ "pan": pan, "tilt": tilt })
 
-videos.sort(key = lambda s: os.path.splitext(s)[0])
+    @app.route("/trackablecolours", methods = [ 'GET' ])
+    def trackablecolours():
+        web_log.debug("Retrieving colours that are trackable")
 
-logging.debug(videos)
+        return json.dumps([ colour.name for colour in Colour if colour not in [ Colour.BLACK ] ])
 
-calibration = Calibration()
-calibration.load()
+    @app.route("/controls", methods = [ 'GET' ])
+    def get_controls():
+        return json.dumps(psg.controls.get())
 
-video_width = config.getint("Video", "Width", fallback = 400)
+    @app.route("/controls", methods = [ 'POST' ])
+    def set_controls():
+        old_controls = psg.controls.snapshot()
 
-if videos:
-    video_source = VideoFiles(args.record, video_width, videos)
-elif args.picam:
-    video_source = PiCam(
-        args.record,
-        video_width,
-        config.getint("Pi Camera", "Brightness", fallback = 50),
-        config.getint("Pi Camera", "Contrast", fallback = 0),
-        config.getint("Pi Camera", "Saturation", fallback = 0),
-        config.get("Pi Camera", "Exposure mode", fallback = "auto"),
-        config.getint("Pi Camera", "ISO", fallback = 0),
-        config.get("Pi Camera", "Automatic white balance mode", fallback = "auto")
-    )
-else:
-    video_source = WebCam(args.record, video_width)
+        psg.controls.set(flask.request.json)
 
-video_processor = VideoProcessor(controls, calibration, controller, video_source)
+        new_controls = psg.controls.snapshot()
 
-scanner = Scanner(
-    controller,
-    calibration,
-    config.getfloat("Scanning", "Pause before resuming scanning", fallback = 2.0),
-    config.getfloat("Scanning", "Pause between turret positions", fallback = 0.7),
-    config.getint("Scanning", "Turret pan increment", fallback = 10)
-)
+        if new_controls.autofire != old_controls.autofire and psg.controller.is_firing():
+            psg.controller.fire(False)
 
-app = flask.Flask(__name__, static_url_path = "", static_folder = "static")
+        psg.scanner.enable(new_controls.scanwhenidle and not new_controls.alwaysfire and not new_controls.autofire)
 
-@app.route("/")
-def index():
-    return flask.render_template(
-        "index.html",
-        grid_ids = [ f"{x}-{y}" for x in range(0, Calibration.NUM_ROWS) for y in range(0, Calibration.NUM_COLS) ]
-    )
+        psg.controller.alwaysfire(new_controls.alwaysfire)
 
-@app.route("/video")
-def video():
-    global video_processor
+        return ("", http.HTTPStatus.NO_CONTENT)
 
-    return flask.Response(
-        video_processor.get_next_frame(),
-        mimetype = "multipart/x-mixed-replace; boundary=frame")
+    @app.route("/camera_configuration", methods = [ 'GET' ])
+    def get_camera_config():
+        return json.dumps(psg.video_source.configuration())
 
-@app.route("/<path:path>")
-def send_static(path):
-    return flask.send_from_directory("static", path)
+    @app.route("/camera_configuration", methods = [ 'POST' ])
+    def set_camera_config():
+        config = psg.video_source.configuration(flask.request.json)
 
-@app.route("/calibrate", methods = [ 'POST' ])
-def calibrate():
-    logging.debug(flask.request.json)
+        if config:
+            return json.dumps(config)
 
-    calibration.calibrate(flask.request.json)
+        return ("", http.HTTPStatus.BAD_REQUEST)
 
-    return ("", http.HTTPStatus.NO_CONTENT)
+    @app.route("/events")
+    def events():
+        response = flask.Response(event_queue.stream([ "turret" ]), mimetype = "text/event-stream")
+        response.headers.set("Cache-Control", "no-cache")
 
-@app.route("/calibration", methods = [ 'GET' ])
-def get_calibration():
-    logging.debug("Retrieving calibration")
+        return response
 
-    current_calibration = calibration.calibration();
+    # What was found in each frame, keyed by its frame ID, for the browser to draw
+    @app.route("/detections")
+    def detections():
+        response = flask.Response(event_queue.stream([ "detections" ]), mimetype = "text/event-stream")
+        response.headers.set("Cache-Control", "no-cache")
 
-    if not current_calibration:
-        # Return 204 (No Content)
-        return ("", http.HTTPStatus.NO_CONTENT)
+        return response
 
-    return json.dumps(current_calibration)
+    return app
 
-@app.route("/turret_position", methods = [ 'GET' ])
-def turret_position():
-    logging.debug(f"Get turret position: {controller.turret_position_str()}")
+# Builds PSG from psg.ini, or the given configuration, and any command line
+# arguments given, and returns its Flask application, with PSG itself as
+# app.psg, ready to start()
+def create_app(config = None, argv = None):
+    if config is None:
+        config = read_configuration()
 
-    pan, tilt = controller.turret_position()
-    return json.dumps({ "pan": pan, "tilt": tilt })
+    (args, videos) = parse_arguments([] if argv is None else argv)
 
-@app.route("/move", methods = [ 'POST' ])
-def move():
-    logging.debug(f"Moving to pan {flask.request.json['pan']}, tilt {flask.request.json['tilt']})")
+    psg = PSG(config, args, videos)
 
-    scanner.turret_active()
-    controller.move(flask.request.json["pan"], flask.request.json["tilt"])
+    app = web_application(psg)
+    app.psg = psg
 
-    return ("", http.HTTPStatus.NO_CONTENT)
+    startup.reached("web")
 
-@app.route("/target", methods = [ 'POST' ])
-def target():
-    logging.debug(f"Targeting ({flask.request.form['x']}, {flask.request.form['y']})")
+    return app
 
-    return ("", http.HTTPStatus.NO_CONTENT)
+def read_configuration():
+    config = configparser.ConfigParser()
+    config.read("psg.ini")
 
-@app.route("/fire", methods = [ 'POST' ])
-def fire():
-    logging.debug(f"Firing: {flask.request.json['firing']} at {controller.turret_position_str()}")
+    if not config:
+        print(f"{sys.argv[0]} requires a configuration file named psg.ini")
+        sys.exit(1)
 
-    scanner.turret_active()
-    controller.fire(flask.request.json["firing"])
+    return config
 
-    return ("", http.HTTPStatus.NO_CONTENT)
+# The videos to play, given with --video, in order
+def video_files(video):
+    videos = []
 
-@app.route("/aim", methods = [ 'POST' ])
-def aim():
-    logging.debug(f"Aim: {flask.request.json}")
+    # Is it a file or directory?
+    if os.path.isfile(video) or Recording.is_recording(video):
+        # It's a file, or a recording made with --record
+        videos.append(video)
+    elif os.path.isdir(video):
+        # It's a directory, so scan it looking for files
+        for entry in os.scandir(video):
+            # Skip non-files
+            if not entry.is_file():
+                continue
 
-    pan, tilt = calibration.calculate_turret_position(
-        ScreenCoords(flask.request.json["x"], flask.request.json["y"])
-    )
+            videos.append(entry.path)
+    else:
+        raise ValueError(f"{video} is not a file or directory")
 
-    if "move_and_fire" in flask.request.json:
-        controller.move(pan, tilt)
-        controller.fire(True)
+    videos.sort(key = lambda s: os.path.splitext(s)[0])
 
-    return json.dumps({ "pan": pan, "tilt": tilt })
+    return videos
 
-@app.route("/trackablecolours", methods = [ 'GET' ])
-def trackablecolours():
-    logging.debug(f"Retrieving colours that are trackable")
+def parse_arguments(argv = None):
+    argument_parser = argparse.ArgumentParser()
+    argument_parser.add_argument(
+        "--video",
+        type = str,
+        required = False,
+        help = "Name of video file, or directory containing video files")
+    argument_parser.add_argument(
+        "--record",
+        action = 'store_true',
+        help = "Record the video in one or more timestamped files")
+    argument_parser.add_argument(
+        "--picam",
+        action = 'store_true',
+        help = "Attempt to utilise the Raspberry Pi camera")
 
-    return json.dumps([ colour.name for colour in Colour if colour not in [ Colour.BLACK ] ])
+    argument_parser.add_argument(
+        "--com-port",
+        type = str,
+        help = "Serial port of the Arduino, such as one emulator.py makes, instead of COM Port under [Arduino] in psg.ini; none runs without the Arduino")
+    argument_parser.add_argument(
+        "--exit-after-first-frame",
+        action = 'store_true',
+        help = "Stop once the first frame has been processed, and print when each stage of starting up was reached as JSON, to time how long PSG takes to start")
 
-@app.route("/controls", methods = [ 'GET' ])
-def get_controls():
-    return json.dumps(controls.get())
+    args = argument_parser.parse_args(argv)
 
-@app.route("/controls", methods = [ 'POST' ])
-def set_controls():
-    old_autofire = controls.autofire()
+    videos = video_files(args.video) if args.video else []
 
-    controls.set(flask.request.json)
+    log.debug("%s", videos)
 
-    if controls.autofire() != old_autofire and controller.is_firing():
-        controller.fire(False)
+    return (args, videos)
 
-    scanner.enable(controls.scanwhenidle() and not controls.alwaysfire() and not controls.autofire())
+def main(argv = None):
+    startup.reached("imported")
 
-    controller.alwaysfire(controls.alwaysfire())
+    config = read_configuration()
 
-    return ("", http.HTTPStatus.NO_CONTENT)
+    atexit.register(configure_logging(config).stop)
 
-@app.route("/camera_configuration", methods = [ 'GET' ])
-def get_camera_config():
-    return json.dumps(video_source.configuration())
+    metrics.configure(config.getboolean("Metrics", "Enabled", fallback = False))
 
-@app.route("/camera_configuration", methods = [ 'POST' ])
-def set_camera_config():
-    config = video_source.configuration(flask.request.json)
+    log.info("Starting PSG")
 
-    if config:
-        return json.dumps(config)
+    http_host = config.get("Web Server", "Host", fallback = "localhost")
+    http_port = config.getint("Web Server", "Port", fallback = 80)
+    http_server = config.get("Web Server", "Server", fallback = "werkzeug")
+    http_debug = config.getboolean("Web Server", "Debug", fallback = True)
 
-    return ("", http.HTTPStatus.BAD_REQUEST)
+    if http_server not in [ "werkzeug", "asgi" ]:
+        print(f"{sys.argv[0]} configuration file psg.ini has an unknown Server under [Web Server]: {http_server}")
+        sys.exit(1)
 
-@app.route("/events")
-def events():
-    event = event_queue.nextEvent()
-    logging.debug(f"Returning event: {event}")
+    (args, videos) = parse_arguments(argv)
 
-    response = flask.Response(event, mimetype = "text/event-stream")
-    response.headers.set("Cache-Control", "no-cache")
+    app = create_app(config, sys.argv[1:] if argv is None else argv)
+    psg = app.psg
 
-    return response
+    psg.start()
 
-if __name__ == "__main__":
-    video_processor.start()
-    video_source.start()
-    controller.start()
+    if args.exit_after_first_frame:
+        startup.first_frame.wait()
+    else:
+        web_log.info("Waiting for HTTP requests (%s)", http_server)
 
-    controller.move(90, 90)
+        if http_server == "asgi":
+            AsyncServer(app, psg.broadcaster, event_queue).run(http_host, http_port)
+        else:
+            app.run(host = http_host, port = http_port, debug = http_debug, threaded = True, use_reloader = False)
 
-    scanner.start()
+        web_log.info("Web server exiting")
 
-    logging.info("Waiting for HTTP requests")
-    app.run(host = http_host, port = http_port, debug = True, threaded = True, use_reloader = False)
-    logging.info("Web server exiting")
+    psg.stop()
 
-    scanner.terminate()
-    controller.terminate()
-    video_processor.terminate()
-    video_source.terminate()
-    event_queue.terminate()
-                
+    # On its own on stdout, as psg.log goes to stderr
+    if args.exit_after_first_frame:
+        print(json.dumps(startup.results()))
 
+if __name__ == "__main__":
+    main()
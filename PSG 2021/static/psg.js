@@ -41,6 +41,14 @@ var current_pan = 90;
 var current_tilt = 90;
 
 var event_source;
+var detection_source;
+
+// As the server would have drawn them, in the colour of their category
+const DETECTION_COLOURS = {
+  "shootable": "#ff0000",
+  "safe": "#00ff00",
+  "other": "#ffff00"
+};
 
 function configure_coord_buttons(loc) {
   document.getElementById("psg-"+loc+"-set").onclick = function(e) {
@@ -283,6 +291,38 @@ function videoPortClickEnd(x, y) {
   }
 }
 
+// Draws the blobs found in a frame over the video, scaled from the size of the
+// frame to the size the video is shown at; with autofire, only the target
+function drawDetections(detections) {
+  const video = document.getElementById("psg-video-port");
+  const overlay = document.getElementById("psg-video-overlay");
+
+  if (overlay.width != video.clientWidth || overlay.height != video.clientHeight) {
+    overlay.width = video.clientWidth;
+    overlay.height = video.clientHeight;
+  }
+
+  const context = overlay.getContext("2d");
+  context.clearRect(0, 0, overlay.width, overlay.height);
+
+  if (!detections.width) {
+    return;
+  }
+
+  const scale = overlay.width / detections.width;
+
+  for (const blob of detections.blobs) {
+    if (detections.autofire && !blob.target) {
+      continue;
+    }
+
+    context.strokeStyle = DETECTION_COLOURS[blob.category];
+    context.beginPath();
+    context.arc(blob.x * scale, blob.y * scale, Math.max(1, blob.size * scale / 2), 0, 2 * Math.PI);
+    context.stroke();
+  }
+}
+
 function setCalibrationVisibility(visibility) {
   //document.getElementById("psg-calibration").style.visibility = visibility;
 
@@ -779,6 +819,17 @@ window.onload = function() {
     }
   }
 
+  detection_source = new EventSource("/detections");
+
+  detection_source.onmessage = function(e) {
+    drawDetections(JSON.parse(e.data));
+  }
+
+  // Rather than leave blobs that may have gone drawn while reconnecting
+  detection_source.onerror = function(e) {
+    drawDetections({ "blobs": [] });
+  }
+
   //event_source.onerror = function(error) {
   //  console.log(error);
   //}
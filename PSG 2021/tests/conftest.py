@@ -0,0 +1,39 @@
+import configparser
+import glob
+import os
+import sys
+
+import pytest
+
+PSG_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, PSG_DIRECTORY)
+
+import psg
+
+VIDEOS = sorted(glob.glob(os.path.join(PSG_DIRECTORY, "Videos", "*.mp4")))
+
+# Frames spread across the videos, limited to keep the tests quick
+VIDEO_FRAMES = 140
+
+def read_config(name):
+    config = configparser.ConfigParser()
+    config.read(os.path.join(PSG_DIRECTORY, name))
+
+    return config
+
+@pytest.fixture(scope = "session")
+def psg_config():
+    return read_config("psg.ini")
+
+@pytest.fixture(scope = "session")
+def detection_config():
+    return read_config(psg.BlobFinder.CONFIG_FILE_NAME)
+
+# Decoded and scaled as PSG would
+@pytest.fixture(scope = "session")
+def video_frames(psg_config):
+    if not VIDEOS:
+        pytest.skip("No videos in Videos")
+
+    return psg.recorded_frames(VIDEOS, psg_config.getint("Video", "Width", fallback = 400), VIDEO_FRAMES)
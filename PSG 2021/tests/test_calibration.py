@@ -0,0 +1,159 @@
+import math
+
+import numpy as np
+import pytest
+
+import psg
+
+#
+# The map Calibration compiles must give the turret position that
+# calculate_turret_position() always worked out one point at a time, for every
+# pixel, at the edges of the grid and the map, beyond them, and wherever the
+# interpolation lands exactly half way between two positions, which round()
+# takes to the even one.
+#
+
+(FRAME_WIDTH, FRAME_HEIGHT) = (400, 300)
+
+# calculate_turret_position() as it was before the map
+def original(grid, x, y):
+    (row, col) = (0, 0)
+
+    while row < psg.Calibration.NUM_ROWS - 2 and col < psg.Calibration.NUM_COLS - 2:
+        if y > grid["y"][row+1][col]:
+            row = row + 1
+            continue
+
+        if x > grid["x"][row][col+1]:
+            col = col + 1
+            continue
+
+        break
+
+    pan_ratio = (x - grid["x"][row][col])/(grid["x"][row][col+1] - grid["x"][row][col])
+    pan = grid["pan"][col] - round(pan_ratio * (grid["pan"][col] - grid["pan"][col+1]))
+
+    tilt_ratio = (y - grid["y"][row][col])/(grid["y"][row+1][col] - grid["y"][row][col])
+    tilt = grid["tilt"][row] + round(tilt_ratio * (grid["tilt"][row+1] - grid["tilt"][row]))
+
+    return (pan, tilt)
+
+# Squares 80 by 60 pixels, 30 degrees across, so a point a quarter of the way
+# across one is 7.5 degrees in, and rounds to 8, and three quarters, 22.5, to 22
+def regular_calibration():
+    return {
+        "pan_left": 180,
+        "pan_right": 0,
+        "tilt_up": 0,
+        "tilt_down": 180,
+        "grid": {
+            "x": [ [ 40 + 80 * col for col in range(5) ] for _ in range(5) ],
+            "y": [ [ 30 + 60 * row ] * 5 for row in range(5) ],
+            "pan": [ 150, 120, 90, 60, 30 ],
+            "tilt": [ 30, 60, 90, 120, 150 ]
+        }
+    }
+
+CALIBRATIONS = {
+    "made up": psg.made_up_calibration(FRAME_WIDTH, FRAME_HEIGHT),
+    "regular": regular_calibration()
+}
+
+def calibrated(data, frame_size = (FRAME_WIDTH, FRAME_HEIGHT)):
+    calibration = psg.Calibration(frame_size)
+    calibration.calibrate(data, save = False)
+
+    return calibration
+
+# Every pixel of the frame, the last row and column of the map and those just
+# beyond it, and points off the frame and between pixels
+def points_to_check(calibration):
+    (map_height, map_width) = calibration.compiled[1].shape
+
+    points = [ (x, y) for y in range(FRAME_HEIGHT) for x in range(FRAME_WIDTH) ]
+    points += [ (x, y) for y in (map_height - 1, map_height) for x in range(0, map_width + 1, 7) ]
+    points += [ (x, y) for x in (map_width - 1, map_width) for y in range(0, map_height + 1, 7) ]
+    points += [ (-20, -20), (-1, 150), (200, -1), (10.5, 20.25), (FRAME_WIDTH / 3, FRAME_HEIGHT / 7), (5000, 5000) ]
+
+    return points
+
+@pytest.mark.parametrize("name", CALIBRATIONS)
+def test_map_matches_original(name):
+    data = CALIBRATIONS[name]
+    calibration = calibrated(data)
+
+    points = points_to_check(calibration)
+    expected = [ original(data["grid"], x, y) for (x, y) in points ]
+
+    (pans, tilts) = calibration.calculate_turret_positions(points)
+
+    for (point, position, pan, tilt) in zip(points, expected, pans, tilts):
+        assert (int(pan), int(tilt)) == position, f"At {point}"
+
+    # One point at a time, as the turret is aimed, for a sample of them
+    for (point, position) in list(zip(points, expected))[::97]:
+        assert calibration.calculate_turret_position(psg.ScreenCoords(*point)) == position, f"At {point}"
+
+# A frame of its own size, every few pixels of it, and after the frame size
+# changes
+def test_map_covers_the_frame():
+    data = psg.made_up_calibration(1280, 720)
+    calibration = calibrated(data, (1280, 720))
+
+    assert calibration.compiled[0].shape == (720, 1280, 2)
+
+    points = [ (x, y) for y in range(0, 720, 3) for x in range(0, 1280, 7) ] + [ (1279, 719), (1280, 720) ]
+    expected = [ original(data["grid"], x, y) for (x, y) in points ]
+
+    for frame_size in [ (1280, 720), (640, 360) ]:
+        calibration.set_frame_size(frame_size)
+
+        assert calibration.compiled[0].shape == (frame_size[1], frame_size[0], 2)
+
+        (pans, tilts) = calibration.calculate_turret_positions(points)
+
+        assert [ (int(pan), int(tilt)) for (pan, tilt) in zip(pans, tilts) ] == expected
+
+# Without the frame size, every point is interpolated
+def test_without_a_map():
+    data = regular_calibration()
+    calibration = calibrated(data, None)
+
+    assert calibration.compiled[0] is None
+
+    points = [ (x, y) for y in range(0, FRAME_HEIGHT, 5) for x in range(0, FRAME_WIDTH, 5) ]
+    (pans, tilts) = calibration.calculate_turret_positions(points)
+
+    assert [ (int(pan), int(tilt)) for (pan, tilt) in zip(pans, tilts) ] == [ original(data["grid"], x, y) for (x, y) in points ]
+
+def test_half_way_rounds_to_even():
+    data = regular_calibration()
+    calibration = calibrated(data)
+
+    # A quarter and three quarters of the way across the first square
+    halves = [ (60, 45), (100, 75) ]
+
+    for (x, y) in halves:
+        pan_ratio = (x - 40) / 80
+        assert math.modf(pan_ratio * 30)[0] == 0.5
+
+    (pans, tilts) = calibration.calculate_turret_positions(halves)
+
+    assert [ (int(pan), int(tilt)) for (pan, tilt) in zip(pans, tilts) ] == [ (142, 38), (128, 52) ]
+    assert [ original(data["grid"], x, y) for (x, y) in halves ] == [ (142, 38), (128, 52) ]
+
+def test_square_with_no_width_is_an_error():
+    data = regular_calibration()
+    data["grid"]["x"][0][1] = data["grid"]["x"][0][0]
+
+    calibration = calibrated(data)
+
+    with pytest.raises(ZeroDivisionError):
+        original(data["grid"], 40, 30)
+
+    with pytest.raises(ZeroDivisionError):
+        calibration.calculate_turret_position(psg.ScreenCoords(40, 30))
+
+def test_uncalibrated_is_an_error():
+    with pytest.raises(ValueError):
+        psg.Calibration().calculate_turret_positions([ (0, 0) ])
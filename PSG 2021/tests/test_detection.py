@@ -0,0 +1,116 @@
+import configparser
+import math
+
+import cv2
+import numpy as np
+import pytest
+
+import psg
+
+#
+# The components engine must find the blobs SimpleBlobDetector finds when it
+# binarizes at the same single threshold. The components engine keeps only the
+# largest of blobs closer together than distance_between_blobs.min, as
+# SimpleBlobDetector does once it has grouped blobs across thresholds, so each
+# blob it finds must be one SimpleBlobDetector found, and each blob
+# SimpleBlobDetector found must be that close to one it found.
+#
+
+THRESHOLDS = [ 60, 100 ]
+
+POSITION_TOLERANCE = 0.5
+SIZE_TOLERANCE = 1.0
+
+NO_SHAPE_FILTERS = { "filterByCircularity": False, "filterByConvexity": False, "filterByInertia": False }
+
+# Changes to the parameters in detection.ini, which find nothing in the videos
+FILTERS = {
+    "configured": {},
+    "loose shape": { "filterByColor": False, "minCircularity": 0.3, "minConvexity": 0.5, "minInertiaRatio": 0.05 },
+    "dark": { "blobColor": 0, **NO_SHAPE_FILTERS },
+    "bright": { "blobColor": 255 },
+    "area only": { "filterByColor": False, **NO_SHAPE_FILTERS }
+}
+
+# Those that find blobs in the videos
+VIDEO_FILTERS = [ "loose shape", "area only" ]
+
+def engines(detection_config, threshold, filters):
+    params = psg.BlobFinder.detection_parameters(detection_config)
+
+    for (name, value) in filters.items():
+        setattr(params, name, value)
+
+    params.minThreshold = threshold
+    params.maxThreshold = threshold + params.thresholdStep
+    params.minRepeatability = 1
+
+    engine_config = configparser.ConfigParser()
+    engine_config["Engine"] = { "threshold": str(threshold) }
+
+    return (params, psg.SimpleBlobEngine(params, engine_config), psg.ConnectedComponentsEngine(params, engine_config))
+
+# Returns the number of blobs found
+def assert_same_blobs(detection_config, threshold, filters, images):
+    (params, reference, engine) = engines(detection_config, threshold, filters)
+
+    found = 0
+
+    for (index, image) in enumerate(images):
+        expected = reference.detect(image)
+        actual = engine.detect(image)
+
+        for keypoint in actual:
+            assert any(
+                math.dist(keypoint.pt, other.pt) < POSITION_TOLERANCE and abs(keypoint.size - other.size) < SIZE_TOLERANCE
+                for other in expected
+            ), f"Image {index}: blob at {keypoint.pt}, size {keypoint.size}, not found by {psg.SimpleBlobEngine.NAME}"
+
+        for keypoint in expected:
+            assert any(
+                math.dist(keypoint.pt, other.pt) < max(params.minDistBetweenBlobs, keypoint.size / 2, other.size / 2)
+                for other in actual
+            ), f"Image {index}: blob at {keypoint.pt}, size {keypoint.size}, missed by {psg.ConnectedComponentsEngine.NAME}"
+
+        found += len(actual)
+
+    return found
+
+# Ellipses of many brightnesses, some overlapping, rings, whose middles are
+# dark blobs, and irregular shapes for the shape filters to reject
+def synthetic_image(seed):
+    random = np.random.default_rng(seed)
+    image = np.zeros((300, 400), dtype = np.uint8)
+
+    for _ in range(12):
+        centre = (int(random.integers(20, 380)), int(random.integers(20, 280)))
+        axes = (int(random.integers(3, 25)), int(random.integers(3, 25)))
+        cv2.ellipse(image, centre, axes, float(random.integers(0, 180)), 0, 360, int(random.integers(30, 255)), -1)
+
+    for _ in range(4):
+        centre = (int(random.integers(30, 370)), int(random.integers(30, 270)))
+        cv2.circle(image, centre, int(random.integers(10, 25)), 200, -1)
+        cv2.circle(image, centre, int(random.integers(3, 8)), 0, -1)
+
+    for _ in range(3):
+        cv2.fillPoly(image, [ random.integers(0, 300, (5, 2)).astype(np.int32) ], 150)
+
+    return image
+
+@pytest.fixture(scope = "module")
+def preprocessed_frames(video_frames):
+    preprocessor = psg.Preprocessor()
+
+    return [ preprocessor.process(frame).copy() for frame in video_frames ]
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+@pytest.mark.parametrize("filters", VIDEO_FILTERS)
+def test_engines_agree_on_videos(detection_config, preprocessed_frames, threshold, filters):
+    assert assert_same_blobs(detection_config, threshold, FILTERS[filters], preprocessed_frames) > 0
+
+@pytest.mark.parametrize("threshold", THRESHOLDS)
+@pytest.mark.parametrize("filters", FILTERS)
+def test_engines_agree_on_synthetic_images(detection_config, threshold, filters):
+    images = [ synthetic_image(seed) for seed in range(40) ]
+
+    assert assert_same_blobs(detection_config, threshold, FILTERS[filters], images) > 0
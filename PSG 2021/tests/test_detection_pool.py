@@ -0,0 +1,121 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import psg
+
+#
+# DetectionPool must hand back each frame's blobs in the order the frames were
+# submitted, whichever worker finishes first, and each with the blobs found in
+# that frame. A frame given up on gets None, and its result is discarded when
+# it turns up late, rather than being taken for a later frame's.
+#
+
+# The workers' BlobFinders read detection.ini from where they run, as PSG's do
+PSG_DIRECTORY = os.path.dirname(os.path.abspath(psg.__file__))
+
+# Bright circles on a dark background, each a blob to detection.ini, so each
+# frame has a different number of them. Large frames take the workers longer.
+def circles(count, scale = 1):
+    random = np.random.default_rng(count)
+    frame = np.full((300, 400, 3), 90, dtype = np.uint8)
+
+    for n in range(count):
+        centre = (40 + 80 * (n % 5), 50 + 100 * (n // 5))
+        cv2.circle(frame, centre, int(random.integers(8, 20)), [ int(c) for c in random.integers(180, 256, 3) ], -1)
+
+    return cv2.resize(frame, None, fx = scale, fy = scale, interpolation = cv2.INTER_NEAREST)
+
+def blobs_of(found):
+    (keypoints, colours) = found
+
+    return ([ (keypoint.pt, keypoint.size) for keypoint in keypoints ], list(colours))
+
+# Three workers, unless a test asks for another number
+@pytest.fixture
+def pool(request, monkeypatch):
+    if not psg.DetectionPool.available():
+        pytest.skip("Detection workers need fork()")
+
+    monkeypatch.chdir(PSG_DIRECTORY)
+
+    pool = psg.DetectionPool(getattr(request, "param", 3))
+    yield pool
+    pool.close()
+
+@pytest.fixture
+def ring():
+    ring = psg.FrameRing(slots = 6, shared = True)
+    yield ring
+    ring.close()
+
+def submit(pool, ring, sequence, frame):
+    (slot, buffer) = ring.acquire(frame.shape)
+    np.copyto(buffer, frame)
+    pool.submit(sequence, (sequence, slot), ring, slot, None)
+
+    return slot
+
+def test_results_come_back_in_submitted_order(pool, ring):
+    # Slow enough not to be given up on, even on a busy machine
+    pool.RESULT_TIMEOUT = 30
+
+    # Every third frame large, so later frames often finish first
+    frames = [ circles(n % 12, 4 if n % 3 == 0 else 1) for n in range(24) ]
+
+    blob_finder = psg.BlobFinder(None)
+    expected = [ blobs_of(blob_finder.find_blobs(frame, None)) for frame in frames ]
+
+    assert len({ len(points) for (points, _) in expected }) > 1
+
+    ready = []
+
+    def collect(wait):
+        for ((sequence, slot), found) in pool.collect(wait):
+            ready.append((sequence, found))
+            ring.abandon(slot)
+
+    for (sequence, frame) in enumerate(frames):
+        while pool.busy():
+            collect(True)
+
+        submit(pool, ring, sequence, frame)
+        collect(False)
+
+    while pool.pending:
+        collect(True)
+
+    assert [ sequence for (sequence, _) in ready ] == list(range(len(frames)))
+
+    for (sequence, found) in ready:
+        assert found is not None, f"Frame {sequence} given up on"
+        assert blobs_of(found) == expected[sequence], f"Frame {sequence}"
+
+    assert (pool.completed, pool.abandoned, pool.discarded) == (len(frames), 0, 0)
+
+# With one worker, the late result turns up while the next frame is waiting
+# for its own
+@pytest.mark.parametrize("pool", [ 1 ], indirect = True)
+def test_late_result_is_discarded(pool, ring):
+    # Given up on as soon as it is collected, long before the worker can be done
+    pool.RESULT_TIMEOUT = 0
+
+    late = submit(pool, ring, 1, circles(11, 4))
+
+    assert pool.collect() == [ ((1, late), None) ]
+    assert pool.abandoned == 1
+
+    pool.RESULT_TIMEOUT = 30
+
+    frame = circles(4)
+    slot = submit(pool, ring, 2, frame)
+
+    [ (context, found) ] = pool.collect(wait = True)
+
+    assert context == (2, slot)
+    assert blobs_of(found) == blobs_of(psg.BlobFinder(None).find_blobs(frame, None))
+    assert (pool.completed, pool.abandoned, pool.discarded) == (1, 1, 1)
+
+    ring.abandon(late)
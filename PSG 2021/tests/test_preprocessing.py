@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+import pytest
+
+import psg
+
+#
+# Preprocessor must give SimpleBlobDetector the same image as the per-channel
+# threshold, invert, OR and mask that BlobFinder did before it, which the
+# detector converted to greyscale itself.
+#
+
+def threshold_and_invert(image):
+    (_, threshed) = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    return cv2.bitwise_not(threshed)
+
+def original(frame):
+    masked_blue = threshold_and_invert(frame[:,:,0])
+    masked_green = threshold_and_invert(frame[:,:,1])
+    masked_red = threshold_and_invert(frame[:,:,2])
+
+    masked = cv2.bitwise_or(cv2.bitwise_or(masked_blue, masked_green), masked_red)
+    mask = cv2.merge((masked, masked, masked))
+
+    return cv2.cvtColor(cv2.bitwise_and(frame, mask), cv2.COLOR_BGR2GRAY)
+
+# Noise, a single colour, and both extremes, which Otsu's method finds no
+# threshold in, at a size of their own
+def synthetic_frames():
+    random = np.random.default_rng(1)
+
+    return [
+        random.integers(0, 256, (300, 400, 3), dtype = np.uint8),
+        np.full((300, 400, 3), (30, 120, 250), dtype = np.uint8),
+        np.zeros((120, 160, 3), dtype = np.uint8),
+        np.full((120, 160, 3), 255, dtype = np.uint8)
+    ]
+
+def test_fused_matches_original_on_videos(video_frames):
+    preprocessor = psg.Preprocessor()
+
+    for (index, frame) in enumerate(video_frames):
+        assert np.array_equal(preprocessor.process(frame), original(frame)), f"Frame {index}"
+
+@pytest.mark.parametrize("index", range(len(synthetic_frames())))
+def test_fused_matches_original_on_synthetic_frames(index):
+    frame = synthetic_frames()[index]
+
+    assert np.array_equal(psg.Preprocessor().process(frame), original(frame))
+
+# Changing size reallocates the buffers, rather than reusing the wrong ones
+def test_fused_matches_original_as_the_size_changes(video_frames):
+    preprocessor = psg.Preprocessor()
+
+    for frame in [ video_frames[0], synthetic_frames()[2], video_frames[1] ]:
+        assert np.array_equal(preprocessor.process(frame), original(frame))
+
+# Reused thresholds are those of the frame they were computed for
+def test_reused_thresholds_match_an_unchanged_scene(video_frames):
+    preprocessor = psg.Preprocessor()
+    preprocessor.configure(True, 0.05)
+
+    for frame in [ video_frames[0], video_frames[0] ]:
+        assert np.array_equal(preprocessor.process(frame), original(frame))
+
+    assert (preprocessor.thresholds_computed, preprocessor.thresholds_reused) == (1, 1)
+
+def test_hsv_at_matches_whole_frame_conversion(video_frames):
+    frame = video_frames[0]
+    (height, width) = frame.shape[:2]
+
+    points = [ (0, 0), (width - 1, height - 1), (width // 2, height // 3), (17, height - 5) ]
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+
+    assert np.array_equal(psg.Preprocessor.hsv_at(frame, points), np.array([ hsv[y, x] for (x, y) in points ]))
+    assert psg.Preprocessor.hsv_at(frame, []).shape == (0, 3)